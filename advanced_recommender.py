@@ -4,7 +4,7 @@
 实现基于用户历史的智能推荐、场景标签检索、做菜助手等功能
 """
 
-from py2neo import Graph
+from graph_db import get_graph
 from typing import List, Dict, Tuple
 from collections import defaultdict
 import json
@@ -14,7 +14,7 @@ class AdvancedRecommender:
     """高级推荐系统"""
     
     def __init__(self):
-        self.g = Graph("bolt://127.0.0.1:7687", auth=("neo4j", "kurisu810975"))
+        self.g = get_graph()
         
         # 场景标签映射
         self.scene_tags = {
@@ -15,6 +15,7 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from graph_rag_system import GraphRAGSystem
 from user_manager import UserManager
 from subgraph_viewer import render_subgraph_viewer
+from vector_retriever import index_exists
 
 
 # 页面配置
@@ -234,7 +235,7 @@ def render_sidebar():
         use_deepseek = False  # 如果没有API密钥，回退到本地模式
     
     # 检查向量检索状态
-    vector_status = "✅ 已启用" if os.path.exists("data/vector_index.pkl") else "❌ 未启用"
+    vector_status = "✅ 已启用" if index_exists() else "❌ 未启用"
     st.sidebar.markdown(f"**向量检索：** {vector_status}")
     
     # LLM服务状态
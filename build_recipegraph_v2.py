@@ -352,6 +352,20 @@ class RecipeGraphBuilderV2:
         
         print("="*60)
     
+    def bump_generation(self):
+        """
+        更新图谱版本号
+        
+        使用构建时刻的毫秒时间戳而非自增计数，清空数据库后重建也不会与旧版本号重复
+        """
+        try:
+            self.g.run(
+                "MERGE (m:GraphMeta {name: 'recipegraph'}) SET m.generation = timestamp()"
+            )
+            print("  ✅ 图谱版本号已更新")
+        except Exception as e:
+            print(f"  ⚠️  图谱版本号更新失败: {e}")
+    
     def print_statistics(self):
         """打印统计信息"""
         print("\n" + "="*60)
@@ -402,7 +416,10 @@ class RecipeGraphBuilderV2:
         # 6. 创建索引
         self.create_indexes()
         
-        # 7. 打印统计
+        # 7. 更新图谱版本号（使依赖图谱快照的缓存失效）
+        self.bump_generation()
+        
+        # 8. 打印统计
         self.print_statistics()
         
         elapsed_time = time.time() - start_time
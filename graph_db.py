@@ -0,0 +1,63 @@
+# coding = utf-8
+"""
+知识图谱连接模块
+各模块共用进程内同一个py2neo Graph（内部维护Bolt连接池），
+新建检索器/推荐器/用户管理器时不再重新握手和认证
+"""
+
+import os
+import threading
+from functools import lru_cache
+from py2neo import Graph
+
+# 连接配置（环境变量，见README；未设置时使用本地默认值）
+NEO4J_URI = os.environ.get('NEO4J_URI', "bolt://127.0.0.1:7687")
+NEO4J_AUTH = (os.environ.get('NEO4J_USER', "neo4j"), os.environ.get('NEO4J_PASSWORD', "kurisu810975"))
+# 连接池上限（不设置时使用py2neo默认值；NEO4J_POOL为旧名称）
+NEO4J_POOL_SIZE = os.environ.get('NEO4J_POOL_SIZE') or os.environ.get('NEO4J_POOL')
+# 批量写入（UNWIND）每批的行数
+NEO4J_BATCH_SIZE = int(os.environ.get('NEO4J_BATCH_SIZE', 200))
+
+
+@lru_cache(maxsize=None)
+def get_graph(uri=NEO4J_URI, auth=NEO4J_AUTH):
+    """返回共享的Graph连接（按连接参数缓存，首次调用时建立）"""
+    if NEO4J_POOL_SIZE:
+        return Graph(uri, auth=auth, max_size=int(NEO4J_POOL_SIZE))
+    return Graph(uri, auth=auth)
+
+
+# 用户侧查询用到的索引（与build_recipegraph_v2.create_indexes同名，已存在时为空操作；
+# Scene节点由用户图谱模型创建，构建脚本中没有它的索引）
+USER_GRAPH_INDEXES = [
+    "CREATE INDEX user_id IF NOT EXISTS FOR (u:User) ON (u.user_id)",
+    "CREATE INDEX dish_name IF NOT EXISTS FOR (d:Dish) ON (d.name)",
+    "CREATE INDEX tag_name IF NOT EXISTS FOR (t:Tag) ON (t.name)",
+    "CREATE INDEX flavor_name IF NOT EXISTS FOR (f:Flavor) ON (f.name)",
+    "CREATE INDEX scene_name IF NOT EXISTS FOR (s:Scene) ON (s.name)",
+]
+
+_indexes_ensured = False
+_indexes_lock = threading.Lock()
+
+
+def ensure_indexes(graph=None):
+    """
+    确保用户侧查询的索引存在（每个进程只执行一次）
+    
+    MATCH (u:User {user_id: ...}) / (d:Dish {name: ...}) 以及对这些键的MERGE
+    没有索引时为整个标签的扫描
+    """
+    global _indexes_ensured
+    if _indexes_ensured:
+        return
+    with _indexes_lock:
+        if _indexes_ensured:
+            return
+        g = graph if graph is not None else get_graph()
+        for stmt in USER_GRAPH_INDEXES:
+            try:
+                g.run(stmt)
+            except Exception as e:
+                print(f"⚠️  索引创建失败: {e}")
+        _indexes_ensured = True
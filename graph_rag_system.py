@@ -6,10 +6,9 @@
 
 from typing import List, Dict, Tuple, Optional
 from collections import defaultdict
-import os
 
 try:
-    from vector_retriever import VectorRetriever, SENTENCE_TRANSFORMERS_AVAILABLE
+    from vector_retriever import VectorRetriever, SENTENCE_TRANSFORMERS_AVAILABLE, index_exists
 except ImportError:
     SENTENCE_TRANSFORMERS_AVAILABLE = False
 
@@ -36,6 +35,9 @@ class GraphRAGSystem:
             use_deepseek: 是否使用DeepSeek API
             api_key: DeepSeek API密钥
         """
+        # 启动时预热Neo4j页缓存，避免首个请求冷启动
+        PreferenceExtractor.warmup()
+        
         if use_deepseek:
             self.model = ModelAPI(use_deepseek=True, api_key=api_key)
             self.query_optimizer = QueryOptimizer(use_deepseek=True, api_key=api_key)
@@ -54,7 +56,7 @@ class GraphRAGSystem:
             try:
                 self.vector_retriever = VectorRetriever()
                 # 尝试加载索引
-                if os.path.exists("data/vector_index.pkl"):
+                if index_exists():
                     self.vector_retriever.load_index()
                     print("向量索引已加载")
                 else:
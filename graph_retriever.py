@@ -4,16 +4,20 @@
 基于Neo4j知识图谱的多跳检索
 """
 
-from py2neo import Graph
+from graph_db import get_graph
+from user_preferences import unpack_preferences
 from typing import List, Dict, Tuple, Set
 from collections import defaultdict
 
+# Cypher列表截取不接受null，不限制长度时传这个值
+_NO_LIMIT = 2 ** 31 - 1
+
 
 class GraphRetriever:
     """图谱检索器"""
     
     def __init__(self):
-        self.g = Graph("bolt://127.0.0.1:7687", auth=("neo4j", "kurisu810975"))
+        self.g = get_graph()
     
     def search_by_dish(self, dish_name, depth=1):
         """
@@ -26,15 +30,39 @@ class GraphRetriever:
         Returns:
             Dict: 包含菜品相关的所有信息
         """
-        cypher = f"""
-        MATCH path=(d:Dish {{name: $dish_name}})-[r*1..{depth}]-(n)
-        RETURN path
-        LIMIT 100
+        return self.search_by_dishes([dish_name], depth)[dish_name]
+    
+    def search_by_dishes(self, dish_names, depth=1):
+        """
+        批量菜品子图检索（UNWIND一次查询，代替逐个菜品往返）
+        
+        Args:
+            dish_names: 菜品名称列表
+            depth: 检索深度（跳数）
+        
+        Returns:
+            Dict[str, Dict]: 菜品名 -> search_by_dish格式的信息（每道菜最多取100条路径）
         """
+        names = list(dict.fromkeys(dish_names))
+        if not names:
+            return {}
         
-        result = self.g.run(cypher, dish_name=dish_name).data()
+        cypher = f"""
+        UNWIND $names AS name
+        CALL {{
+            WITH name
+            MATCH path=(d:Dish {{name: name}})-[r*1..{int(depth)}]-(n)
+            RETURN path
+            LIMIT 100
+        }}
+        RETURN name, COLLECT(path) AS paths
+        """
         
-        # 提取信息
+        paths_by_name = {row['name']: row['paths'] for row in self.g.run(cypher, names=names).data()}
+        return {name: self._dish_info_from_paths(name, paths_by_name.get(name, [])) for name in names}
+    
+    def _dish_info_from_paths(self, dish_name, paths):
+        """从以菜品为起点的路径中提取菜品信息"""
         info = {
             'dish': dish_name,
             'ingredients': [],
@@ -54,8 +82,13 @@ class GraphRetriever:
         ingredient_dict = {}
         condiment_dict = {}
         
-        for record in result:
-            path_data = record['path']
+        # 用dict做有序去重（O(1)成员判断，保留首次出现顺序）
+        tools_seen = {}
+        tags_seen = {}
+        flavors_seen = {}
+        similar_seen = {}
+        
+        for path_data in paths:
             nodes = path_data.nodes
             rels = path_data.relationships
             
@@ -87,17 +120,13 @@ class GraphRetriever:
                 name = node.get('name', '')
                 
                 if label == 'Tool' and name:
-                    if name not in info['tools']:
-                        info['tools'].append(name)
+                    tools_seen[name] = None
                 elif label == 'Tag' and name:
-                    if name not in info['tags']:
-                        info['tags'].append(name)
+                    tags_seen[name] = None
                 elif label == 'Flavor' and name:
-                    if name not in info['flavors']:
-                        info['flavors'].append(name)
+                    flavors_seen[name] = None
                 elif label == 'Dish' and name != dish_name:
-                    if name not in info['similar_dishes']:
-                        info['similar_dishes'].append(name)
+                    similar_seen[name] = None
             
             # 提取菜品属性
             for node in nodes:
@@ -106,6 +135,11 @@ class GraphRetriever:
                     info['steps'] = node.get('steps')
                     info['tips'] = node.get('tips')
         
+        info['tools'] = list(tools_seen)
+        info['tags'] = list(tags_seen)
+        info['flavors'] = list(flavors_seen)
+        info['similar_dishes'] = list(similar_seen)
+        
         # 将带用量的食材和调料转换为列表格式
         info['ingredients'] = [f"{name} {amount}".strip() if amount else name 
                                for name, amount in ingredient_dict.items()]
@@ -114,73 +148,135 @@ class GraphRetriever:
         
         return info
     
-    def search_by_ingredient(self, ingredient_name, limit=10):
+    def search_by_ingredient(self, ingredient_name, limit=10, tags_per_dish=None, flavors_per_dish=None):
         """
         根据食材查找菜品
         
         Args:
             ingredient_name: 食材名称
             limit: 返回数量限制
+            tags_per_dish: 每道菜最多返回的标签数（None不限制，在图数据库内截取）
+            flavors_per_dish: 每道菜最多返回的口味数（None不限制）
         
         Returns:
             List[Dict]: 菜品列表
         """
+        return self.search_by_ingredients([ingredient_name], limit, tags_per_dish, flavors_per_dish)[ingredient_name]
+    
+    def search_by_ingredients(self, ingredient_names, limit=10, tags_per_dish=None, flavors_per_dish=None):
+        """
+        批量根据食材查找菜品（UNWIND一次查询）
+        
+        Args:
+            ingredient_names: 食材名称列表
+            limit: 每种食材的返回数量限制
+            tags_per_dish: 每道菜最多返回的标签数（None不限制，在图数据库内截取）
+            flavors_per_dish: 每道菜最多返回的口味数（None不限制）
+        
+        Returns:
+            Dict[str, List[Dict]]: 食材名 -> 菜品列表
+        """
         cypher = """
-        MATCH (i:Ingredient {name: $ingredient})<-[:need_ingredient]-(d:Dish)
+        UNWIND $names AS name
+        MATCH (i:Ingredient {name: name})<-[:need_ingredient]-(d:Dish)
         OPTIONAL MATCH (d)-[:has_tag]->(t:Tag)
         OPTIONAL MATCH (d)-[:has_flavor]->(f:Flavor)
-        WITH d, COLLECT(DISTINCT t.name) as tags, COLLECT(DISTINCT f.name) as flavors
-        RETURN d.name as dish, d.difficulty as difficulty, tags, flavors
-        LIMIT $limit
+        WITH name, d, COLLECT(DISTINCT t.name)[..$tags_limit] as tags, COLLECT(DISTINCT f.name)[..$flavors_limit] as flavors
+        WITH name, COLLECT({dish: d.name, difficulty: d.difficulty, tags: tags, flavors: flavors})[..$limit] as dishes
+        RETURN name, dishes
         """
-        
-        result = self.g.run(cypher, ingredient=ingredient_name, limit=limit).data()
-        return result
+        return self._run_batch(cypher, ingredient_names, limit, tags_limit=tags_per_dish, flavors_limit=flavors_per_dish)
     
-    def search_by_tag(self, tag_name, limit=10):
+    def search_by_tag(self, tag_name, limit=10, tags_per_dish=None, flavors_per_dish=None):
         """
         根据标签查找菜品（包括场景标签，如：熬夜、快手菜、健身等）
         
         Args:
             tag_name: 标签名称
             limit: 返回数量限制
+            tags_per_dish: 每道菜最多返回的标签数（None不限制，在图数据库内截取）
+            flavors_per_dish: 每道菜最多返回的口味数（None不限制）
         
         Returns:
             List[Dict]: 菜品列表
         """
+        return self.search_by_tags([tag_name], limit, tags_per_dish, flavors_per_dish)[tag_name]
+    
+    def search_by_tags(self, tag_names, limit=10, tags_per_dish=None, flavors_per_dish=None):
+        """
+        批量根据标签查找菜品（UNWIND一次查询）
+        
+        Args:
+            tag_names: 标签名称列表
+            limit: 每个标签的返回数量限制
+            tags_per_dish: 每道菜最多返回的标签数（None不限制，在图数据库内截取）
+            flavors_per_dish: 每道菜最多返回的口味数（None不限制）
+        
+        Returns:
+            Dict[str, List[Dict]]: 标签名 -> 菜品列表
+        """
         cypher = """
-        MATCH (t:Tag {name: $tag})<-[:has_tag]-(d:Dish)
+        UNWIND $names AS name
+        MATCH (t:Tag {name: name})<-[:has_tag]-(d:Dish)
         OPTIONAL MATCH (d)-[:has_tag]->(t2:Tag)
         OPTIONAL MATCH (d)-[:has_flavor]->(f:Flavor)
-        WITH d, COLLECT(DISTINCT t2.name) as tags, COLLECT(DISTINCT f.name) as flavors
-        RETURN d.name as dish, d.difficulty as difficulty, tags, flavors
-        LIMIT $limit
+        WITH name, d, COLLECT(DISTINCT t2.name)[..$tags_limit] as tags, COLLECT(DISTINCT f.name)[..$flavors_limit] as flavors
+        WITH name, COLLECT({dish: d.name, difficulty: d.difficulty, tags: tags, flavors: flavors})[..$limit] as dishes
+        RETURN name, dishes
         """
-        
-        result = self.g.run(cypher, tag=tag_name, limit=limit).data()
-        return result
+        return self._run_batch(cypher, tag_names, limit, tags_limit=tags_per_dish, flavors_limit=flavors_per_dish)
     
-    def search_by_flavor(self, flavor_name, limit=10):
+    def search_by_flavor(self, flavor_name, limit=10, tags_per_dish=None):
         """
         根据口味查找菜品
         
         Args:
             flavor_name: 口味名称
             limit: 返回数量限制
+            tags_per_dish: 每道菜最多返回的标签数（None不限制，在图数据库内截取）
         
         Returns:
             List[Dict]: 菜品列表
         """
+        return self.search_by_flavors([flavor_name], limit, tags_per_dish)[flavor_name]
+    
+    def search_by_flavors(self, flavor_names, limit=10, tags_per_dish=None):
+        """
+        批量根据口味查找菜品（UNWIND一次查询）
+        
+        Args:
+            flavor_names: 口味名称列表
+            limit: 每种口味的返回数量限制
+            tags_per_dish: 每道菜最多返回的标签数（None不限制，在图数据库内截取）
+        
+        Returns:
+            Dict[str, List[Dict]]: 口味名 -> 菜品列表
+        """
         cypher = """
-        MATCH (f:Flavor {name: $flavor})<-[:has_flavor]-(d:Dish)
+        UNWIND $names AS name
+        MATCH (f:Flavor {name: name})<-[:has_flavor]-(d:Dish)
         OPTIONAL MATCH (d)-[:has_tag]->(t:Tag)
-        WITH d, COLLECT(DISTINCT t.name) as tags
-        RETURN d.name as dish, d.difficulty as difficulty, tags
-        LIMIT $limit
+        WITH name, d, COLLECT(DISTINCT t.name)[..$tags_limit] as tags
+        WITH name, COLLECT({dish: d.name, difficulty: d.difficulty, tags: tags})[..$limit] as dishes
+        RETURN name, dishes
+        """
+        return self._run_batch(cypher, flavor_names, limit, tags_limit=tags_per_dish)
+    
+    def _run_batch(self, cypher, names, limit, **field_limits):
         """
+        执行按名称UNWIND的批量查询，结果按输入名称归组（没有结果的名称对应空列表）
         
-        result = self.g.run(cypher, flavor=flavor_name, limit=limit).data()
-        return result
+        field_limits为每道菜各属性列表的截取长度参数（如tags_limit），None表示不限制
+        """
+        names = list(dict.fromkeys(names))
+        if not names:
+            return {}
+        params = {key: _NO_LIMIT if value is None else value for key, value in field_limits.items()}
+        rows = self.g.run(cypher, names=names, limit=limit, **params).data()
+        grouped = {name: [] for name in names}
+        for row in rows:
+            grouped[row['name']] = row['dishes']
+        return grouped
     
     def find_similar_dishes(self, dish_name, limit=5):
         """
@@ -234,11 +330,11 @@ class GraphRetriever:
                 if dish:
                     results.append((dish, score, features if isinstance(features, list) else [reason]))
         
-        # 去重并排序
-        dish_scores = defaultdict(lambda: {'score': 0, 'features': set()})
+        # 去重并排序（共同特征用dict保持首次出现的顺序：先食材后口味，子图截取前几个时结果稳定）
+        dish_scores = defaultdict(lambda: {'score': 0, 'features': {}})
         for dish, score, features in results:
             dish_scores[dish]['score'] += score
-            dish_scores[dish]['features'].update(features)
+            dish_scores[dish]['features'].update(dict.fromkeys(features))
         
         # 转换为列表
         final_results = [
@@ -274,17 +370,16 @@ class GraphRetriever:
         # 获取用户节点的preferences属性（包含口味、标签、食材偏好）
         user_pref_cypher = """
         MATCH (u:User {user_id: $user_id})
-        RETURN u.preferences as preferences
+        RETURN u.preferences as preferences, u.flavors as flavors, u.tags as tags, u.ingredients as ingredients
         """
         
         user_prefs = self.g.run(user_pref_cypher, user_id=user_id).data()
         
-        # 解析preferences JSON
-        import json
+        # 解析偏好（列表字段为原生属性，其余在preferences JSON中）
         preferences = {}
-        if user_prefs and user_prefs[0].get('preferences'):
+        if user_prefs:
             try:
-                preferences = json.loads(user_prefs[0]['preferences'])
+                preferences = unpack_preferences(user_prefs[0])
                 print(f"  [DEBUG] 从用户节点读取偏好: {preferences}")
             except Exception as e:
                 print(f"  [DEBUG] 解析preferences失败: {e}")
@@ -330,6 +425,31 @@ class GraphRetriever:
             'preferences': preferences
         }
     
+    def bfs_from_dish(self, dish_name, depth=2, limit=200):
+        """
+        从菜品出发的多跳遍历（在图数据库内完成，一次查询返回去重后的所有边）
+        
+        Args:
+            dish_name: 起点菜品名称
+            depth: 最大跳数（限制在1~3）
+            limit: 最多取的路径数
+        
+        Returns:
+            List[Dict]: [{'source', 'source_label', 'rel', 'target', 'target_label'}, ...]
+        """
+        depth = max(1, min(int(depth), 3))
+        cypher = f"""
+        MATCH path=(start:Dish {{name: $dish_name}})-[*1..{depth}]-(n)
+        WITH path LIMIT $limit
+        UNWIND relationships(path) AS r
+        WITH DISTINCT r
+        WITH r, startNode(r) AS s, endNode(r) AS e
+        RETURN coalesce(s.name, s.user_id) AS source, labels(s)[0] AS source_label,
+               type(r) AS rel,
+               coalesce(e.name, e.user_id) AS target, labels(e)[0] AS target_label
+        """
+        return self.g.run(cypher, dish_name=dish_name, limit=limit).data()
+    
     def multi_hop_search(self, start_nodes, relation_types, depth=2):
         """
         多跳图谱搜索
@@ -9,11 +9,62 @@
 
 import os
 import json
-import re
 from openai import OpenAI
-from typing import Dict, List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, List, Literal, Optional, Tuple
 import time
 
+
+# 标准口味（与prompt中的规则保持一致）
+Flavor = Literal['辣', '甜', '咸', '酸', '鲜', '香', '麻', '苦', '清淡']
+
+
+class Ingredient(BaseModel):
+    name: str
+    amount: str = ""
+    is_main: bool = False
+
+
+class Condiment(BaseModel):
+    name: str
+    amount: str = ""
+
+
+class Step(BaseModel):
+    step_number: int
+    description: str
+    time: Optional[str] = ""
+    temperature: Optional[str] = ""
+
+
+class Nutrition(BaseModel):
+    calories: Optional[str] = ""
+    protein: Optional[str] = ""
+    benefits: List[str] = []
+
+
+class Recipe(BaseModel):
+    """LLM输出的菜谱结构（必需字段不能为空）"""
+    name: str = Field(min_length=1)
+    category: str = ""
+    difficulty: int = Field(default=3, ge=1, le=5)
+    time: str = ""
+    desc: str = ""
+    flavors: List[Flavor] = Field(min_length=1)
+    tags: List[str] = Field(min_length=1)
+    ingredients: List[Ingredient] = Field(min_length=1)
+    condiments: List[Condiment] = []
+    tools: List[str] = []
+    steps: List[Step] = Field(min_length=1)
+    tips: List[str] = []
+    nutrition: Nutrition = Field(default_factory=Nutrition)
+
+
+class BatchRecipe(Recipe):
+    """批量解析时的单个菜谱，file_id用于对应输入文档"""
+    file_id: str
+
+
 class LLMRecipeParser:
     def __init__(self, api_key: str):
         """初始化LLM解析器"""
@@ -62,9 +113,19 @@ class LLMRecipeParser:
             }
         }
     
-    def create_extraction_prompt(self, md_content: str) -> str:
-        """创建提取prompt"""
-        prompt = f"""你是一个专业的菜谱信息提取专家。请仔细阅读以下菜谱文档，提取所有关键信息，并按照指定的JSON格式输出，其用于neo4j构建高质量知识图谱。
+    def create_extraction_prompt(self, recipes: List[Tuple[str, str]]) -> str:
+        """
+        创建提取prompt（一次可包含多篇菜谱，分摊规则和示例的token开销）
+        
+        Args:
+            recipes: [(file_id, md_content), ...]
+        """
+        documents = "\n\n".join(
+            f"===== file_id: {file_id} =====\n{md_content}"
+            for file_id, md_content in recipes
+        )
+        
+        prompt = f"""你是一个专业的菜谱信息提取专家。请仔细阅读以下{len(recipes)}篇菜谱文档，分别提取每篇的所有关键信息，并按照指定的JSON格式输出，其用于neo4j构建高质量知识图谱。
 你应该尽可能只凭借文档提取信息，例如除非文档中没有说明菜品flavors的任何信息，你才可以根据你的经验进行补充，但是补充的信息一定要准确。
 
 **重要规则：**
@@ -82,77 +143,67 @@ class LLMRecipeParser:
 7. **技巧**：提取关键的烹饪技巧、注意事项、常见错误
 
 **输出格式：**
-请严格按照以下JSON格式输出，不要添加任何其他文字：
+请严格按照以下JSON格式输出一个JSON对象，不要添加任何其他文字。recipes中每篇文档对应一个元素，file_id与文档标题中的file_id保持一致：
 
-```json
 {{
-  "name": "菜品名称",
-  "category": "",
-  "difficulty": 3,
-  "time": "30分钟",
-  "desc": "菜品简介",
-  "flavors": ["辣", "鲜"],
-  "tags": ["川菜", "下饭菜", "家常菜"],
-  "ingredients": [
-    {{"name": "主料名", "amount": "300g", "is_main": true}},
-    {{"name": "辅料名", "amount": "适量", "is_main": false}}
-  ],
-  "condiments": [
-    {{"name": "盐", "amount": "适量"}},
-    {{"name": "酱油", "amount": "15ml"}}
-  ],
-  "tools": ["炒锅", "菜刀", "砧板"],
-  "steps": [
+  "recipes": [
     {{
-      "step_number": 1,
-      "description": "具体操作描述",
-      "time": "5分钟",
-      "temperature": "大火"
+      "file_id": "文档的file_id",
+      "name": "菜品名称",
+      "category": "",
+      "difficulty": 3,
+      "time": "30分钟",
+      "desc": "菜品简介",
+      "flavors": ["辣", "鲜"],
+      "tags": ["川菜", "下饭菜", "家常菜"],
+      "ingredients": [
+        {{"name": "主料名", "amount": "300g", "is_main": true}},
+        {{"name": "辅料名", "amount": "适量", "is_main": false}}
+      ],
+      "condiments": [
+        {{"name": "盐", "amount": "适量"}},
+        {{"name": "酱油", "amount": "15ml"}}
+      ],
+      "tools": ["炒锅", "菜刀", "砧板"],
+      "steps": [
+        {{
+          "step_number": 1,
+          "description": "具体操作描述",
+          "time": "5分钟",
+          "temperature": "大火"
+        }}
+      ],
+      "tips": [
+        "技巧1：...",
+        "注意事项：..."
+      ],
+      "nutrition": {{
+        "calories": "约300卡/份",
+        "protein": "高",
+        "benefits": ["补充蛋白质", "增强免疫力"]
+      }}
     }}
-  ],
-  "tips": [
-    "技巧1：...",
-    "注意事项：..."
-  ],
-  "nutrition": {{
-    "calories": "约300卡/份",
-    "protein": "高",
-    "benefits": ["补充蛋白质", "增强免疫力"]
-  }}
+  ]
 }}
-```
 
 **菜谱文档内容：**
-{md_content}
+{documents}
 
 请开始提取并输出JSON："""
         
         return prompt
     
-    def extract_json_from_response(self, response: str) -> Optional[Dict]:
-        """从LLM响应中提取JSON"""
-        # 尝试提取```json```代码块
-        json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            # 尝试提取{}包裹的内容
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-            else:
-                return None
+    def parse_recipes_with_llm(self, recipes: List[Tuple[str, str]], retry=3) -> Dict[str, Dict]:
+        """
+        使用LLM一次解析多个菜谱
         
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError as e:
-            print(f"JSON解析错误: {e}")
-            print(f"原始响应: {response[:500]}...")
-            return None
-    
-    def parse_recipe_with_llm(self, md_content: str, retry=3) -> Optional[Dict]:
-        """使用LLM解析单个菜谱"""
-        prompt = self.create_extraction_prompt(md_content)
+        Args:
+            recipes: [(file_id, md_content), ...]
+        
+        Returns:
+            Dict[str, Dict]: {file_id: 菜谱数据}，只含校验通过的菜谱；全部重试失败时返回空字典
+        """
+        prompt = self.create_extraction_prompt(recipes)
         
         for attempt in range(retry):
             try:
@@ -163,49 +214,58 @@ class LLMRecipeParser:
                         {"role": "user", "content": prompt}
                     ],
                     temperature=0.1,  # 降低温度以获得更稳定的输出
-                    max_tokens=2000
+                    max_tokens=min(2000 * len(recipes), 8000),  # 每个菜谱约2000 token，deepseek-chat上限8K
+                    response_format={"type": "json_object"}  # JSON模式，保证输出可直接解析
                 )
                 
                 result = response.choices[0].message.content
-                recipe_data = self.extract_json_from_response(result)
-                
-                if recipe_data:
-                    # 验证必需字段
-                    if self.validate_recipe_data(recipe_data):
-                        return recipe_data
-                    else:
-                        print(f"数据验证失败，重试 {attempt + 1}/{retry}")
-                else:
-                    print(f"JSON提取失败，重试 {attempt + 1}/{retry}")
-                
+                # 外层结构无效（非JSON、缺少recipes列表）时整批重试
+                items = json.loads(result).get('recipes')
+                if not isinstance(items, list):
+                    raise ValueError("输出缺少recipes列表")
+            except (ValueError, AttributeError) as e:  # json.JSONDecodeError是ValueError的子类
+                print(f"JSON解析失败: {e}，重试 {attempt + 1}/{retry}")
                 time.sleep(1)  # 避免API限流
-                
+                continue
             except Exception as e:
                 print(f"API调用失败: {e}，重试 {attempt + 1}/{retry}")
                 time.sleep(2)
+                continue
+            
+            # 逐个校验必需字段/标准口味：只丢弃无效的菜谱，其余照常返回（缺失的由调用方单独重新解析）
+            parsed = {}
+            for item in items:
+                try:
+                    recipe = BatchRecipe.model_validate(item)
+                except ValidationError as e:
+                    file_id = item.get('file_id') if isinstance(item, dict) else None
+                    print(f"数据验证失败: {file_id}（{e.error_count()}处错误）")
+                    continue
+                parsed[recipe.file_id] = recipe.model_dump(exclude={'file_id'})
+            
+            # 单个菜谱解析失败时重试（成本只有一个菜谱）；多个菜谱的批次不因个别无效项整批重发
+            if parsed or len(recipes) > 1:
+                return parsed
+            print(f"数据验证失败，重试 {attempt + 1}/{retry}")
+            time.sleep(1)
         
-        return None
+        return {}
     
-    def validate_recipe_data(self, data: Dict) -> bool:
-        """验证提取的数据是否完整"""
-        required_fields = ['name', 'flavors', 'tags', 'ingredients', 'steps']
-        
-        for field in required_fields:
-            if field not in data or not data[field]:
-                print(f"缺少必需字段: {field}")
-                return False
-        
-        # 验证口味是否在标准列表中
-        valid_flavors = ['辣', '甜', '咸', '酸', '鲜', '香', '麻', '苦', '清淡']
-        for flavor in data.get('flavors', []):
-            if flavor not in valid_flavors:
-                print(f"非标准口味: {flavor}")
-                # 不返回False，只是警告
-        
-        return True
+    def parse_recipe_with_llm(self, md_content: str, retry=3) -> Optional[Dict]:
+        """使用LLM解析单个菜谱"""
+        return self.parse_recipes_with_llm([('0', md_content)], retry=retry).get('0')
     
-    def parse_all_recipes(self, dishes_dir: str, output_path: str, start_from: int = 0):
-        """批量解析所有菜谱"""
+    def parse_all_recipes(self, dishes_dir: str, output_path: str, start_from: int = 0,
+                          batch_size: int = 4):
+        """
+        批量解析所有菜谱
+        
+        Args:
+            dishes_dir: 菜谱MD目录
+            output_path: 输出JSON文件路径
+            start_from: 断点续传的起始文件序号
+            batch_size: 每次LLM调用包含的菜谱数量
+        """
         print("="*60)
         print("开始使用LLM解析菜谱...")
         print(f"输入目录: {dishes_dir}")
@@ -239,51 +299,69 @@ class LLMRecipeParser:
         failed_files = []
         
         with open(output_path, mode, encoding='utf-8') as f:
-            for idx, md_path in enumerate(all_md_files[start_from:], start=start_from):
-                filename = os.path.basename(md_path)
-                print(f"\n[{idx+1}/{len(all_md_files)}] 解析: {filename}")
+            for chunk_start in range(start_from, len(all_md_files), batch_size):
+                chunk = []
+                for idx, md_path in enumerate(all_md_files[chunk_start:chunk_start + batch_size], start=chunk_start):
+                    filename = os.path.basename(md_path)
+                    try:
+                        # 读取MD文件
+                        with open(md_path, 'r', encoding='utf-8') as mf:
+                            md_content = mf.read()
+                        # 以相对路径作为file_id，与LLM输出对应
+                        rel_path = os.path.relpath(md_path, dishes_dir)
+                        chunk.append((idx, rel_path, md_content))
+                    except Exception as e:
+                        failed_count += 1
+                        failed_files.append(filename)
+                        print(f"❌ 异常: {filename} - {e}")
                 
-                try:
-                    # 读取MD文件
-                    with open(md_path, 'r', encoding='utf-8') as mf:
-                        md_content = mf.read()
-                    
-                    # 从文件路径提取category（只取一级目录）
-                    rel_path = os.path.relpath(md_path, dishes_dir)
-                    path_parts = rel_path.split(os.sep)
-                    category_folder = path_parts[0] if len(path_parts) > 0 else ''
-                    
-                    # 使用LLM解析
-                    recipe_data = self.parse_recipe_with_llm(md_content)
+                print(f"\n[{chunk_start+1}-{chunk_start+len(chunk)}/{len(all_md_files)}] 批量解析 {len(chunk)} 个菜谱")
+                
+                # 使用LLM批量解析
+                parsed = {}
+                if len(chunk) > 1:
+                    parsed = self.parse_recipes_with_llm([(rel_path, md_content) for _, rel_path, md_content in chunk])
+                
+                for idx, rel_path, md_content in chunk:
+                    filename = os.path.basename(rel_path)
                     
-                    if recipe_data:
-                        # 设置category为文件夹名
-                        recipe_data['category'] = category_folder
+                    try:
+                        recipe_data = parsed.get(rel_path)
+                        if recipe_data is None:
+                            # 批量结果中缺失（或批量失败）时退化为单个解析，避免一个坏文件拖累整批
+                            if len(chunk) > 1:
+                                print(f"   退化为单个解析: {filename}")
+                            recipe_data = self.parse_recipe_with_llm(md_content)
                         
-                        # 写入文件
-                        f.write(json.dumps(recipe_data, ensure_ascii=False) + '\n')
-                        f.flush()  # 立即写入磁盘
-                        
-                        success_count += 1
-                        print(f"✅ 成功: {recipe_data['name']}")
-                        print(f"   口味: {', '.join(recipe_data.get('flavors', []))}")
-                        print(f"   标签: {', '.join(recipe_data.get('tags', []))}")
-                    else:
+                        if recipe_data:
+                            # 设置category为文件夹名（只取一级目录）
+                            path_parts = rel_path.split(os.sep)
+                            recipe_data['category'] = path_parts[0] if len(path_parts) > 0 else ''
+                            
+                            # 写入文件
+                            f.write(json.dumps(recipe_data, ensure_ascii=False) + '\n')
+                            f.flush()  # 立即写入磁盘
+                            
+                            success_count += 1
+                            print(f"✅ 成功: {recipe_data['name']}")
+                            print(f"   口味: {', '.join(recipe_data.get('flavors', []))}")
+                            print(f"   标签: {', '.join(recipe_data.get('tags', []))}")
+                        else:
+                            failed_count += 1
+                            failed_files.append(filename)
+                            print(f"❌ 失败: {filename}")
+                    
+                    except Exception as e:
                         failed_count += 1
                         failed_files.append(filename)
-                        print(f"❌ 失败: {filename}")
+                        print(f"❌ 异常: {filename} - {e}")
                     
                     # 每10个菜谱显示一次进度
                     if (idx + 1) % 10 == 0:
                         print(f"\n--- 进度: {idx+1}/{len(all_md_files)}, 成功: {success_count}, 失败: {failed_count} ---")
-                    
-                    # API限流控制
-                    time.sleep(0.5)
-                    
-                except Exception as e:
-                    failed_count += 1
-                    failed_files.append(filename)
-                    print(f"❌ 异常: {filename} - {e}")
+                
+                # API限流控制
+                time.sleep(0.5)
         
         # 输出统计信息
         print("\n" + "="*60)
@@ -305,8 +383,10 @@ class LLMRecipeParser:
 
 def main():
     """主函数"""
-    # 配置
-    API_KEY = "sk-c3c8709965474f6f908d0d11d849d2a6"  # 请替换为你的DeepSeek API Key
+    # 配置（API Key从环境变量读取，不要写入源码）
+    API_KEY = os.environ.get('DEEPSEEK_API_KEY')
+    if not API_KEY:
+        raise RuntimeError("请设置环境变量 DEEPSEEK_API_KEY，例如：export DEEPSEEK_API_KEY=your_api_key_here")
     
     cur_dir = os.path.dirname(os.path.abspath(__file__))
     project_dir = os.path.dirname(cur_dir)
@@ -318,7 +398,7 @@ def main():
     
     # 解析所有菜谱
     # start_from参数可用于断点续传
-    parser.parse_all_recipes(dishes_dir, output_path, start_from=0)
+    parser.parse_all_recipes(dishes_dir, output_path, start_from=0, batch_size=4)
 
 
 if __name__ == '__main__':
@@ -1,9 +1,90 @@
 # coding = utf-8
 import os
 import re
+import asyncio
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import json
-import time
+
+try:
+    import h2  # httpx的HTTP/2支持依赖h2包
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+
+
+@functools.lru_cache(maxsize=4)
+def _deepseek_http(api_key):
+    """进程内按api_key共享的httpx连接池（OpenAI SDK与原始SSE请求共用）"""
+    # HTTP/2下多个并发流式请求复用同一个TLS连接
+    return httpx.Client(
+        http2=HTTP2_AVAILABLE,
+        base_url=DEEPSEEK_BASE_URL,
+        headers={"Authorization": f"Bearer {api_key}"},
+        limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=30),
+        timeout=60
+    )
+
+
+@functools.lru_cache(maxsize=4)
+def _deepseek_client(api_key):
+    """
+    进程内按api_key共享的DeepSeek客户端
+    
+    即使调用方每次请求都新建ModelAPI，也只有一个连接池；首次创建时后台预热连接
+    """
+    from openai import OpenAI
+    # 显式传入共享的httpx.Client，使预热建立的连接留在连接池中被后续请求复用
+    client = OpenAI(
+        api_key=api_key,
+        base_url=DEEPSEEK_BASE_URL,
+        http_client=_deepseek_http(api_key)
+    )
+    _prewarm(client)
+    return client
+
+
+def _prewarm(client):
+    """后台预热TCP+TLS连接，首个查询无需再等待握手"""
+    def _warm():
+        try:
+            client.models.list()
+        except Exception as e:
+            print(f"[DEBUG] DeepSeek连接预热失败: {e}")
+    
+    threading.Thread(target=_warm, daemon=True).start()
+
+
+@functools.lru_cache(maxsize=1)
+def _local_session():
+    """进程内共享的本地服务会话（复用连接池，避免每次请求重新建立TCP连接）"""
+    session = requests.Session()
+    # 有限次数的指数退避重试（0.3s, 0.6s, 1.2s...），遵循Retry-After
+    retry = Retry(
+        total=5,
+        backoff_factor=0.3,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["POST"],
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 class ModelAPI():
@@ -24,15 +105,15 @@ class ModelAPI():
             api_key: DeepSeek API密钥（如果use_deepseek=True）
         """
         self.use_deepseek = use_deepseek
+        self._aclient = None  # 异步客户端（懒加载，见_get_aclient）
+        self._cache = OrderedDict()  # 响应缓存：(query, history) -> (answer, new_history)，LRU淘汰
+        self._cache_size = 256
         
         if use_deepseek:
             # 使用DeepSeek API
+            self.api_key = api_key or os.environ.get('DEEPSEEK_API_KEY')
             try:
-                from openai import OpenAI
-                self.client = OpenAI(
-                    api_key=api_key or os.environ.get('DEEPSEEK_API_KEY'),
-                    base_url="https://api.deepseek.com"
-                )
+                self.client = _deepseek_client(self.api_key)
                 print("✅ 已连接到DeepSeek API")
             except ImportError:
                 print("❌ 错误：请先安装OpenAI SDK: pip install openai")
@@ -41,18 +122,55 @@ class ModelAPI():
                 print(f"❌ DeepSeek API初始化失败: {e}")
                 raise
         else:
-            # 使用本地模拟服务
+            # 使用本地模拟服务（进程内共享会话）
             self.url = MODEL_URL
+            self.session = _local_session()
             print(f"✅ 已连接到本地LLM服务: {MODEL_URL}")
 
+    def close(self):
+        """释放本地服务的共享连接池（之后新建的实例会重新创建会话）"""
+        session = getattr(self, 'session', None)
+        if session is not None:
+            session.close()
+            _local_session.cache_clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """释放异步客户端的连接池"""
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+    def _get_aclient(self):
+        """获取共享的异步客户端（需在事件循环内首次创建）"""
+        if self._aclient is None and not self.use_deepseek:
+            # 本地模拟服务：keep-alive连接池，超时与send_request一致
+            self._aclient = httpx.AsyncClient(
+                timeout=httpx.Timeout(60.0, connect=3.0),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=30)
+            )
+        elif self._aclient is None:
+            self._aclient = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                base_url=DEEPSEEK_BASE_URL,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30)
+            )
+        return self._aclient
+
     def send_request(self, message, history):
         """发送请求到本地模拟服务"""
-        data = json.dumps({"message": message, "history": history})
-        headers = {'Content-Type': 'application/json'}
         try:
-            res = requests.post(self.url, data=data, headers=headers)
-            predict = json.loads(res.text)["output"][0]
-            history = json.loads(res.text)["history"]
+            res = self.session.post(self.url, json={"message": message, "history": history}, timeout=(3, 60))
+            result = res.json()
+            predict = result["output"][0]
+            history = result["history"]
             return predict, history
         except Exception as e:
             print("request error", e)
@@ -77,23 +195,8 @@ class ModelAPI():
         else:
             # 非流式模式：返回完整答案
             try:
-                # 构建消息列表
-                messages = self._build_messages(query, history)
-                
-                # 调用DeepSeek API
-                response = self.client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=messages,
-                    stream=True,
-                    temperature=0.7,
-                    max_tokens=2000
-                )
-                
-                # 收集完整响应
-                answer = ""
-                for chunk in response:
-                    if chunk.choices[0].delta.content is not None:
-                        answer += chunk.choices[0].delta.content
+                # 收集完整响应（先放入列表再一次性拼接，避免逐token字符串拼接）
+                answer = "".join(self._iter_sse(query, history))
                 
                 # 更新历史
                 new_history = history + [
@@ -135,29 +238,13 @@ class ModelAPI():
     def _chat_stream_generator(self, query, history):
         """流式生成器（独立方法，避免try-except中的yield问题）"""
         try:
-            # 构建消息列表
-            messages = self._build_messages(query, history)
-            
             print(f"[DEBUG] 开始流式生成，查询长度: {len(query)}")
             
-            # 调用DeepSeek API
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                stream=True,
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
-            print(f"[DEBUG] API 调用成功，开始接收流式响应")
-            
             # 流式返回
             token_count = 0
-            for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    content = chunk.choices[0].delta.content
-                    token_count += 1
-                    yield content
+            for content in self._iter_sse(query, history):
+                token_count += 1
+                yield content
             
             print(f"[DEBUG] 流式生成完成，共 {token_count} 个 token")
             
@@ -168,6 +255,47 @@ class ModelAPI():
             traceback.print_exc()
             yield error_msg
     
+    def _stream_payload(self, query, history):
+        """流式对话请求体"""
+        return {
+            "model": "deepseek-chat",
+            "messages": self._build_messages(query, history),
+            "stream": True,
+            "temperature": 0.7,
+            "max_tokens": 2000
+        }
+    
+    @staticmethod
+    def _sse_content(line):
+        """
+        解析一行SSE，只取增量文本
+        
+        Returns:
+            str: 增量文本（可能为空串）；None表示流结束
+        """
+        if not line.startswith("data:"):
+            return ""
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return None
+        return _json_loads(data)["choices"][0]["delta"].get("content") or ""
+    
+    def _iter_sse(self, query, history):
+        """
+        直接读取原始SSE流（同步）
+        
+        绕过OpenAI SDK对每个chunk的pydantic模型校验，只解析content字段
+        """
+        http = _deepseek_http(self.api_key)
+        with http.stream("POST", "/chat/completions", json=self._stream_payload(query, history)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                content = self._sse_content(line)
+                if content is None:
+                    break
+                if content:
+                    yield content
+    
     def _stream_response(self, response, query, history):
         """
         流式响应生成器
@@ -175,12 +303,12 @@ class ModelAPI():
         Yields:
             每个token的内容
         """
-        full_answer = ""
+        parts = []
         try:
             for chunk in response:
                 if chunk.choices[0].delta.content is not None:
                     content = chunk.choices[0].delta.content
-                    full_answer += content
+                    parts.append(content)
                     yield content
             
             # 流结束后，更新历史（通过特殊标记）
@@ -189,6 +317,105 @@ class ModelAPI():
         except Exception as e:
             yield f"\n\n❌ 流式传输错误: {str(e)}"
 
+    def achat(self, query, history=[], stream=False):
+        """
+        异步对话接口
+        
+        Args:
+            query: 用户查询
+            history: 对话历史
+            stream: 是否使用流式生成（仅DeepSeek支持）
+        
+        Returns:
+            如果stream=False: 协程，await后得到(answer, new_history)
+            如果stream=True: 异步生成器，async for每个token
+        """
+        if not self.use_deepseek:
+            if stream:
+                raise NotImplementedError("本地模拟服务不支持流式生成")
+            return self._asend_request([{"role": "user", "content": query}], history)
+        
+        if stream:
+            return self._achat_stream_generator(query, history)
+        return self._achat_complete(query, history)
+    
+    async def _asend_request(self, message, history):
+        """异步发送请求到本地模拟服务（返回值与send_request一致）"""
+        try:
+            res = await self._get_aclient().post(self.url, json={"message": message, "history": history})
+            result = res.json()
+            return result["output"][0], result["history"]
+        except Exception as e:
+            print("request error", e)
+            return "", []
+    
+    async def _achat_stream_generator(self, query, history):
+        """异步流式生成器（直接解析SSE增量）"""
+        payload = self._stream_payload(query, history)
+        async with self._get_aclient().stream("POST", "/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                content = self._sse_content(line)
+                if content is None:
+                    break
+                if content:
+                    yield content
+    
+    async def _achat_complete(self, query, history):
+        """异步获取完整答案"""
+        try:
+            answer = "".join([token async for token in self._achat_stream_generator(query, history)])
+        except Exception as e:
+            print(f"DeepSeek API异步调用失败: {e}")
+            return f"抱歉，API调用失败：{str(e)}", history
+        
+        new_history = history + [
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": answer}
+        ]
+        return answer, new_history
+    
+    async def abatch(self, queries, concurrency=8):
+        """
+        并发执行多个独立查询（信号量限制并发数）
+        
+        Args:
+            queries: 查询列表
+            concurrency: 最大并发请求数
+        
+        Returns:
+            List[Tuple[str, list]]: 与queries顺序一致的(answer, history)列表
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _one(query):
+            async with semaphore:
+                return await self.achat(query, [])
+        
+        return await asyncio.gather(*(_one(q) for q in queries))
+
+    def chat_batch(self, queries, concurrency=8):
+        """
+        批量对话（同步接口），用于离线批量生成等场景
+        
+        Args:
+            queries: 查询列表（彼此独立，不共享历史）
+            concurrency: 最大并发请求数（仅DeepSeek）
+        
+        Returns:
+            List[Tuple[str, list]]: 与queries顺序一致的(answer, history)列表
+        """
+        if not self.use_deepseek:
+            # 本地模拟服务逐个同步调用（走session上的重试和响应缓存）
+            return [self.chat(query, []) for query in queries]
+        
+        async def _run():
+            # 退出时关闭异步客户端，它不能跨事件循环复用
+            async with self:
+                return await self.abatch(queries, concurrency=concurrency)
+        
+        return asyncio.run(_run())
+
     def chat(self, query, history=[], stream=False):
         """
         统一的对话接口
@@ -202,27 +429,41 @@ class ModelAPI():
             如果stream=False: (response, history): 回答和更新后的历史
             如果stream=True: 生成器，yield每个token
         """
+        key = self._cache_key(query, history)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            answer, new_history = cached
+            if stream:
+                return iter([answer])
+            return answer, list(new_history)
+        
         if self.use_deepseek:
-            # 使用DeepSeek API
-            return self.chat_with_deepseek(query, history, stream=stream)
+            # 使用DeepSeek API（流式结果不缓存，保持生成器语义）
+            if stream:
+                return self.chat_with_deepseek(query, history, stream=True)
+            answer, new_history = self.chat_with_deepseek(query, history)
         else:
-            # 使用本地模拟服务（带重试机制，不支持流式）
+            # 使用本地模拟服务（重试由session上的Retry适配器完成，不支持流式）
             if stream:
                 raise NotImplementedError("本地模拟服务不支持流式生成")
             
             message = [{"role": "user", "content": query}]
-            count = 0
-            response = ''
-            while count <= 10:
-                try:
-                    count += 1
-                    response, history = self.send_request(message, history)
-                    if response:
-                        return response, history
-                except Exception as e:
-                    print('Exception:', e)
-                    time.sleep(1)
-            return response, history
+            answer, new_history = self.send_request(message, history)
+        
+        # 只缓存成功的回答（失败时answer为空或history未更新）
+        if answer and new_history is not history:
+            self._cache[key] = (answer, list(new_history))
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        
+        return answer, new_history
+    
+    @staticmethod
+    def _cache_key(query, history):
+        """响应缓存的键：query与history的内容摘要"""
+        raw = query + "|" + json.dumps(history, sort_keys=True, ensure_ascii=False)
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).digest()
 
 
 if __name__ == '__main__':
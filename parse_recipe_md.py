@@ -2,10 +2,162 @@
 # coding: utf-8
 # File: parse_recipe_md.py
 # Date: 2025-11-17
+# 解析函数带完整类型注解，可选用mypyc编译为C扩展（纯Python导入不受影响）：
+#   pip install mypy && mypyc --ignore-missing-imports parse_recipe_md.py
 
 import os
 import re
 import json
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 预编译的正则（导入时编译一次，避免逐行查找re内部缓存）
+_RE_TITLE_HOWTO = re.compile(r'^#\s+(.+?)的做法', re.MULTILINE)
+_RE_TITLE = re.compile(r'^#\s+(.+)', re.MULTILINE)
+_RE_DIFFICULTY = re.compile(r'预估烹饪难度：(★+)')
+_RE_SECTION_HEADER = re.compile(r'^## (.*)$', re.MULTILINE)
+_RE_LIST_PREFIX = re.compile(r'^[-*]\s+')
+_RE_COLON = re.compile(r'^([^：:]+)[：:](.+)$')
+_RE_PAREN = re.compile(r'\（[^）]+\）|\([^)]+\)')
+_RE_PAREN_MIXED = re.compile(r'[（(][^）)]+[）)]')
+_RE_COMMA = re.compile(r'[，,]')
+_RE_ITEM_SEP = re.compile(r'[、，,]')
+_RE_AMOUNT_SKIP = re.compile(
+    r'^(?:每\s*\d*\s*份[：:：。]'  # 如：每 2 份：
+    r'|每次制作.*[：:。]'
+    r'|一份.*[：:。]'
+    r'|总量[：:：。]'
+    r'|按照.*[：:。]'
+    r'|以下.*[：:。])'
+)
+_RE_AMOUNT_EQ = re.compile(r'^(.+?)\s*[=＝]\s*(.+)$')
+_RE_AMOUNT_SPACED = re.compile(r'^([^\s]+(?:\s+[^\s]+)?)\s{2,}(.+)$')
+_RE_HAS_QUANTITY = re.compile(r'\d+|一|二|三|四|五|六|七|八|九|十|[几若干适量少许]')
+_RE_NUMERAL_ONLY = re.compile(r'^[\d一二三四五六七八九十]+$')
+_RE_IMAGE = re.compile(r'!\[')
+_RE_LINK = re.compile(r'\[([^\]]+)\]\([^\)]+\)')
+_RE_URL = re.compile(r'https?://')
+
+# 原料部分：原始行的跳过条件合并为一个正则
+#   Markdown标题/引用块、以冒号结尾的小标题行、整行小标题文字
+_SECTION_LABELS = frozenset(['原料', '工具', '调味料', '食材'])
+_RE_LINE_SKIP = re.compile(
+    r'^[#>]'
+    r'|[：:]$'
+    r'|^(?:' + '|'.join(map(re.escape, sorted(_SECTION_LABELS))) + r')$'
+)
+# 原料部分：去括号后条目的跳过条件合并为一个正则
+#   单个非中文字符、HTML注释/感叹号开头、纯符号、以数量开头（如"10g 吉利丁"，应归入amounts）
+_RE_ITEM_SKIP = re.compile(
+    r'^[^\u4e00-\u9fa5]$'
+    r'|^(?:<!--|!)'
+    r'|^[!@#$%^&*\(\)\-\+=\[\]{}|\\:;"\'<>,.?/~`]+$'
+    r'|^\d+[\d\.\s]*(?:g|kg|ml|L|cm|厘米|毫升|升)'
+)
+# 原料部分：说明性文字关键词（合并为一个正则，一次扫描）
+_RE_INGREDIENT_SKIP = re.compile('|'.join(map(re.escape, [
+    '图片', '示例', '成品', '注意', '建议', '推荐',
+    '材料都是', '计算得出', '可额外',
+    '必备', '以下', '按照', '依照', '过程', '不要太', '温度',
+    '在这里', '下列', '下面的', '可根据', '根据自己', '供有',
+    '配料放入', '配料洗净', '食材原料', '口味偏好', '快速判断'
+])))
+# 计算部分：说明句子关键词及句内标点
+_RE_AMOUNT_NOTE = re.compile('|'.join(map(re.escape, [
+    '注意', '建议', '推荐', '可以', '需要', '理论上', '默认',
+    '使用上述', '依口味', '按比例', '计划做', '正好够'
+])))
+_RE_SENTENCE_PUNCT = re.compile('[。！，、]')
+
+
+def _encode_recipe(recipe):
+    """把一个菜谱编码为一行JSON（UTF-8字节，含换行）"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(recipe) + b'\n'
+    return (json.dumps(recipe, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def _iter_md_files(path):
+    """
+    递归列出菜谱MD文件（排除README.md）
+    
+    os.scandir的DirEntry自带文件类型，省去os.walk对每个条目的额外stat；
+    遍历顺序与os.walk一致：先当前目录的文件，再依次进入子目录（不跟随目录符号链接）
+    """
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return
+    
+    subdirs = []
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            if not entry.is_symlink():
+                subdirs.append(entry.path)
+        elif entry.name.endswith('.md') and entry.name != 'README.md':
+            yield entry.path
+    
+    for subdir in subdirs:
+        yield from _iter_md_files(subdir)
+
+
+# 工作进程内的解析器实例（每个进程只构建一次关键词表）
+_worker_parser = None
+
+
+def _init_worker(dishes_dir):
+    global _worker_parser
+    _worker_parser = RecipeParser(dishes_dir)
+
+
+def _parse_one(task):
+    """在工作进程中解析单个MD文件，返回(md_path, recipe_data, error)"""
+    md_path, category = task
+    try:
+        return md_path, _worker_parser.parse_single_recipe(md_path, category), None
+    except Exception as e:
+        return md_path, None, str(e)
+
+
+def _parse_chunk(task):
+    """
+    在工作进程中解析一批MD文件，结果直接写入该批的NDJSON分片，不回传菜谱数据
+    
+    Returns:
+        (成功数, 问题列表[(md_path, error)])，error为None表示解析为空
+    """
+    chunk, shard_path = task
+    count = 0
+    problems = []
+    with open(shard_path, 'wb', buffering=1 << 20) as f:
+        for md_path, category in chunk:
+            _, recipe_data, error = _parse_one((md_path, category))
+            if recipe_data:
+                f.write(_encode_recipe(recipe_data))
+                count += 1
+            else:
+                problems.append((md_path, error))
+    return count, problems
+
 
 class RecipeParser:
     def __init__(self, dishes_dir):
@@ -45,62 +197,193 @@ class RecipeParser:
             '凉拌': '拌', '水煮': '煮', '油炸': '炸', '小炒': '炒'
         }
         
-    def parse_all_recipes(self):
-        """遍历所有MD文件（递归遍历所有子目录）"""
-        print("开始解析菜谱文档...")
-        print(f"扫描目录: {self.dishes_dir}\n")
+        # 烹饪方法：长词优先的单一交替正则，一次扫描菜名+步骤
+        # 名次取该词所含关键词在字典中的最早位置（如"凉拌"含"拌"），与逐词检查的输出顺序一致
+        keywords = list(self.method_keywords)
+        self._method_re = re.compile('|'.join(
+            re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+        self._method_rank = {
+            k: min(i for i, sub in enumerate(keywords) if sub in k) for k in keywords
+        }
         
-        count = 0
-        failed = 0
-        all_md_files = []
+        # 食材/工具/调料分类自动机：一次扫描得到条目命中的所有类别
+        self._classifier = self._build_classifier()
         
-        # 收集所有MD文件
-        for root, dirs, files in os.walk(self.dishes_dir):
-            for file in files:
-                if file.endswith('.md') and file != 'README.md':
-                    md_path = os.path.join(root, file)
-                    all_md_files.append(md_path)
+    def _build_classifier(self):
+        """用三类关键词构建Aho-Corasick自动机（未安装pyahocorasick时返回None）"""
+        if not AHOCORASICK_AVAILABLE:
+            return None
         
-        print(f"发现 {len(all_md_files)} 个MD文件\n")
+        word_categories = {}
+        for category, keywords in (('main', self.main_ingredient_keywords),
+                                   ('tool', self.tool_keywords),
+                                   ('condiment', self.condiment_keywords)):
+            for word in keywords:
+                word_categories.setdefault(word, set()).add(category)
         
-        # 解析每个文件
-        for md_path in all_md_files:
-            # 获取分类（从dishes/后的第一级目录）
-            rel_path = os.path.relpath(md_path, self.dishes_dir)
-            category = rel_path.split(os.sep)[0]
-            
-            try:
-                recipe_data = self.parse_single_recipe(md_path, category)
-                if recipe_data:
+        automaton = ahocorasick.Automaton()
+        for word, categories in word_categories.items():
+            automaton.add_word(word, frozenset(categories))
+        automaton.make_automaton()
+        return automaton
+    
+    def classify_item(self, item: str) -> str:
+        """
+        对原料条目分类（优先级：主要食材 > 工具 > 调料 > 其他食材）
+        
+        Returns:
+            str: 'ingredient' / 'tool' / 'condiment'
+        """
+        if self._classifier is not None:
+            categories = set()
+            for _, cats in self._classifier.iter(item):
+                categories |= cats
+            is_main = 'main' in categories
+            is_tool = 'tool' in categories
+            is_condiment = 'condiment' in categories
+        else:
+            is_main = any(k in item for k in self.main_ingredient_keywords)
+            is_tool = any(k in item for k in self.tool_keywords)
+            is_condiment = any(k in item for k in self.condiment_keywords)
+        
+        if is_main:
+            return 'ingredient'
+        if is_tool:
+            return 'tool'
+        if is_condiment:
+            return 'condiment'
+        # 默认归类为食材
+        return 'ingredient'
+    
+    def parse_all_recipes(self, workers=None):
+        """
+        遍历所有MD文件（递归遍历所有子目录），多进程并行解析
+        
+        Args:
+            workers: 进程数，默认为CPU核数
+        """
+        count = 0
+        failed = 0
+        tasks = self._collect_tasks()
+        
+        # 每个文件互相独立且解析是CPU密集型，按进程并行
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 initializer=_init_worker,
+                                 initargs=(self.dishes_dir,)) as executor:
+            for md_path, recipe_data, error in executor.map(_parse_one, tasks, chunksize=16):
+                if error is not None:
+                    failed += 1
+                    print(f"❌ 解析失败 {os.path.basename(md_path)}: {error}")
+                elif recipe_data:
                     self.recipes.append(recipe_data)
                     count += 1
                     if count % 50 == 0:
-                        print(f"已解析 {count}/{len(all_md_files)} 个菜谱...")
+                        print(f"已解析 {count}/{len(tasks)} 个菜谱...")
                 else:
                     failed += 1
                     print(f"⚠️  解析为空: {os.path.basename(md_path)}")
-            except Exception as e:
-                failed += 1
-                print(f"❌ 解析失败 {os.path.basename(md_path)}: {e}")
         
+        self._print_summary(count, failed, len(tasks))
+        return self.recipes
+    
+    def parse_all_to_json(self, output_path, workers=None, chunk_size=50):
+        """
+        多进程解析所有MD文件并直接写出recipes.json（不在内存中累积self.recipes）
+        
+        每批文件由工作进程写入各自的NDJSON分片，父进程按批次顺序拼接分片，
+        输出顺序与parse_all_recipes + save_to_json一致
+        
+        Args:
+            output_path: 输出文件路径
+            workers: 进程数，默认为CPU核数
+            chunk_size: 每个分片包含的MD文件数
+        
+        Returns:
+            成功解析的菜谱数
+        """
+        count = 0
+        failed = 0
+        tasks = self._collect_tasks()
+        
+        output_dir = os.path.dirname(output_path)
+        os.makedirs(output_dir, exist_ok=True)
+        # 分片放在输出目录下，拼接时不跨文件系统
+        shard_dir = tempfile.mkdtemp(prefix='.recipe_shards_', dir=output_dir)
+        try:
+            shard_paths = []
+            chunk_tasks = []
+            for i in range(0, len(tasks), chunk_size):
+                shard_path = os.path.join(shard_dir, f'shard_{i // chunk_size:05d}.ndjson')
+                shard_paths.append(shard_path)
+                chunk_tasks.append((tasks[i:i + chunk_size], shard_path))
+            
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                     initializer=_init_worker,
+                                     initargs=(self.dishes_dir,)) as executor:
+                for chunk_count, problems in executor.map(_parse_chunk, chunk_tasks):
+                    count += chunk_count
+                    failed += len(problems)
+                    for md_path, error in problems:
+                        if error is not None:
+                            print(f"❌ 解析失败 {os.path.basename(md_path)}: {error}")
+                        else:
+                            print(f"⚠️  解析为空: {os.path.basename(md_path)}")
+                    print(f"已解析 {count}/{len(tasks)} 个菜谱...")
+            
+            with open(output_path, 'wb') as out:
+                for shard_path in shard_paths:
+                    with open(shard_path, 'rb') as shard:
+                        shutil.copyfileobj(shard, out, 1 << 20)
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        
+        self._print_summary(count, failed, len(tasks))
+        print(f"数据已保存到: {output_path}")
+        return count
+    
+    def _collect_tasks(self):
+        """收集所有MD文件，返回[(md_path, 分类)]"""
+        print("开始解析菜谱文档...")
+        print(f"扫描目录: {self.dishes_dir}\n")
+        
+        # 收集所有MD文件
+        all_md_files = list(_iter_md_files(self.dishes_dir))
+        
+        print(f"发现 {len(all_md_files)} 个MD文件\n")
+        
+        # 获取分类（从dishes/后的第一级目录）
+        return [
+            (md_path, os.path.relpath(md_path, self.dishes_dir).split(os.sep)[0])
+            for md_path in all_md_files
+        ]
+    
+    @staticmethod
+    def _print_summary(count, failed, total):
         print(f"\n{'='*60}")
         print(f"解析完成！")
         print(f"成功: {count} 个")
         print(f"失败: {failed} 个")
-        print(f"总计: {len(all_md_files)} 个MD文件")
+        print(f"总计: {total} 个MD文件")
         print(f"{'='*60}\n")
-        
-        return self.recipes
     
-    def parse_single_recipe(self, md_path, category):
+    @staticmethod
+    def read_markdown(md_path: str) -> str:
+        """无缓冲二进制一次读入再解码，省去文本层的逐块解码和拷贝"""
+        with open(md_path, 'rb', buffering=0) as f:
+            content = f.readall().decode('utf-8')
+        # 与文本模式的通用换行一致：统一为\n
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+        return content
+    
+    def parse_single_recipe(self, md_path: str, category: str) -> Optional[Dict]:
         """解析单个MD文件"""
-        with open(md_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = self.read_markdown(md_path)
         
         # 提取菜名
-        name_match = re.search(r'^#\s+(.+?)的做法', content, re.MULTILINE)
+        name_match = _RE_TITLE_HOWTO.search(content)
         if not name_match:
-            name_match = re.search(r'^#\s+(.+)', content, re.MULTILINE)
+            name_match = _RE_TITLE.search(content)
             if not name_match:
                 return None
             dish_name = name_match.group(1).strip()
@@ -131,11 +414,11 @@ class RecipeParser:
             'cooking_methods': cooking_methods
         }
     
-    def extract_difficulty(self, content):
-        match = re.search(r'预估烹饪难度：(★+)', content)
+    def extract_difficulty(self, content: str) -> int:
+        match = _RE_DIFFICULTY.search(content)
         return len(match.group(1)) if match else 3
     
-    def extract_description(self, content):
+    def extract_description(self, content: str) -> str:
         lines = content.split('\n')
         desc_lines = []
         found_title = False
@@ -154,53 +437,40 @@ class RecipeParser:
         
         return ' '.join(desc_lines[:3])
     
-    def split_sections(self, content):
+    def split_sections(self, content: str) -> Dict[str, str]:
+        """按二级标题切分文档：一次正则扫描定位标题，直接切片原字符串"""
         sections = {}
-        current_section = None
-        current_content = []
-        
-        for line in content.split('\n'):
-            if line.startswith('## '):
-                if current_section:
-                    sections[current_section] = '\n'.join(current_content)
-                current_section = line[3:].strip()
-                current_content = []
-            elif current_section:
-                current_content.append(line)
+        headers = list(_RE_SECTION_HEADER.finditer(content))
         
-        if current_section:
-            sections[current_section] = '\n'.join(current_content)
+        for i, header in enumerate(headers):
+            name = header.group(1).strip()
+            if not name:  # 空标题不成节，其后内容一并忽略
+                continue
+            start = header.end() + 1  # 跳过标题行末尾的换行
+            end = headers[i + 1].start() - 1 if i + 1 < len(headers) else len(content)
+            sections[name] = content[start:end]
         
         return sections
     
-    def parse_ingredients(self, content):
-        ingredients = []
-        condiments = []
-        tools = []
+    def parse_ingredients(self, content: str) -> Tuple[List[str], List[str], List[str]]:
+        # 以dict作有序集合：O(1)去重，同时保留首次出现的顺序
+        buckets: Dict[str, Dict[str, None]] = {'ingredient': {}, 'condiment': {}, 'tool': {}}
         lines = content.split('\n')
         
         for line in lines:
             # 移除列表标记
-            line = re.sub(r'^[-*]\s+', '', line.strip())
+            line = _RE_LIST_PREFIX.sub('', line.strip())
             if not line:
                 continue
             
-            # 跳过Markdown标题（###、####等）
-            if line.startswith('#'):
-                continue
-            
-            # 跳过引用块（以>开头的行）
-            if line.startswith('>'):
-                continue
-            
-            # 跳过包含冒号的标题行（如："原料："、"工具："、"调味料："）
-            if line.endswith(('：', ':')) or line in ['原料', '工具', '调味料', '食材']:
+            # 跳过Markdown标题、引用块和小标题行（如："原料："、"工具："、"调味料："）
+            if _RE_LINE_SKIP.search(line):
                 continue
             
             # 处理 "原料名：说明文字" 格式，只保留原料名
             if '：' in line or ':' in line:
                 # 分割冒号，只取冒号前的部分
-                colon_match = re.match(r'^([^：:]+)[：:](.+)$', line)
+                colon_match = _RE_COLON.match(line)
                 if colon_match:
                     line = colon_match.group(1).strip()
                     # 如果冒号前的内容太短或为空，跳过
@@ -208,33 +478,15 @@ class RecipeParser:
                         continue
             
             # 先去除括号内的说明（括号内可能包含说明性文字）
-            line_cleaned = re.sub(r'\（[^）]+\）|\([^)]+\)', '', line).strip()
+            line_cleaned = _RE_PAREN.sub('', line).strip()
             if not line_cleaned:
                 continue
-            # 对于单个字符，只保留中文字符（如"鱼"、"肉"等）
-            if len(line_cleaned) == 1 and not re.match(r'[\u4e00-\u9fa5]', line_cleaned):
+            # 单个非中文字符、HTML注释、纯符号、以数量开头的行（单个中文字符如"鱼"、"肉"保留）
+            if _RE_ITEM_SKIP.search(line_cleaned):
                 continue
             
             # 跳过说明性文字（使用去除括号后的文本判断）
-            skip_keywords = ['图片', '示例', '成品', '注意', '建议', '推荐', 
-                           '材料都是', '计算得出', '可额外', 
-                           '必备', '以下', '按照', '依照', '过程', '不要太', '温度',
-                           '在这里', '下列', '下面的', '可根据', '根据自己', '供有',
-                           '配料放入', '配料洗净', '食材原料', '口味偏好', '快速判断']
-            if any(kw in line_cleaned for kw in skip_keywords) and len(line_cleaned) > 10:
-                continue
-            
-            # 跳过HTML注释
-            if line_cleaned.startswith('<!--') or line_cleaned.startswith('!'):
-                continue
-            
-            # 跳过纯符号或特殊标记
-            if re.match(r'^[!@#$%^&*\(\)\-\+=\[\]{}|\\:;"\'<>,.?/~`]+$', line_cleaned):
-                continue
-            
-            # 跳过以数量开头的行（如"10g 吉利丁"、"250ml 椰树牌椰汁"）
-            # 这些应该在amounts中，不应该在ingredients中
-            if re.match(r'^\d+[\d\.\s]*(g|kg|ml|L|cm|厘米|毫升|升)', line_cleaned):
+            if len(line_cleaned) > 10 and _RE_INGREDIENT_SKIP.search(line_cleaned):
                 continue
             
             # 使用清理后的文本
@@ -247,55 +499,25 @@ class RecipeParser:
                 should_split = True  # 顿号通常表示并列，应该拆分
             elif '，' in line or ',' in line:
                 # 检查逗号后的内容是否是属性描述
-                parts = re.split(r'[，,]', line)
+                parts = _RE_COMMA.split(line)
                 # 如果拆分后的部分都比较长（>2字符），可能是并列关系，应该拆分
                 # 如果有很短的部分（<=2字符），可能是属性描述，不拆分
                 if all(len(p.strip()) > 2 for p in parts if p.strip()):
                     should_split = True
             
+            # 拆分成多个项目，或单个项目/不拆分的组合直接分类
             if should_split:
-                # 拆分成多个项目
-                items = re.split(r'[、，,]', line)
-                for item in items:
-                    item = item.strip()
-                    if not item or len(item) < 2:
-                        continue
-                    
-                    # 分类（优先级：主要食材 > 工具 > 调料 > 其他食材）
-                    if any(k in item for k in self.main_ingredient_keywords):
-                        # 主要食材优先
-                        if item not in ingredients:
-                            ingredients.append(item)
-                    elif any(k in item for k in self.tool_keywords):
-                        if item not in tools:
-                            tools.append(item)
-                    elif any(k in item for k in self.condiment_keywords):
-                        if item not in condiments:
-                            condiments.append(item)
-                    else:
-                        # 默认归类为食材
-                        if item not in ingredients:
-                            ingredients.append(item)
+                items = [item.strip() for item in _RE_ITEM_SEP.split(line)]
+                items = [item for item in items if item and len(item) >= 2]
             else:
-                # 单个项目或不拆分的组合，直接分类
-                if any(k in line for k in self.main_ingredient_keywords):
-                    # 主要食材优先
-                    if line not in ingredients:
-                        ingredients.append(line)
-                elif any(k in line for k in self.tool_keywords):
-                    if line not in tools:
-                        tools.append(line)
-                elif any(k in line for k in self.condiment_keywords):
-                    if line not in condiments:
-                        condiments.append(line)
-                else:
-                    # 默认归类为食材
-                    if line not in ingredients:
-                        ingredients.append(line)
+                items = [line]
+            
+            for item in items:
+                buckets[self.classify_item(item)].setdefault(item, None)
         
-        return ingredients, condiments, tools
+        return list(buckets['ingredient']), list(buckets['condiment']), list(buckets['tool'])
     
-    def parse_amounts(self, content):
+    def parse_amounts(self, content: str) -> Dict[str, str]:
         """解析用量信息（从'计算'部分提取）"""
         amounts = {}
         lines = content.split('\n')
@@ -307,39 +529,27 @@ class RecipeParser:
                 continue
             
             # 移除列表标记
-            line = re.sub(r'^[-*]\s+', '', line)
+            line = _RE_LIST_PREFIX.sub('', line)
             
             # 跳过纯说明性文字（不包含具体用量信息的行）
             # 这些行通常以"每"、"一份"等开头，且以冒号或句号结尾
-            skip_patterns = [
-                r'^每\s*\d*\s*份[：:：。]',  # 如：每 2 份：
-                r'^每次制作.*[：:。]',
-                r'^一份.*[：:。]',
-                r'^总量[：:：。]',
-                r'^按照.*[：:。]',
-                r'^以下.*[：:。]',
-            ]
-            if any(re.match(pattern, line) for pattern in skip_patterns):
+            if _RE_AMOUNT_SKIP.match(line):
                 continue
             
             # 跳过包含特定关键词的完整说明句子
-            skip_keywords = [
-                '注意', '建议', '推荐', '可以', '需要', '理论上', '默认',
-                '使用上述', '依口味', '按比例', '计划做', '正好够'
-            ]
-            if any(kw in line for kw in skip_keywords) and len(line) > 20:
+            if len(line) > 20 and _RE_AMOUNT_NOTE.search(line):
                 # 如果包含标点符号，很可能是说明句子
-                if any(punct in line for punct in ['。', '！', '，', '、']):
+                if _RE_SENTENCE_PUNCT.search(line):
                     continue
             
             # 格式1: 食材名 = 用量 (如：手枪腿 = 1 支（约 350g）)
-            match1 = re.search(r'^(.+?)\s*[=＝]\s*(.+)$', line)
+            match1 = _RE_AMOUNT_EQ.search(line)
             if match1:
                 ingredient = match1.group(1).strip()
                 amount = match1.group(2).strip()
                 
                 # 清理食材名中的括号说明
-                ingredient_clean = re.sub(r'[（(][^）)]+[）)]', '', ingredient).strip()
+                ingredient_clean = _RE_PAREN_MIXED.sub('', ingredient).strip()
                 
                 if ingredient_clean and amount and len(ingredient_clean) < 30:
                     amounts[ingredient_clean] = amount
@@ -347,13 +557,13 @@ class RecipeParser:
             
             # 格式2: 食材名 空格 用量 (如：鲈鱼 一条)
             # 匹配：中文/英文 + 多个空格 + 数字/中文数量词
-            match2 = re.search(r'^([^\s]+(?:\s+[^\s]+)?)\s{2,}(.+)$', line)
+            match2 = _RE_AMOUNT_SPACED.search(line)
             if match2:
                 ingredient = match2.group(1).strip()
                 amount = match2.group(2).strip()
                 
                 # 清理食材名中的括号说明
-                ingredient_clean = re.sub(r'[（(][^）)]+[）)]', '', ingredient).strip()
+                ingredient_clean = _RE_PAREN_MIXED.sub('', ingredient).strip()
                 
                 if ingredient_clean and amount and len(ingredient_clean) < 30:
                     amounts[ingredient_clean] = amount
@@ -361,70 +571,77 @@ class RecipeParser:
             
             # 格式3: 食材名 单个空格 用量 (更宽松的匹配)
             # 只有当行中包含明显的数量词时才匹配
-            if re.search(r'\d+|一|二|三|四|五|六|七|八|九|十|[几若干适量少许]', line):
+            if _RE_HAS_QUANTITY.search(line):
                 parts = line.split(None, 1)  # 按第一个空白符分割
                 if len(parts) == 2:
                     ingredient = parts[0].strip()
                     amount = parts[1].strip()
                     
                     # 清理食材名中的括号说明
-                    ingredient_clean = re.sub(r'[（(][^）)]+[）)]', '', ingredient).strip()
+                    ingredient_clean = _RE_PAREN_MIXED.sub('', ingredient).strip()
                     
                     # 确保食材名不是纯数字或量词
                     if ingredient_clean and amount and len(ingredient_clean) < 30:
-                        if not re.match(r'^[\d一二三四五六七八九十]+$', ingredient_clean):
+                        if not _RE_NUMERAL_ONLY.match(ingredient_clean):
                             amounts[ingredient_clean] = amount
         
         return amounts
     
-    def parse_steps(self, content):
+    def parse_steps(self, content: str) -> List[str]:
         steps = []
         lines = content.split('\n')
         
         for line in lines:
-            line = re.sub(r'^[-*]\s+', '', line.strip())
-            if not line or re.search(r'!\[', line) or line.startswith('#'):
+            line = _RE_LIST_PREFIX.sub('', line.strip())
+            if not line or _RE_IMAGE.search(line) or line.startswith('#'):
                 continue
-            line = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', line)
+            line = _RE_LINK.sub(r'\1', line)
             if line and len(line) > 3:
                 steps.append(line)
         
         return steps
     
-    def parse_tips(self, content):
+    def parse_tips(self, content: str) -> str:
         tips = []
         lines = content.split('\n')
         
         for line in lines:
-            line = re.sub(r'^[-*]\s+', '', line.strip())
-            if '如果您遵循本指南' in line or re.search(r'https?://', line):
+            line = _RE_LIST_PREFIX.sub('', line.strip())
+            if '如果您遵循本指南' in line or _RE_URL.search(line):
                 continue
-            line = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', line)
-            if re.search(r'!\[', line) or line.startswith('#'):
+            line = _RE_LINK.sub(r'\1', line)
+            if _RE_IMAGE.search(line) or line.startswith('#'):
                 continue
             if line and len(line) > 5:
                 tips.append(line)
         
         return '\n'.join(tips)
     
-    def extract_cooking_methods(self, dish_name, steps):
-        methods = []
-        for keyword, method in self.method_keywords.items():
-            if keyword in dish_name and method not in methods:
-                methods.append(method)
+    def extract_cooking_methods(self, dish_name: str, steps: List[str]) -> List[str]:
+        text = dish_name + ' ' + ' '.join(steps)
+        boundary = len(dish_name)
+        name_hits: Dict[str, int] = {}
+        step_hits: Dict[str, int] = {}
+        for match in self._method_re.finditer(text):
+            keyword = match.group(0)
+            hits = name_hits if match.start() < boundary else step_hits
+            method = self.method_keywords[keyword]
+            rank = self._method_rank[keyword]
+            if method not in hits or rank < hits[method]:
+                hits[method] = rank
         
-        steps_text = ' '.join(steps)
-        for keyword, method in self.method_keywords.items():
-            if keyword in steps_text and method not in methods:
-                methods.append(method)
+        # 菜名命中的方法在前，步骤中新增的方法在后
+        methods = sorted(name_hits, key=name_hits.__getitem__)
+        methods += [m for m in sorted(step_hits, key=step_hits.__getitem__) if m not in name_hits]
         
         return methods if methods else ['炒']
     
     def save_to_json(self, output_path):
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, 'w', encoding='utf-8') as f:
+        # 每行一个菜谱（JSON Lines），大缓冲区二进制写入，orjson直接输出UTF-8字节
+        with open(output_path, 'wb', buffering=1 << 20) as f:
             for recipe in self.recipes:
-                f.write(json.dumps(recipe, ensure_ascii=False) + '\n')
+                f.write(_encode_recipe(recipe))
         print(f"数据已保存到: {output_path}")
 
 if __name__ == '__main__':
@@ -434,7 +651,6 @@ if __name__ == '__main__':
     output_path = os.path.join(cur_dir, 'data', 'recipes.json')
     
     parser = RecipeParser(dishes_dir)
-    recipes = parser.parse_all_recipes()
-    parser.save_to_json(output_path)
+    total = parser.parse_all_to_json(output_path)
     
-    print(f"\n解析完成！总菜谱数: {len(recipes)}")
+    print(f"\n解析完成！总菜谱数: {total}")
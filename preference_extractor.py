@@ -5,9 +5,32 @@
 基于规则匹配 + 知识图谱实体匹配
 """
 
+import os
 import re
+import logging
 import json
-from py2neo import Graph
+import pickle
+import hashlib
+from graph_db import get_graph
+from vocab import (FLAVOR_KEYWORDS, TAG_KEYWORDS, INGREDIENT_KEYWORDS,
+                   KeywordMatcher, CYAC_AVAILABLE, normalize)
+
+# 初始化日志走logging：未启用INFO级别时不格式化消息
+logger = logging.getLogger(__name__)
+
+# 规则门槛词（导入时编译一次）
+# "做过"/"煮过"等：提取做过的菜
+_COOKED_RE = re.compile(r'(?:做|煮|炒|烧|炖|蒸|煎|炸|烤)过')
+# "喜欢"/"爱吃"等：提取喜欢的菜
+_LIKE_RE = re.compile('|'.join(['喜欢', '爱吃', '爱', '最爱', '很爱', '特别喜欢']))
+# 表达偏好的词：口味和食材偏好只在有这些词时才提取
+_PREFERENCE_RE = re.compile('|'.join(['喜欢', '爱吃', '想吃', '偏好', '口味', '爱', '最爱']))
+
+# 实体列表与匹配器的磁盘快照目录（按图谱版本号区分）
+# 自动机文件以只读mmap方式加载，同一台机器上的多个worker进程共享同一份物理内存页
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cache')
+# 快照格式版本（模式串的存储方式变化时递增，使旧快照失效）
+CACHE_VERSION = 2
 
 
 class PreferenceExtractor:
@@ -21,77 +44,154 @@ class PreferenceExtractor:
             use_deepseek: 保留参数以兼容，但不使用
             api_key: 保留参数以兼容，但不使用
         """
-        # 连接知识图谱
-        self.g = Graph("bolt://127.0.0.1:7687", auth=("neo4j", "kurisu810975"))
-        
-        # 加载知识图谱中的实体
-        self._load_entities_from_graph()
-        # 定义口味关键词
-        self.flavor_keywords = {
-            '酸': ['酸', '酸味', '酸的', '酸爽', '酸辣'],
-            '甜': ['甜', '甜味', '甜的', '甜品', '甜食'],
-            '苦': ['苦', '苦味', '苦的'],
-            '辣': ['辣', '辣味', '辣的', '麻辣', '香辣', '酸辣', '微辣', '中辣', '特辣', '辛辣'],
-            '咸': ['咸', '咸味', '咸的', '重口味'],
-            '鲜': ['鲜', '鲜味', '鲜美', '鲜香'],
-            '麻': ['麻', '麻味', '麻辣', '花椒'],
-            '香': ['香', '香味', '香的'],
-            '清淡': ['清淡', '淡', '少油', '少盐'],
-        }
+        # 连接知识图谱（进程内共享的连接池）
+        self.g = get_graph()
         
-        # 定义生活习惯/场景标签
-        self.tag_keywords = {
-            '熬夜': ['熬夜', '晚睡', '夜宵', '宵夜'],
-            '加班': ['加班', '工作忙', '没时间'],
-            '健身': ['健身', '锻炼', '运动', '增肌'],
-            '减脂': ['减脂', '减肥', '瘦身', '控制体重', '低卡'],
-            '养生': ['养生', '保健', '滋补', '调理'],
-            '快手': ['快手', '快速', '简单', '方便', '省时', '10分钟', '5分钟'],
-            '宴客': ['宴客', '请客', '聚餐', '招待', '待客'],
-            '便当': ['便当', '带饭', '午餐盒'],
-            '下酒': ['下酒', '喝酒', '配酒'],
-            '早餐': ['早餐', '早饭', '早上吃'],
-            '午餐': ['午餐', '午饭', '中午吃'],
-            '晚餐': ['晚餐', '晚饭', '晚上吃'],
-        }
+        # 口味关键词、生活习惯/场景标签、常见食材（与查询优化共用vocab中的词表）
+        self.flavor_keywords = FLAVOR_KEYWORDS
+        self.tag_keywords = TAG_KEYWORDS
+        self.ingredient_keywords = INGREDIENT_KEYWORDS
         
-        # 常见食材（作为备用，优先使用知识图谱中的）
-        self.ingredient_keywords = [
-            '鸡肉', '猪肉', '牛肉', '羊肉', '鱼', '虾', '蟹', '鸡蛋', '豆腐',
-            '土豆', '番茄', '黄瓜', '茄子', '青椒', '洋葱', '蒜', '姜',
-            '米饭', '面条', '面粉', '豆芽', '白菜', '菠菜', '芹菜'
-        ]
+        # 加载知识图谱中的实体，所有词表合并为一个多模式匹配器（每次查询只扫描一遍）
+        # 图谱版本号未变时直接读取磁盘快照，跳过实体查询和匹配器构建
+        generation = self._graph_generation()
+        cache_path = self._cache_path(generation) if generation is not None else None
+        if cache_path is None or not self._load_cache(cache_path):
+            loaded = self._load_entities_from_graph()
+            self._build_matcher()
+            if cache_path is not None and loaded:
+                self._save_cache(cache_path)
+    
+    @classmethod
+    def warmup(cls, graph=None):
+        """
+        预热Neo4j页缓存：服务启动时调用一次，让首个请求不再从磁盘读取节点和属性页
+        
+        对菜品/食材/口味/标签四类节点各扫描一遍name属性（一条UNION ALL查询）；
+        Neo4j企业版也可直接开启 dbms.memory.pagecache.warmup.enable=true
+        
+        Returns:
+            Dict[str, int]: 标签 -> 节点数，失败时返回空字典
+        """
+        g = graph if graph is not None else get_graph()
+        cypher = " UNION ALL ".join(
+            f"MATCH (n:{label}) RETURN '{label}' AS label, count(n.name) AS count"
+            for label in ('Dish', 'Ingredient', 'Flavor', 'Tag')
+        )
+        try:
+            counts = {row['label']: row['count'] for row in g.run(cypher).data()}
+        except Exception as e:
+            logger.warning("预热知识图谱失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            return {}
+        logger.info("知识图谱预热完成: %s", counts)
+        return counts
+    
+    def _graph_generation(self):
+        """读取图谱版本号（由build_recipegraph_v2构建时更新），没有则返回None"""
+        try:
+            rows = self.g.run(
+                "MATCH (m:GraphMeta {name: 'recipegraph'}) RETURN m.generation AS generation"
+            ).data()
+        except Exception as e:
+            logger.warning("读取图谱版本号失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            return None
+        return rows[0]['generation'] if rows and rows[0]['generation'] is not None else None
+    
+    def _cache_path(self, generation):
+        """快照路径：图谱版本号 + 预定义词表的摘要（改词表后旧快照自动失效）"""
+        vocab = json.dumps([CACHE_VERSION, self.flavor_keywords, self.tag_keywords, self.ingredient_keywords],
+                           ensure_ascii=False, sort_keys=True)
+        digest = hashlib.blake2b(vocab.encode('utf-8'), digest_size=8).hexdigest()
+        return os.path.join(CACHE_DIR, f'pref_ext_{generation}_{digest}.pkl')
+    
+    def _load_cache(self, cache_path):
+        """读取快照（自动机直接映射文件，不拷贝），成功返回True"""
+        ac_path = cache_path[:-len('.pkl')] + '.ac'
+        if not os.path.exists(cache_path) or (CYAC_AVAILABLE and not os.path.exists(ac_path)):
+            return False
+        try:
+            with open(cache_path, 'rb') as f:
+                state = pickle.load(f)
+            matcher = KeywordMatcher(state['patterns'], state['pattern_meta'])
+            matcher.load_automaton(ac_path)
+        except Exception as e:
+            logger.warning("读取偏好提取快照失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            return False
+        
+        self.dish_names = state['dish_names']
+        self.graph_ingredients = state['graph_ingredients']
+        self.graph_flavors = state['graph_flavors']
+        self.graph_tags = state['graph_tags']
+        self._matcher = matcher
+        logger.info("已从快照加载知识图谱实体: %d道菜, %d种食材, %d种口味, %d个标签",
+                    len(self.dish_names), len(self.graph_ingredients), len(self.graph_flavors), len(self.graph_tags))
+        return True
+    
+    def _save_cache(self, cache_path):
+        """写入快照（先写临时文件再原子替换，避免多个进程读到半个文件）"""
+        state = {
+            'dish_names': self.dish_names,
+            'graph_ingredients': self.graph_ingredients,
+            'graph_flavors': self.graph_flavors,
+            'graph_tags': self.graph_tags,
+            'patterns': self._matcher.patterns,
+            'pattern_meta': self._matcher.meta,
+        }
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            if self._matcher.automaton is not None:
+                ac_path = cache_path[:-len('.pkl')] + '.ac'
+                self._matcher.save_automaton(ac_path + '.tmp')
+                os.replace(ac_path + '.tmp', ac_path)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.warning("写入偏好提取快照失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+    
+    def _build_matcher(self):
+        """把知识图谱实体和预定义关键词合并为一个多模式匹配器"""
+        matcher = KeywordMatcher()
+        matcher.add_list(self.dish_names, 'dish')
+        matcher.add_list(self.graph_flavors, 'flavor_graph')
+        matcher.add_synonyms(self.flavor_keywords, 'flavor_kw')
+        matcher.add_list(self.graph_tags, 'tag_graph')
+        matcher.add_synonyms(self.tag_keywords, 'tag_kw')
+        matcher.add_list(self.graph_ingredients, 'ingredient_graph')
+        matcher.add_list(self.ingredient_keywords, 'ingredient_kw')
+        self._matcher = matcher.build()
     
     def _load_entities_from_graph(self):
-        """从知识图谱加载所有实体"""
+        """从知识图谱加载所有实体（一条UNION ALL查询，一次Bolt往返），成功返回True"""
         try:
-            # 加载所有菜品名
-            cypher_dishes = "MATCH (d:Dish) RETURN d.name as name"
-            dishes = self.g.run(cypher_dishes).data()
-            self.dish_names = [d['name'] for d in dishes if d['name']]
-            
-            # 加载所有食材名
-            cypher_ingredients = "MATCH (i:Ingredient) RETURN i.name as name"
-            ingredients = self.g.run(cypher_ingredients).data()
-            self.graph_ingredients = [i['name'] for i in ingredients if i['name']]
-            
-            # 加载所有口味
-            cypher_flavors = "MATCH (f:Flavor) RETURN f.name as name"
-            flavors = self.g.run(cypher_flavors).data()
-            self.graph_flavors = [f['name'] for f in flavors if f['name']]
+            cypher = (
+                "MATCH (d:Dish) RETURN 'dish' AS t, d.name AS name "
+                "UNION ALL MATCH (i:Ingredient) RETURN 'ingredient' AS t, i.name AS name "
+                "UNION ALL MATCH (f:Flavor) RETURN 'flavor' AS t, f.name AS name "
+                "UNION ALL MATCH (g:Tag) RETURN 'tag' AS t, g.name AS name"
+            )
+            entities = {'dish': [], 'ingredient': [], 'flavor': [], 'tag': []}
+            for row in self.g.run(cypher).data():
+                if row['name']:
+                    entities[row['t']].append(row['name'])
             
-            # 加载所有标签
-            cypher_tags = "MATCH (t:Tag) RETURN t.name as name"
-            tags = self.g.run(cypher_tags).data()
-            self.graph_tags = [t['name'] for t in tags if t['name']]
+            self.dish_names = entities['dish']
+            self.graph_ingredients = entities['ingredient']
+            self.graph_flavors = entities['flavor']
+            self.graph_tags = entities['tag']
             
-            print(f"  已加载知识图谱实体: {len(self.dish_names)}道菜, {len(self.graph_ingredients)}种食材, {len(self.graph_flavors)}种口味, {len(self.graph_tags)}个标签")
+            logger.info("已加载知识图谱实体: %d道菜, %d种食材, %d种口味, %d个标签",
+                        len(self.dish_names), len(self.graph_ingredients), len(self.graph_flavors), len(self.graph_tags))
+            return True
         except Exception as e:
-            print(f"  加载知识图谱实体失败: {e}")
+            # 只在DEBUG级别附带堆栈
+            logger.warning("加载知识图谱实体失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             self.dish_names = []
             self.graph_ingredients = []
             self.graph_flavors = []
             self.graph_tags = []
+            return False
     
     def extract_from_query(self, user_query):
         """
@@ -111,88 +211,64 @@ class PreferenceExtractor:
             }
         """
         result = self._default_result()
+        # 入口处规范化一次（全角/半角、大小写），后续规则都使用规范化后的查询
+        user_query = normalize(user_query)
+        hits = self._matcher.match(user_query)
+        if not hits:
+            # 没有命中任何词（匹配器按模式首字符预先短路），各规则都不会产生结果
+            return result
+        
+        # 上下文门槛每次查询只判断一次
+        has_cooked_context = _COOKED_RE.search(user_query) is not None
+        has_like_context = _LIKE_RE.search(user_query) is not None
+        has_preference_context = _PREFERENCE_RE.search(user_query) is not None
+        
+        def ordered(category):
+            """某类别命中的规范名，按原词表顺序排列"""
+            bucket = hits.get(category, {})
+            return sorted(bucket, key=lambda name: bucket[name][0])
+        
+        # 规则1、2共用同一组菜品命中，只排序一次
+        dishes = ordered('dish')
         
         # 规则1: 提取做过的菜（优先匹配知识图谱中的菜品）
         # 先检查是否有"做过"/"煮过"等关键词
-        if re.search(r'(?:做|煮|炒|烧|炖|蒸|煎|炸|烤)过', user_query):
-            # 遍历知识图谱中的所有菜品，看是否在查询中出现
-            for dish_name in self.dish_names:
-                if dish_name in user_query:
-                    if dish_name not in result['dishes_cooked']:
-                        result['dishes_cooked'].append(dish_name)
-                        result['has_preference'] = True
+        if has_cooked_context:
+            result['dishes_cooked'] = dishes
         
         # 规则2: 提取喜欢的菜（优先匹配知识图谱中的菜品）
-        # 检查是否有"喜欢"/"爱吃"等关键词
-        preference_words = ['喜欢', '爱吃', '爱', '最爱', '很爱', '特别喜欢']
-        has_like_context = any(word in user_query for word in preference_words)
-        
-        if has_like_context:
-            # 遍历知识图谱中的所有菜品
-            for dish_name in self.dish_names:
-                if dish_name in user_query:
-                    # 排除已经在dishes_cooked中的
-                    if dish_name not in result['dishes_cooked'] and dish_name not in result['dishes_liked']:
-                        result['dishes_liked'].append(dish_name)
-                        result['has_preference'] = True
+        # 检查是否有"喜欢"/"爱吃"等关键词；要排除dishes_cooked中的菜，
+        # 而有"做过"上下文时命中的菜已全部归入dishes_cooked，差集为空，无需逐个比较
+        if has_like_context and not has_cooked_context:
+            result['dishes_liked'] = list(dishes)
         
         # 规则3: 提取口味偏好（优先匹配知识图谱中的口味）
-        # 检查是否包含表达偏好的词
-        preference_words_for_flavor = ['喜欢', '爱吃', '想吃', '偏好', '口味', '爱', '最爱']
-        has_preference_context = any(word in user_query for word in preference_words_for_flavor)
-        
-        # 先匹配知识图谱中的口味
-        for flavor in self.graph_flavors:
-            if flavor in user_query:
-                if has_preference_context or flavor + '的' in user_query or flavor + '味' in user_query:
-                    if flavor not in result['flavors']:
-                        result['flavors'].append(flavor)
-                        result['has_preference'] = True
-        
-        # 再匹配预定义的口味关键词（作为补充）
-        for flavor, keywords in self.flavor_keywords.items():
-            if flavor not in result['flavors']:  # 避免重复
-                for keyword in keywords:
-                    if keyword in user_query:
-                        if has_preference_context or keyword + '的' in user_query or keyword + '味' in user_query:
-                            if flavor not in result['flavors']:
-                                result['flavors'].append(flavor)
-                                result['has_preference'] = True
-                            break
-        
-        # 规则4: 提取生活习惯/场景标签（优先匹配知识图谱中的标签）
-        # 先匹配知识图谱中的标签
-        for tag in self.graph_tags:
-            if tag in user_query:
-                if tag not in result['tags']:
-                    result['tags'].append(tag)
-                    result['has_preference'] = True
-        
-        # 再匹配预定义的标签关键词（作为补充）
-        for tag, keywords in self.tag_keywords.items():
-            if tag not in result['tags']:  # 避免重复
-                for keyword in keywords:
-                    if keyword in user_query:
-                        if tag not in result['tags']:
-                            result['tags'].append(tag)
-                            result['has_preference'] = True
-                        break
+        # 有表达偏好的词，或口味词后接"的"/"味"
+        def flavor_in_context(word):
+            return has_preference_context or word + '的' in user_query or word + '味' in user_query
+        
+        # 先匹配知识图谱中的口味（dict作有序集合，O(1)去重）
+        flavors = dict.fromkeys(f for f in ordered('flavor_graph') if flavor_in_context(f))
+        
+        # 再匹配预定义的口味关键词（作为补充，任一命中的关键词满足上下文即可）
+        # 自动机的模式信息已把同义词直接映射到规范口味（如"酸辣"同时对应"酸"和"辣"）
+        flavor_kw_hits = hits.get('flavor_kw', {})
+        for flavor in ordered('flavor_kw'):
+            if flavor not in flavors and any(map(flavor_in_context, flavor_kw_hits[flavor][1:])):
+                flavors[flavor] = None
+        result['flavors'] = list(flavors)
+        
+        # 规则4: 提取生活习惯/场景标签（优先匹配知识图谱中的标签，再用预定义关键词补充）
+        result['tags'] = list(dict.fromkeys(ordered('tag_graph') + ordered('tag_kw')))
         
         # 规则5: 提取食材偏好（优先匹配知识图谱中的食材）
         # 只有在明确表达喜欢的情况下才提取
         if has_preference_context:
-            # 先匹配知识图谱中的食材
-            for ingredient in self.graph_ingredients:
-                if ingredient in user_query:
-                    if ingredient not in result['ingredients']:
-                        result['ingredients'].append(ingredient)
-                        result['has_preference'] = True
-            
-            # 再匹配预定义的食材（作为补充）
-            for ingredient in self.ingredient_keywords:
-                if ingredient not in result['ingredients'] and ingredient in user_query:
-                    result['ingredients'].append(ingredient)
-                    result['has_preference'] = True
+            result['ingredients'] = list(dict.fromkeys(ordered('ingredient_graph') + ordered('ingredient_kw')))
+        
+        result['has_preference'] = any(
+            result[key] for key in ('dishes_cooked', 'dishes_liked', 'flavors', 'tags', 'ingredients')
+        )
         
         return result
     
@@ -210,8 +286,15 @@ class PreferenceExtractor:
 
 if __name__ == '__main__':
     """测试偏好提取"""
+    import sys
+    logging.basicConfig(level=logging.INFO, format="  %(message)s")
     extractor = PreferenceExtractor()
     
+    # 部署时先运行一次 python preference_extractor.py --build-cache 生成快照，
+    # 之后各worker进程启动时直接映射同一份快照文件
+    if '--build-cache' in sys.argv:
+        sys.exit(0)
+    
     test_cases = [
         "我喜欢吃辛辣的食物",
         "我做过西红柿炒鸡蛋",
@@ -5,8 +5,40 @@ LLM查询优化模块
 """
 
 from llm_server import ModelAPI
+import vocab
 import re
+import copy
+import asyncio
 import json
+import time
+from collections import OrderedDict
+
+try:
+    import jieba
+    JIEBA_AVAILABLE = True
+except ImportError:
+    JIEBA_AVAILABLE = False
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _extract_json(text):
+    """
+    从LLM回复中取出第一个完整的JSON对象
+    
+    从每个'{'处尝试raw_decode，解析到对象结尾即停止，不会像r'\{.*\}'那样
+    贪婪匹配到最后一个'}'、再整体解析第二遍
+    
+    Returns:
+        解析得到的对象，找不到时返回None
+    """
+    start = text.find('{')
+    while start != -1:
+        try:
+            return _JSON_DECODER.raw_decode(text, start)[0]
+        except json.JSONDecodeError:
+            start = text.find('{', start + 1)
+    return None
 
 
 class QueryOptimizer:
@@ -25,6 +57,76 @@ class QueryOptimizer:
             self.model = ModelAPI(use_deepseek=True, api_key=api_key)
         else:
             self.model = ModelAPI(MODEL_URL=model_url)
+        
+        # 结果缓存：(接口, 规范化查询) -> (过期时刻, 结果)，LRU淘汰 + TTL过期
+        self._cache = OrderedDict()
+        self._cache_size = 4096
+        self._cache_ttl = 3600
+        self._cache_hits = 0
+        self._cache_misses = 0
+    
+    def _cache_get(self, kind, query):
+        """查缓存，返回(是否命中, 结果副本)"""
+        key = (kind, query)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            self._cache_hits += 1
+            return True, copy.deepcopy(entry[1])
+        self._cache_misses += 1
+        return False, None
+    
+    def _cache_put(self, kind, query, value):
+        """写缓存，返回结果副本（调用方修改结果不影响缓存）"""
+        key = (kind, query)
+        self._cache[key] = (time.monotonic() + self._cache_ttl, value)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return copy.deepcopy(value)
+    
+    def _cached(self, kind, query, compute):
+        """查缓存，未命中时调用compute(query)并缓存结果（compute抛出的异常不缓存，由调用方降级处理）"""
+        hit, value = self._cache_get(kind, query)
+        if hit:
+            return value
+        return self._cache_put(kind, query, compute(query))
+    
+    async def _acached(self, kind, query, acompute):
+        """_cached的异步版本"""
+        hit, value = self._cache_get(kind, query)
+        if hit:
+            return value
+        return self._cache_put(kind, query, await acompute(query))
+    
+    @staticmethod
+    def _check_response(response, new_history, history):
+        """ModelAPI失败时不抛异常：返回空回答，或原样返回传入的history；这里转成异常，避免把失败结果写入缓存"""
+        if not response or new_history is history:
+            raise RuntimeError(response or "LLM无响应")
+        return response
+    
+    def _chat(self, prompt):
+        """单轮调用LLM（失败时抛出异常）"""
+        history = []
+        response, new_history = self.model.chat(query=prompt, history=history)
+        return self._check_response(response, new_history, history)
+    
+    async def _achat(self, prompt):
+        """单轮异步调用LLM（失败时抛出异常）"""
+        history = []
+        response, new_history = await self.model.achat(prompt, history)
+        return self._check_response(response, new_history, history)
+    
+    def cache_stats(self):
+        """缓存命中统计"""
+        total = self._cache_hits + self._cache_misses
+        return {
+            'size': len(self._cache),
+            'hits': self._cache_hits,
+            'misses': self._cache_misses,
+            'hit_rate': self._cache_hits / total if total else 0.0
+        }
     
     def optimize_query(self, user_query):
         """
@@ -41,7 +143,24 @@ class QueryOptimizer:
                 'keywords': 关键词
             }
         """
-        prompt = f"""你是一个菜谱问答系统的查询优化助手。请分析用户的查询，提取关键信息。
+        user_query = vocab.normalize(user_query)
+        try:
+            return self._cached('optimize', user_query, self._optimize_query)
+        except Exception as e:
+            print(f"查询优化失败: {e}")
+            return self._default_optimization(user_query, str(e))
+    
+    def _optimize_query(self, user_query):
+        """调用LLM优化查询（失败时抛出异常）"""
+        return self._parse_optimization(user_query, self._chat(self._optimize_prompt(user_query)))
+    
+    async def _aoptimize_query(self, user_query):
+        """异步调用LLM优化查询（失败时抛出异常）"""
+        return self._parse_optimization(user_query, await self._achat(self._optimize_prompt(user_query)))
+    
+    def _optimize_prompt(self, user_query):
+        """查询优化的提示词"""
+        return f"""你是一个菜谱问答系统的查询优化助手。请分析用户的查询，提取关键信息。
 
 用户查询：{user_query}
 
@@ -117,22 +236,16 @@ class QueryOptimizer:
 - 难度关键词：新手/简单/容易/快手 → easy，中等 → medium，复杂/高级/难 → hard
 
 现在请分析上面的用户查询："""
-
-        try:
-            response, _ = self.model.chat(query=prompt, history=[])
-            
-            # 尝试解析JSON
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-                return result
-            else:
-                # 如果没有JSON，返回默认结构
-                return self._default_optimization(user_query, response)
-        
-        except Exception as e:
-            print(f"查询优化失败: {e}")
-            return self._default_optimization(user_query, str(e))
+    
+    def _parse_optimization(self, user_query, response):
+        """从LLM回复中解析优化结果"""
+        # 尝试解析JSON
+        result = _extract_json(response)
+        if result is not None:
+            return result
+        else:
+            # 如果没有JSON，返回默认结构
+            return self._default_optimization(user_query, response)
     
     def _default_optimization(self, user_query, llm_response=""):
         """默认优化（当LLM失败时）"""
@@ -145,7 +258,6 @@ class QueryOptimizer:
             "flavors": [],
             "tags": []
         }
-        keywords = []
         
         # 意图识别
         if any(word in user_query for word in ["推荐", "有什么", "做什么"]):
@@ -155,26 +267,12 @@ class QueryOptimizer:
         elif any(word in user_query for word in ["食材", "原料", "需要什么"]):
             intent = "ingredient_search"
         
-        # 场景识别
-        scenes = ["加班", "熬夜", "减肥", "健身", "聚会", "周末", "夜宵"]
-        for scene in scenes:
-            if scene in user_query:
-                entities["scenes"].append(scene)
-                keywords.append(scene)
-        
-        # 口味识别
-        flavors = ["辣", "麻辣", "清淡", "酸", "甜", "酸甜", "咸", "鲜"]
-        for flavor in flavors:
-            if flavor in user_query:
-                entities["flavors"].append(flavor)
-                keywords.append(flavor)
-        
-        # 标签识别
-        tags = ["简单", "快手", "下饭", "新手", "家常"]
-        for tag in tags:
-            if tag in user_query:
-                entities["tags"].append(tag)
-                keywords.append(tag)
+        # 场景、口味、标签识别（共享词表，一次扫描）
+        hits = vocab.scan(user_query)
+        entities["scenes"] = hits.get('scene', [])
+        entities["flavors"] = hits.get('query_flavor', [])
+        entities["tags"] = hits.get('query_tag', [])
+        keywords = entities["scenes"] + entities["flavors"] + entities["tags"]
         
         return {
             "optimized_query": user_query,
@@ -195,7 +293,24 @@ class QueryOptimizer:
         Returns:
             List[str]: 扩展后的查询列表
         """
-        prompt = f"""请为以下菜谱查询生成3个语义相似但表达不同的查询变体，用于扩展检索范围。
+        query = vocab.normalize(query)
+        try:
+            return self._cached('expand', query, self._expand_query)
+        except Exception as e:
+            print(f"查询扩展失败: {e}")
+            return [query]
+    
+    def _expand_query(self, query):
+        """调用LLM生成查询变体（失败时抛出异常）"""
+        return self._parse_expansion(query, self._chat(self._expand_prompt(query)))
+    
+    async def _aexpand_query(self, query):
+        """异步调用LLM生成查询变体（失败时抛出异常）"""
+        return self._parse_expansion(query, await self._achat(self._expand_prompt(query)))
+    
+    def _expand_prompt(self, query):
+        """查询扩展的提示词"""
+        return f"""请为以下菜谱查询生成3个语义相似但表达不同的查询变体，用于扩展检索范围。
 
 原始查询：{query}
 
@@ -214,25 +329,49 @@ class QueryOptimizer:
 适合喜欢吃辣的人的菜谱
 
 现在请为上面的查询生成变体："""
-
-        try:
-            response, _ = self.model.chat(query=prompt, history=[])
-            
-            # 提取查询
-            lines = [line.strip() for line in response.split('\n') if line.strip()]
-            # 去除编号
-            queries = []
-            for line in lines:
-                # 去除数字编号、点、破折号等
-                cleaned = re.sub(r'^[\d\-\.\)）、]+\s*', '', line)
-                if cleaned and len(cleaned) > 2:
-                    queries.append(cleaned)
-            
-            return queries[:3] if queries else [query]
+    
+    def _parse_expansion(self, query, response):
+        """从LLM回复中解析查询变体"""
+        # 提取查询
+        lines = [line.strip() for line in response.split('\n') if line.strip()]
+        # 去除编号
+        queries = []
+        for line in lines:
+            # 去除数字编号、点、破折号等
+            cleaned = re.sub(r'^[\d\-\.\)）、]+\s*', '', line)
+            if cleaned and len(cleaned) > 2:
+                queries.append(cleaned)
         
-        except Exception as e:
-            print(f"查询扩展失败: {e}")
-            return [query]
+        return queries[:3] if queries else [query]
+    
+    async def optimize_and_expand(self, user_query):
+        """
+        并发执行查询优化和查询扩展（两次LLM请求的网络等待重叠）
+        
+        在事件循环中复用self.model的异步连接池；单独调用时可用
+        asyncio.run(...)，结束后调用await self.model.aclose()释放连接
+        
+        Returns:
+            Tuple[Dict, List[str]]: (optimize_query的结果, expand_query的结果)
+        """
+        user_query = vocab.normalize(user_query)
+        
+        async def optimize():
+            try:
+                return await self._acached('optimize', user_query, self._aoptimize_query)
+            except Exception as e:
+                print(f"查询优化失败: {e}")
+                return self._default_optimization(user_query, str(e))
+        
+        async def expand():
+            try:
+                return await self._acached('expand', user_query, self._aexpand_query)
+            except Exception as e:
+                print(f"查询扩展失败: {e}")
+                return [user_query]
+        
+        optimization, expanded = await asyncio.gather(optimize(), expand())
+        return optimization, expanded
     
     def generate_search_keywords(self, query):
         """
@@ -244,6 +383,25 @@ class QueryOptimizer:
         Returns:
             List[str]: 关键词列表
         """
+        query = vocab.normalize(query)
+        try:
+            return self._cached('keywords', query, self._generate_search_keywords)
+        except Exception as e:
+            print(f"关键词提取失败: {e}")
+            return self._default_keywords(query)
+    
+    def _default_keywords(self, query):
+        """默认关键词（当LLM失败时）：词表命中的场景/标签/食材/口味，jieba分词补充"""
+        hits = vocab.scan(query)
+        keywords = []
+        for category in ('scene', 'tag_kw', 'query_tag', 'ingredient_kw', 'flavor_kw', 'query_flavor'):
+            keywords.extend(hits.get(category, []))
+        if JIEBA_AVAILABLE:
+            keywords.extend(w for w in jieba.lcut_for_search(query) if len(w) > 1)
+        return list(dict.fromkeys(keywords))[:5]
+    
+    def _generate_search_keywords(self, query):
+        """调用LLM提取关键词（失败时抛出异常）"""
         prompt = f"""请从以下菜谱查询中提取最重要的3-5个搜索关键词。
 
 查询：{query}
@@ -261,21 +419,15 @@ class QueryOptimizer:
 
 现在请提取关键词："""
 
-        try:
-            response, _ = self.model.chat(query=prompt, history=[])
-            
-            # 提取关键词
-            keywords = [kw.strip() for kw in response.split(',') if kw.strip()]
-            # 去除编号等
-            keywords = [re.sub(r'^[\d\.\)）、]+\s*', '', kw) for kw in keywords]
-            keywords = [kw for kw in keywords if kw and len(kw) > 1]
-            
-            return keywords[:5]
+        response = self._chat(prompt)
         
-        except Exception as e:
-            print(f"关键词提取失败: {e}")
-            # 简单分词
-            return [word for word in query if len(word) > 1][:5]
+        # 提取关键词
+        keywords = [kw.strip() for kw in response.split(',') if kw.strip()]
+        # 去除编号等
+        keywords = [re.sub(r'^[\d\.\)）、]+\s*', '', kw) for kw in keywords]
+        keywords = [kw for kw in keywords if kw and len(kw) > 1]
+        
+        return keywords[:5]
 
 
 if __name__ == "__main__":
@@ -294,18 +446,21 @@ if __name__ == "__main__":
         "有什么简单的家常菜"
     ]
     
-    for query in test_queries:
-        print(f"\n原始查询：{query}")
-        
-        # 优化查询
-        result = optimizer.optimize_query(query)
-        print(f"优化后：{result['optimized_query']}")
-        print(f"意图：{result['intent']}")
-        print(f"实体：{result['entities']}")
-        print(f"关键词：{result['keywords']}")
-        
-        # 查询扩展
-        expanded = optimizer.expand_query(query)
-        print(f"扩展查询：")
-        for i, eq in enumerate(expanded, 1):
-            print(f"  {i}. {eq}")
+    async def run_tests():
+        # 退出时关闭异步连接池
+        async with optimizer.model:
+            for query in test_queries:
+                print(f"\n原始查询：{query}")
+                
+                # 优化查询与查询扩展并发执行
+                result, expanded = await optimizer.optimize_and_expand(query)
+                print(f"优化后：{result['optimized_query']}")
+                print(f"意图：{result['intent']}")
+                print(f"实体：{result['entities']}")
+                print(f"关键词：{result['keywords']}")
+                
+                print(f"扩展查询：")
+                for i, eq in enumerate(expanded, 1):
+                    print(f"  {i}. {eq}")
+    
+    asyncio.run(run_tests())
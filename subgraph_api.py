@@ -5,14 +5,126 @@
 """
 
 from graph_retriever import GraphRetriever
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
+from collections import OrderedDict, namedtuple
+import hashlib
+import threading
+import time
+
+
+def _nid(node_type: str, label: str) -> str:
+    """由(类型, 名称)得到稳定的节点id：不同子图中的同一实体id相同，合并子图时不会串线"""
+    digest = hashlib.blake2b(str(label).encode('utf-8'), digest_size=6).hexdigest()
+    return f"{node_type}:{digest}"
+
+
+# 构建过程中的节点/边记录（元组，比逐条建dict省内存和分配），在result()中统一转为dict
+_Node = namedtuple("_Node", "id label type group")
+_Edge = namedtuple("_Edge", "src dst label")
+
+
+class _SubgraphBuilder:
+    """子图构建器：同类型同名的实体只建一个节点，重复出现时只加边"""
+    
+    def __init__(self):
+        self.nodes = []
+        self.edges = []
+        self._node_ids = set()
+        self._edge_keys = set()
+    
+    def node(self, label: str, node_type: str, group: str) -> str:
+        """返回实体的节点id，首次出现时添加节点"""
+        node_id = _nid(node_type, label)
+        if node_id not in self._node_ids:
+            self._node_ids.add(node_id)
+            self.nodes.append(_Node(node_id, label, node_type, group))
+        return node_id
+    
+    def add_edge(self, source_id: str, target_id: str, label: str):
+        """添加边（相同的边只添加一次，边记录本身即去重的键）"""
+        edge = _Edge(source_id, target_id, label)
+        if edge not in self._edge_keys:
+            self._edge_keys.add(edge)
+            self.edges.append(edge)
+    
+    def link(self, source_id: str, items: List[str], node_type: str, group: str, edge_label: str):
+        """为items的每一项添加（或复用）节点，以及从source_id指向它的边"""
+        node, add_edge = self.node, self.add_edge
+        for item in items:
+            add_edge(source_id, node(item, node_type, group), edge_label)
+    
+    def result(self) -> Dict[str, Any]:
+        return {
+            "nodes": [{"id": n.id, "label": n.label, "type": n.type, "group": n.group} for n in self.nodes],
+            "edges": [{"from": e.src, "to": e.dst, "label": e.label} for e in self.edges],
+        }
 
 
 class SubgraphAPI:
     """子图查询统一API"""
     
-    def __init__(self):
-        self.retriever = GraphRetriever()
+    # 食材/标签/口味子图：每个中心实体展示的菜品数，以及每道菜展示的标签/口味数
+    # （截取在检索的Cypher中完成，用不到的属性传0，不经过驱动传输）
+    DISHES_PER_ENTITY = 15
+    FIELD_LIMITS = {
+        "Ingredient": {"tags_per_dish": 3, "flavors_per_dish": 0},
+        "Tag": {"tags_per_dish": 0, "flavors_per_dish": 2},
+        "Flavor": {"tags_per_dish": 2},
+    }
+    
+    def __init__(self, retriever: GraphRetriever = None, cache_size: int = 512, cache_ttl: float = 300):
+        """
+        Args:
+            retriever: 复用已有的图谱检索器（如GraphRAGSystem中的），不传则新建
+            cache_size: 结果缓存的最大条目数
+            cache_ttl: 结果缓存的过期时间（秒）
+        """
+        self.retriever = retriever if retriever is not None else GraphRetriever()
+        
+        # 子图类型 -> 构建函数（新增子图类型只需在这里登记）
+        self._dispatch = {
+            "Dish": self._query_dish_subgraph,
+            "Ingredient": self._query_ingredient_subgraph,
+            "Tag": self._query_tag_subgraph,
+            "Flavor": self._query_flavor_subgraph,
+            "Similar": self._query_similar_subgraph,
+            "UserPreference": self._query_user_preference_subgraph,
+            "MultiHop": self._query_multihop_subgraph,
+        }
+        
+        # 结果缓存：(子图类型, 实体, 深度) -> (过期时刻, 图数据)，LRU淘汰 + TTL过期
+        # 返回的是共享对象，调用方不应修改；实例可能被多个会话共用，读写加锁
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_ttl = cache_ttl
+        self._cache_lock = threading.Lock()
+    
+    # 不进结果缓存的子图类型：用户偏好子图随每次搜索/做过/喜欢和偏好更新变化，缓存会让用户看到过期的偏好图
+    _UNCACHED_TYPES = frozenset({"UserPreference"})
+    
+    def _cache_get(self, key):
+        """查缓存，未命中、已过期或类型不缓存时返回None"""
+        if key[0] in self._UNCACHED_TYPES:
+            return None
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+    
+    def _cache_put(self, key, result):
+        """写缓存（查询失败的结果和_UNCACHED_TYPES中的类型不缓存）"""
+        if result.get('error') or key[0] in self._UNCACHED_TYPES:
+            return
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic() + self._cache_ttl, result)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
     
     def query_subgraph(self, subgraph_type: str, entity: str, depth: int = 1) -> Dict[str, Any]:
         """
@@ -26,396 +138,202 @@ class SubgraphAPI:
         Returns:
             Dict: 包含 nodes 和 edges 的图数据
         """
+        key = (subgraph_type, entity, depth)
+        result = self._cache_get(key)
+        if result is None:
+            result = self._query_subgraph(subgraph_type, entity, depth)
+            self._cache_put(key, result)
+        return result
+    
+    def _query_subgraph(self, subgraph_type: str, entity: str, depth: int) -> Dict[str, Any]:
+        """按类型分派子图查询（不经过缓存）"""
+        query = self._dispatch.get(subgraph_type)
+        if query is None:
+            return {"error": f"未知的子图类型: {subgraph_type}", "nodes": [], "edges": []}
         try:
-            if subgraph_type == "Dish":
-                return self._query_dish_subgraph(entity, depth)
-            elif subgraph_type == "Ingredient":
-                return self._query_ingredient_subgraph(entity, depth)
-            elif subgraph_type == "Tag":
-                return self._query_tag_subgraph(entity, depth)
-            elif subgraph_type == "Flavor":
-                return self._query_flavor_subgraph(entity, depth)
-            elif subgraph_type == "Similar":
-                return self._query_similar_subgraph(entity, depth)
-            elif subgraph_type == "UserPreference":
-                return self._query_user_preference_subgraph(entity, depth)
-            elif subgraph_type == "MultiHop":
-                return self._query_multihop_subgraph(entity, depth)
-            else:
-                return {"error": f"未知的子图类型: {subgraph_type}", "nodes": [], "edges": []}
+            return query(entity, depth)
         except Exception as e:
             return {"error": str(e), "nodes": [], "edges": []}
     
-    def _query_dish_subgraph(self, dish_name: str, depth: int) -> Dict[str, Any]:
-        """查询菜品子图"""
-        info = self.retriever.search_by_dish(dish_name, depth)
-        
-        nodes = []
-        edges = []
-        node_id_map = {}
-        
-        # 添加中心菜品节点
-        dish_id = f"dish_{dish_name}"
-        nodes.append({
-            "id": dish_id,
-            "label": dish_name,
-            "type": "Dish",
-            "group": "dish"
-        })
-        node_id_map[dish_name] = dish_id
-        
-        # 添加食材节点和边
-        for i, ingredient in enumerate(info.get('ingredients', [])):
-            ing_id = f"ingredient_{i}"
-            nodes.append({
-                "id": ing_id,
-                "label": ingredient,
-                "type": "Ingredient",
-                "group": "ingredient"
-            })
-            edges.append({
-                "from": dish_id,
-                "to": ing_id,
-                "label": "需要食材"
-            })
-        
-        # 添加调料节点和边
-        for i, condiment in enumerate(info.get('condiments', [])):
-            cond_id = f"condiment_{i}"
-            nodes.append({
-                "id": cond_id,
-                "label": condiment,
-                "type": "Condiment",
-                "group": "condiment"
-            })
-            edges.append({
-                "from": dish_id,
-                "to": cond_id,
-                "label": "需要调料"
-            })
-        
-        # 添加标签节点和边
-        for i, tag in enumerate(info.get('tags', [])):
-            tag_id = f"tag_{i}"
-            nodes.append({
-                "id": tag_id,
-                "label": tag,
-                "type": "Tag",
-                "group": "tag"
-            })
-            edges.append({
-                "from": dish_id,
-                "to": tag_id,
-                "label": "标签"
-            })
-        
-        # 添加口味节点和边
-        for i, flavor in enumerate(info.get('flavors', [])):
-            flavor_id = f"flavor_{i}"
-            nodes.append({
-                "id": flavor_id,
-                "label": flavor,
-                "type": "Flavor",
-                "group": "flavor"
-            })
-            edges.append({
-                "from": dish_id,
-                "to": flavor_id,
-                "label": "口味"
-            })
+    def query_subgraphs_batch(self, requests: List[Tuple[str, str]], depth: int = 1) -> List[Dict[str, Any]]:
+        """
+        批量子图查询：按类型分组，每种类型只发一次批量检索（UNWIND），再在本地组装节点和边
         
-        # 添加相似菜品节点和边
-        for i, similar in enumerate(info.get('similar_dishes', [])):
-            similar_id = f"similar_{i}"
-            nodes.append({
-                "id": similar_id,
-                "label": similar,
-                "type": "Dish",
-                "group": "dish"
-            })
-            edges.append({
-                "from": dish_id,
-                "to": similar_id,
-                "label": "相似"
-            })
+        Args:
+            requests: [(子图类型, 实体名称), ...]
+            depth: 查询深度（默认1）
         
-        return {"nodes": nodes, "edges": edges}
+        Returns:
+            List[Dict]: 与requests一一对应的图数据
+        """
+        # 支持批量检索的类型及其批量检索函数（子图由self._dispatch中的构建函数用预取数据组装）
+        batch_fetchers = {
+            "Dish": lambda names: self.retriever.search_by_dishes(names, depth),
+            "Ingredient": lambda names: self.retriever.search_by_ingredients(
+                names, limit=self.DISHES_PER_ENTITY, **self.FIELD_LIMITS["Ingredient"]),
+            "Tag": lambda names: self.retriever.search_by_tags(
+                names, limit=self.DISHES_PER_ENTITY, **self.FIELD_LIMITS["Tag"]),
+            "Flavor": lambda names: self.retriever.search_by_flavors(
+                names, limit=self.DISHES_PER_ENTITY, **self.FIELD_LIMITS["Flavor"]),
+        }
+        
+        # 已缓存的直接取出，只对未命中的实体发起批量检索
+        cached = {}
+        buckets = {}
+        for subgraph_type, entity in requests:
+            key = (subgraph_type, entity, depth)
+            result = self._cache_get(key)
+            if result is not None:
+                cached[key] = result
+            elif subgraph_type in batch_fetchers:
+                buckets.setdefault(subgraph_type, []).append(entity)
+        
+        prefetched = {}
+        for subgraph_type, names in buckets.items():
+            try:
+                prefetched[subgraph_type] = batch_fetchers[subgraph_type](names)
+            except Exception as e:
+                prefetched[subgraph_type] = e
+        
+        results = []
+        for subgraph_type, entity in requests:
+            key = (subgraph_type, entity, depth)
+            if key in cached:
+                results.append(cached[key])
+                continue
+            data = prefetched.get(subgraph_type)
+            if data is None:
+                # 没有批量检索的类型逐个查询
+                results.append(self.query_subgraph(subgraph_type, entity, depth))
+                continue
+            if isinstance(data, Exception):
+                result = {"error": str(data), "nodes": [], "edges": []}
+            else:
+                try:
+                    result = self._dispatch[subgraph_type](entity, depth, data[entity])
+                except Exception as e:
+                    result = {"error": str(e), "nodes": [], "edges": []}
+            self._cache_put(key, result)
+            cached[key] = result
+            results.append(result)
+        return results
     
-    def _query_ingredient_subgraph(self, ingredient_name: str, depth: int) -> Dict[str, Any]:
-        """查询食材子图"""
-        dishes = self.retriever.search_by_ingredient(ingredient_name, limit=15)
-        
-        nodes = []
-        edges = []
-        
-        # 添加中心食材节点
-        ing_id = f"ingredient_{ingredient_name}"
-        nodes.append({
-            "id": ing_id,
-            "label": ingredient_name,
-            "type": "Ingredient",
-            "group": "ingredient"
-        })
-        
-        # 添加相关菜品节点和边
-        for i, dish_info in enumerate(dishes):
-            dish_name = dish_info.get('dish')
-            dish_id = f"dish_{i}"
-            nodes.append({
-                "id": dish_id,
-                "label": dish_name,
-                "type": "Dish",
-                "group": "dish"
-            })
-            edges.append({
-                "from": ing_id,
-                "to": dish_id,
-                "label": "可做"
-            })
-            
-            # 添加菜品的标签
-            for j, tag in enumerate(dish_info.get('tags', [])[:3]):
-                tag_id = f"tag_{i}_{j}"
-                nodes.append({
-                    "id": tag_id,
-                    "label": tag,
-                    "type": "Tag",
-                    "group": "tag"
-                })
-                edges.append({
-                    "from": dish_id,
-                    "to": tag_id,
-                    "label": "标签"
-                })
-        
-        return {"nodes": nodes, "edges": edges}
+    def _query_dish_subgraph(self, dish_name: str, depth: int, info: Dict = None) -> Dict[str, Any]:
+        """查询菜品子图（info为预取的菜品信息时不再查询）"""
+        if info is None:
+            info = self.retriever.search_by_dish(dish_name, depth)
+        
+        # 中心菜品节点
+        builder = _SubgraphBuilder()
+        dish_id = builder.node(dish_name, "Dish", "dish")
+        
+        # 食材、调料、标签、口味、相似菜品节点和边
+        builder.link(dish_id, info.get('ingredients', []), "Ingredient", "ingredient", "需要食材")
+        builder.link(dish_id, info.get('condiments', []), "Condiment", "condiment", "需要调料")
+        builder.link(dish_id, info.get('tags', []), "Tag", "tag", "标签")
+        builder.link(dish_id, info.get('flavors', []), "Flavor", "flavor", "口味")
+        builder.link(dish_id, info.get('similar_dishes', []), "Dish", "dish", "相似")
+        
+        return builder.result()
     
-    def _query_tag_subgraph(self, tag_name: str, depth: int) -> Dict[str, Any]:
-        """查询标签子图"""
-        dishes = self.retriever.search_by_tag(tag_name, limit=15)
-        
-        nodes = []
-        edges = []
-        
-        # 添加中心标签节点
-        tag_id = f"tag_{tag_name}"
-        nodes.append({
-            "id": tag_id,
-            "label": tag_name,
-            "type": "Tag",
-            "group": "tag"
-        })
-        
-        # 添加相关菜品节点和边
-        for i, dish_info in enumerate(dishes):
-            dish_name = dish_info.get('dish')
-            dish_id = f"dish_{i}"
-            nodes.append({
-                "id": dish_id,
-                "label": dish_name,
-                "type": "Dish",
-                "group": "dish"
-            })
-            edges.append({
-                "from": tag_id,
-                "to": dish_id,
-                "label": "包含"
-            })
-            
-            # 添加菜品的口味
-            for j, flavor in enumerate(dish_info.get('flavors', [])[:2]):
-                flavor_id = f"flavor_{i}_{j}"
-                nodes.append({
-                    "id": flavor_id,
-                    "label": flavor,
-                    "type": "Flavor",
-                    "group": "flavor"
-                })
-                edges.append({
-                    "from": dish_id,
-                    "to": flavor_id,
-                    "label": "口味"
-                })
-        
-        return {"nodes": nodes, "edges": edges}
+    def _dishes_subgraph(self, center_label: str, center_type: str, center_group: str,
+                         dishes: List[Dict], center_edge: str, attr: str,
+                         attr_type: str, attr_group: str, attr_edge: str) -> Dict[str, Any]:
+        """以食材/标签/口味为中心的子图：中心 -> 菜品 -> 菜品的属性（标签或口味，已在检索时截取，多个菜品共用同一节点）"""
+        builder = _SubgraphBuilder()
+        center_id = builder.node(center_label, center_type, center_group)
+        
+        for dish_info in dishes:
+            dish_id = builder.node(dish_info.get('dish'), "Dish", "dish")
+            builder.add_edge(center_id, dish_id, center_edge)
+            builder.link(dish_id, dish_info.get(attr, []), attr_type, attr_group, attr_edge)
+        
+        return builder.result()
     
-    def _query_flavor_subgraph(self, flavor_name: str, depth: int) -> Dict[str, Any]:
-        """查询口味子图"""
-        dishes = self.retriever.search_by_flavor(flavor_name, limit=15)
-        
-        nodes = []
-        edges = []
-        
-        # 添加中心口味节点
-        flavor_id = f"flavor_{flavor_name}"
-        nodes.append({
-            "id": flavor_id,
-            "label": flavor_name,
-            "type": "Flavor",
-            "group": "flavor"
-        })
-        
-        # 添加相关菜品节点和边
-        for i, dish_info in enumerate(dishes):
-            dish_name = dish_info.get('dish')
-            dish_id = f"dish_{i}"
-            nodes.append({
-                "id": dish_id,
-                "label": dish_name,
-                "type": "Dish",
-                "group": "dish"
-            })
-            edges.append({
-                "from": flavor_id,
-                "to": dish_id,
-                "label": "具有"
-            })
-            
-            # 添加菜品的标签
-            for j, tag in enumerate(dish_info.get('tags', [])[:2]):
-                tag_id = f"tag_{i}_{j}"
-                nodes.append({
-                    "id": tag_id,
-                    "label": tag,
-                    "type": "Tag",
-                    "group": "tag"
-                })
-                edges.append({
-                    "from": dish_id,
-                    "to": tag_id,
-                    "label": "标签"
-                })
-        
-        return {"nodes": nodes, "edges": edges}
+    def _query_ingredient_subgraph(self, ingredient_name: str, depth: int, dishes: List[Dict] = None) -> Dict[str, Any]:
+        """查询食材子图（dishes为预取的菜品列表时不再查询）"""
+        if dishes is None:
+            dishes = self.retriever.search_by_ingredient(ingredient_name, limit=self.DISHES_PER_ENTITY,
+                                                         **self.FIELD_LIMITS["Ingredient"])
+        
+        # 中心食材 -> 相关菜品 -> 菜品的前3个标签
+        return self._dishes_subgraph(ingredient_name, "Ingredient", "ingredient",
+                                     dishes, "可做", 'tags', "Tag", "tag", "标签")
+    
+    def _query_tag_subgraph(self, tag_name: str, depth: int, dishes: List[Dict] = None) -> Dict[str, Any]:
+        """查询标签子图（dishes为预取的菜品列表时不再查询）"""
+        if dishes is None:
+            dishes = self.retriever.search_by_tag(tag_name, limit=self.DISHES_PER_ENTITY,
+                                                  **self.FIELD_LIMITS["Tag"])
+        
+        # 中心标签 -> 相关菜品 -> 菜品的前2个口味
+        return self._dishes_subgraph(tag_name, "Tag", "tag",
+                                     dishes, "包含", 'flavors', "Flavor", "flavor", "口味")
+    
+    def _query_flavor_subgraph(self, flavor_name: str, depth: int, dishes: List[Dict] = None) -> Dict[str, Any]:
+        """查询口味子图（dishes为预取的菜品列表时不再查询）"""
+        if dishes is None:
+            dishes = self.retriever.search_by_flavor(flavor_name, limit=self.DISHES_PER_ENTITY,
+                                                     **self.FIELD_LIMITS["Flavor"])
+        
+        # 中心口味 -> 相关菜品 -> 菜品的前2个标签
+        return self._dishes_subgraph(flavor_name, "Flavor", "flavor",
+                                     dishes, "具有", 'tags', "Tag", "tag", "标签")
     
     def _query_similar_subgraph(self, dish_name: str, depth: int) -> Dict[str, Any]:
         """查询相似菜品子图"""
         similar_dishes = self.retriever.find_similar_dishes(dish_name, limit=10)
         
-        nodes = []
-        edges = []
+        # 中心菜品节点
+        builder = _SubgraphBuilder()
+        dish_id = builder.node(dish_name, "Dish", "dish")
         
-        # 添加中心菜品节点
-        dish_id = f"dish_{dish_name}"
-        nodes.append({
-            "id": dish_id,
-            "label": dish_name,
-            "type": "Dish",
-            "group": "dish"
-        })
+        # 相似菜品节点和边，以及共同特征节点（多个相似菜品共用同一特征节点）
+        for similar_dish, score, features in similar_dishes:
+            similar_id = builder.node(similar_dish, "Dish", "dish")
+            builder.add_edge(dish_id, similar_id, f"相似度:{score}")
+            builder.link(similar_id, features[:3], "Feature", "feature", "共同点")
         
-        # 添加相似菜品节点和边
-        for i, (similar_dish, score, features) in enumerate(similar_dishes):
-            similar_id = f"similar_{i}"
-            nodes.append({
-                "id": similar_id,
-                "label": similar_dish,
-                "type": "Dish",
-                "group": "dish"
-            })
-            edges.append({
-                "from": dish_id,
-                "to": similar_id,
-                "label": f"相似度:{score}"
-            })
-            
-            # 添加共同特征节点
-            for j, feature in enumerate(features[:3]):
-                feature_id = f"feature_{i}_{j}"
-                nodes.append({
-                    "id": feature_id,
-                    "label": feature,
-                    "type": "Feature",
-                    "group": "feature"
-                })
-                edges.append({
-                    "from": similar_id,
-                    "to": feature_id,
-                    "label": "共同点"
-                })
-        
-        return {"nodes": nodes, "edges": edges}
+        return builder.result()
     
     def _query_user_preference_subgraph(self, user_id: str, depth: int) -> Dict[str, Any]:
         """查询用户偏好子图"""
         user_data = self.retriever.get_user_preference_dishes(user_id, limit=10)
         
-        nodes = []
-        edges = []
-        
-        # 添加中心用户节点
-        user_node_id = f"user_{user_id}"
-        nodes.append({
-            "id": user_node_id,
-            "label": user_id,
-            "type": "User",
-            "group": "user"
-        })
+        # 中心用户节点
+        builder = _SubgraphBuilder()
+        user_node_id = builder.node(user_id, "User", "user")
         
-        # 添加用户历史菜品
-        history = user_data.get('history', [])
-        for i, record in enumerate(history[:10]):
-            dish_name = record.get('dish')
-            action = record.get('action', 'unknown')
-            dish_id = f"dish_{i}"
-            nodes.append({
-                "id": dish_id,
-                "label": dish_name,
-                "type": "Dish",
-                "group": "dish"
-            })
-            edges.append({
-                "from": user_node_id,
-                "to": dish_id,
-                "label": action
-            })
+        # 用户历史菜品（边上标注行为，同一道菜的多种行为共用一个节点）
+        for record in user_data.get('history', [])[:10]:
+            dish_id = builder.node(record.get('dish'), "Dish", "dish")
+            builder.add_edge(user_node_id, dish_id, record.get('action', 'unknown'))
         
-        # 添加用户偏好（口味、标签）
+        # 用户偏好（口味、标签）
         preferences = user_data.get('preferences', {})
+        builder.link(user_node_id, preferences.get('flavors', [])[:5], "Flavor", "flavor", "喜欢口味")
+        builder.link(user_node_id, preferences.get('tags', [])[:5], "Tag", "tag", "偏好标签")
         
-        # 添加口味偏好
-        for i, flavor in enumerate(preferences.get('flavors', [])[:5]):
-            flavor_id = f"pref_flavor_{i}"
-            nodes.append({
-                "id": flavor_id,
-                "label": flavor,
-                "type": "Flavor",
-                "group": "flavor"
-            })
-            edges.append({
-                "from": user_node_id,
-                "to": flavor_id,
-                "label": "喜欢口味"
-            })
-        
-        # 添加标签偏好
-        for i, tag in enumerate(preferences.get('tags', [])[:5]):
-            tag_id = f"pref_tag_{i}"
-            nodes.append({
-                "id": tag_id,
-                "label": tag,
-                "type": "Tag",
-                "group": "tag"
-            })
-            edges.append({
-                "from": user_node_id,
-                "to": tag_id,
-                "label": "偏好标签"
-            })
-        
-        return {"nodes": nodes, "edges": edges}
+        return builder.result()
     
     def _query_multihop_subgraph(self, entity_description: str, depth: int) -> Dict[str, Any]:
-        """查询多跳子图（简化版）"""
-        # 简化实现：尝试将输入解析为菜品名，然后进行多跳查询
-        # 实际应用中可以使用NLP解析entity_description
-        
-        # 默认尝试作为菜品查询
+        """查询多跳子图：以输入为起点菜品，在图数据库内做多跳遍历"""
+        # 实际应用中可以使用NLP解析entity_description，这里直接作为菜品名
         try:
-            info = self.retriever.search_by_dish(entity_description, depth=min(depth, 2))
-            return self._query_dish_subgraph(entity_description, depth)
-        except:
-            return {"error": "无法解析多跳查询", "nodes": [], "edges": []}
+            rows = self.retriever.bfs_from_dish(entity_description, depth=max(depth, 2))
+        except Exception as e:
+            return {"error": f"无法解析多跳查询: {e}", "nodes": [], "edges": []}
+        
+        builder = _SubgraphBuilder()
+        builder.node(entity_description, "Dish", "dish")
+        for row in rows:
+            source_label = row['source_label'] or "Node"
+            target_label = row['target_label'] or "Node"
+            source_id = builder.node(row['source'], source_label, source_label.lower())
+            target_id = builder.node(row['target'], target_label, target_label.lower())
+            builder.add_edge(source_id, target_id, row['rel'])
+        
+        return builder.result()
 
 
 if __name__ == "__main__":
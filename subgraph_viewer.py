@@ -4,10 +4,203 @@
 为RecipeQA系统提供可视化子图查询功能
 """
 
+import os
+import json
+import string
+import hashlib
+import threading
+from collections import OrderedDict
 import streamlit as st
 from typing import Dict, Any, Optional
 import streamlit.components.v1 as components
 from subgraph_api import SubgraphAPI
+from graph_retriever import GraphRetriever
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+# vis-network脚本：static/下有本地副本时导入时读取一次并内联到页面，
+# 每次渲染不再请求CDN；没有本地副本时退回CDN
+_VIS_JS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'vis-network.min.js')
+_VIS_CDN_URL = "https://unpkg.com/vis-network/standalone/umd/vis-network.min.js"
+
+
+def _load_vis_script() -> str:
+    """返回引入vis-network的<script>标签"""
+    try:
+        with open(_VIS_JS_PATH, 'r', encoding='utf-8') as f:
+            source = f.read()
+    except OSError:
+        return f'<script type="text/javascript" src="{_VIS_CDN_URL}"></script>'
+    return '<script type="text/javascript">' + source.replace('</script', '<\\/script') + '</script>'
+
+
+# vis-network页面模板，$vis_script为上面的脚本标签，$nodes/$edges为节点和边的JSON
+_VIS_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    $vis_script
+    <style type="text/css">
+        #mynetwork {
+            width: 100%;
+            height: 550px;
+            border: 1px solid #e0e0e0;
+            border-radius: 8px;
+            background-color: #fafafa;
+        }
+    </style>
+</head>
+<body>
+    <div id="mynetwork"></div>
+    <script type="text/javascript">
+        // 节点和边按列传输（各属性一个数组），在这里展开为vis-network的行数据
+        var nodeCols = $nodes;
+        var edgeCols = $edges;
+        var nodes = new vis.DataSet(nodeCols.ids.map(function(id, i) {
+            return {
+                id: id,
+                label: nodeCols.labels[i],
+                color: nodeCols.colors[i],
+                font: {size: 14, color: '#333333'},
+                shape: 'dot',
+                size: nodeCols.sizes[i]
+            };
+        }));
+        var edges = new vis.DataSet(edgeCols.from.map(function(from, i) {
+            return {
+                from: from,
+                to: edgeCols.to[i],
+                label: edgeCols.labels[i],
+                arrows: 'to',
+                font: {size: 10, align: 'middle'}
+            };
+        }));
+        
+        var container = document.getElementById('mynetwork');
+        var data = {
+            nodes: nodes,
+            edges: edges
+        };
+        
+        var options = {
+            nodes: {
+                borderWidth: 2,
+                borderWidthSelected: 3,
+                shadow: true
+            },
+            edges: {
+                width: 2,
+                color: {color: '#848484', highlight: '#FF6B6B'},
+                smooth: {
+                    type: 'continuous',
+                    roundness: 0.5
+                }
+            },
+            physics: {
+                enabled: true,
+                stabilization: {
+                    enabled: true,
+                    iterations: 200,
+                    fit: true
+                },
+                barnesHut: {
+                    gravitationalConstant: -8000,
+                    centralGravity: 0.3,
+                    springLength: 150,
+                    springConstant: 0.04
+                }
+            },
+            interaction: {
+                hover: true,
+                tooltipDelay: 200,
+                navigationButtons: true,
+                keyboard: true
+            }
+        };
+        
+        // 大图改用forceAtlas2Based并限制最大速度，以更少的迭代收敛
+        if (nodes.length > 200) {
+            options.physics.solver = 'forceAtlas2Based';
+            options.physics.maxVelocity = 50;
+        }
+        
+        var network = new vis.Network(container, data, options);
+        
+        // 布局稳定后关闭物理模拟，避免浏览器持续计算
+        network.once("stabilizationIterationsDone", function() {
+            network.setOptions({physics: {enabled: false}});
+        });
+        
+        // 节点点击事件
+        network.on("click", function(params) {
+            if (params.nodes.length > 0) {
+                var nodeId = params.nodes[0];
+                var node = nodes.get(nodeId);
+                console.log("Clicked node:", node);
+            }
+        });
+    </script>
+</body>
+</html>
+"""
+
+# 导入时编译一次，并先填入脚本标签（其中的"$"转义为"$$"），每次渲染只替换节点和边
+_VIS_TEMPLATE = string.Template(_VIS_PAGE.replace("$vis_script", _load_vis_script().replace("$", "$$")))
+
+
+def _to_script_json(data) -> str:
+    """序列化为可直接嵌入<script>的紧凑JSON（转义"</"，避免标签中的文本提前结束脚本）"""
+    if ORJSON_AVAILABLE:
+        text = orjson.dumps(data).decode('utf-8')
+    else:
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return text.replace("</", "<\\/")
+
+
+# 生成的页面HTML按节点/边JSON的摘要缓存（LRU，进程内共享）：rerun时同一子图不再重新拼接页面
+_HTML_CACHE_SIZE = 64
+_html_cache = OrderedDict()
+_html_cache_lock = threading.Lock()
+
+
+def _render_vis_page(nodes_json: dict, edges_json: dict) -> str:
+    """由按列存储的节点和边生成完整页面（命中缓存时直接返回）"""
+    nodes_text = _to_script_json(nodes_json)
+    edges_text = _to_script_json(edges_json)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(nodes_text.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(edges_text.encode('utf-8'))
+    key = digest.digest()
+    
+    with _html_cache_lock:
+        html = _html_cache.get(key)
+        if html is not None:
+            _html_cache.move_to_end(key)
+            return html
+    
+    html = _VIS_TEMPLATE.substitute(nodes=nodes_text, edges=edges_text)
+    with _html_cache_lock:
+        _html_cache[key] = html
+        if len(_html_cache) > _HTML_CACHE_SIZE:
+            _html_cache.popitem(last=False)
+    return html
+
+
+@st.cache_resource(show_spinner=False)
+def _get_graph_retriever():
+    """进程内共用的图谱检索器，不随每次rerun重建"""
+    return GraphRetriever()
+
+
+@st.cache_resource(show_spinner=False)
+def _get_subgraph_api():
+    """所有查看器共用一个SubgraphAPI（连同其结果缓存），不随每次rerun重建"""
+    return SubgraphAPI(retriever=_get_graph_retriever())
 
 
 class SubgraphViewer:
@@ -53,7 +246,7 @@ class SubgraphViewer:
     }
     
     def __init__(self, unique_id: str = "default", retrieval_results: dict = None):
-        self.api = SubgraphAPI()
+        self._api = None  # 首次查询时才获取（没有实体时render直接返回，不初始化检索器）
         self.unique_id = unique_id
         self.retrieval_results = retrieval_results or {}
         
@@ -62,6 +255,16 @@ class SubgraphViewer:
             st.session_state.subgraph_visible = {}
         if 'subgraph_data' not in st.session_state:
             st.session_state.subgraph_data = {}
+        if 'subgraph_prefetched' not in st.session_state:
+            # 已预取过子图的消息unique_id，rerun时不再重复预取
+            st.session_state.subgraph_prefetched = set()
+    
+    @property
+    def api(self) -> SubgraphAPI:
+        """共享的SubgraphAPI（延迟获取）"""
+        if self._api is None:
+            self._api = _get_subgraph_api()
+        return self._api
     
     def _extract_entities(self):
         """从检索结果中提取实体"""
@@ -77,18 +280,17 @@ class SubgraphViewer:
         
         # 从优化后的查询中提取实体
         optimized = self.retrieval_results.get('optimized', {})
-        if optimized:
-            opt_entities = optimized.get('entities', {})
-            entities['dishes'] = opt_entities.get('dishes', [])
-            entities['ingredients'] = opt_entities.get('ingredients', [])
-            entities['tags'] = opt_entities.get('scenes', [])  # scenes 对应 tags
-            entities['flavors'] = opt_entities.get('flavors', [])
+        # 用dict做有序去重（O(1)成员判断），并且不再直接引用、修改检索结果里的列表
+        opt_entities = optimized.get('entities', {}) if optimized else {}
+        dishes = dict.fromkeys(opt_entities.get('dishes', []))
+        entities['ingredients'] = list(dict.fromkeys(opt_entities.get('ingredients', [])))
+        entities['tags'] = list(dict.fromkeys(opt_entities.get('scenes', [])))  # scenes 对应 tags
+        entities['flavors'] = list(dict.fromkeys(opt_entities.get('flavors', [])))
         
         # 从检索结果中提取菜品
         combined_results = self.retrieval_results.get('combined_results', [])
-        for dish, score, reason in combined_results[:5]:
-            if dish and dish not in entities['dishes']:
-                entities['dishes'].append(dish)
+        dishes.update((dish, None) for dish, score, reason in combined_results[:5] if dish)
+        entities['dishes'] = list(dishes)
         
         return entities
     
@@ -102,6 +304,9 @@ class SubgraphViewer:
         if not any(entities.values()):
             return
         
+        # 一次批量查询预取所有按钮对应的子图（每种类型一次往返）
+        self._prefetch_subgraphs(entities)
+        
         # 添加分隔线
         st.markdown("---")
         
@@ -154,10 +359,28 @@ class SubgraphViewer:
         if st.session_state.subgraph_visible.get(self.unique_id, False) and st.session_state.subgraph_data.get(self.unique_id):
             self._render_subgraph_modal()
     
+    def _prefetch_subgraphs(self, entities: Dict[str, list], depth: int = 1):
+        """批量预取可见实体的子图，只用于预热SubgraphAPI自身的缓存
+        
+        每条消息只预取一次（无论成败），避免每次rerun都重复发起查询
+        """
+        prefetched = st.session_state.subgraph_prefetched
+        if self.unique_id in prefetched:
+            return
+        prefetched.add(self.unique_id)
+        
+        requests = [
+            (subgraph_type, entity)
+            for key, subgraph_type in (('dishes', 'Dish'), ('ingredients', 'Ingredient'),
+                                       ('tags', 'Tag'), ('flavors', 'Flavor'))
+            for entity in entities[key][:10]
+        ]
+        self.api.query_subgraphs_batch(requests, depth)
+    
     def _query_and_show_subgraph(self, subgraph_type: str, entity: str):
         """查询并显示子图"""
         with st.spinner(f"正在查询 {subgraph_type} 子图..."):
-            # 调用API查询
+            # 预取过的子图直接命中SubgraphAPI的缓存
             result = self.api.query_subgraph(subgraph_type, entity, depth=1)
             
             if result.get('error'):
@@ -235,109 +458,21 @@ class SubgraphViewer:
             "feature": "#FFFFD2"
         }
         
-        # 转换节点数据
-        nodes_json = []
-        for node in nodes:
-            color = color_map.get(node.get('group', 'default'), "#CCCCCC")
-            nodes_json.append({
-                "id": node['id'],
-                "label": node['label'],
-                "color": color,
-                "font": {"size": 14, "color": "#333333"},
-                "shape": "dot",
-                "size": 20 if node.get('type') == 'Dish' else 15
-            })
-        
-        # 转换边数据
-        edges_json = []
-        for edge in edges:
-            edges_json.append({
-                "from": edge['from'],
-                "to": edge['to'],
-                "label": edge.get('label', ''),
-                "arrows": "to",
-                "font": {"size": 10, "align": "middle"}
-            })
-        
-        # 生成HTML
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <script type="text/javascript" src="https://unpkg.com/vis-network/standalone/umd/vis-network.min.js"></script>
-            <style type="text/css">
-                #mynetwork {{
-                    width: 100%;
-                    height: 550px;
-                    border: 1px solid #e0e0e0;
-                    border-radius: 8px;
-                    background-color: #fafafa;
-                }}
-            </style>
-        </head>
-        <body>
-            <div id="mynetwork"></div>
-            <script type="text/javascript">
-                var nodes = new vis.DataSet({nodes_json});
-                var edges = new vis.DataSet({edges_json});
-                
-                var container = document.getElementById('mynetwork');
-                var data = {{
-                    nodes: nodes,
-                    edges: edges
-                }};
-                
-                var options = {{
-                    nodes: {{
-                        borderWidth: 2,
-                        borderWidthSelected: 3,
-                        shadow: true
-                    }},
-                    edges: {{
-                        width: 2,
-                        color: {{color: '#848484', highlight: '#FF6B6B'}},
-                        smooth: {{
-                            type: 'continuous',
-                            roundness: 0.5
-                        }}
-                    }},
-                    physics: {{
-                        enabled: true,
-                        stabilization: {{
-                            iterations: 200
-                        }},
-                        barnesHut: {{
-                            gravitationalConstant: -8000,
-                            centralGravity: 0.3,
-                            springLength: 150,
-                            springConstant: 0.04
-                        }}
-                    }},
-                    interaction: {{
-                        hover: true,
-                        tooltipDelay: 200,
-                        navigationButtons: true,
-                        keyboard: true
-                    }}
-                }};
-                
-                var network = new vis.Network(container, data, options);
-                
-                // 节点点击事件
-                network.on("click", function(params) {{
-                    if (params.nodes.length > 0) {{
-                        var nodeId = params.nodes[0];
-                        var node = nodes.get(nodeId);
-                        console.log("Clicked node:", node);
-                    }}
-                }});
-            </script>
-        </body>
-        </html>
-        """
+        # 节点和边转为按列存储（每个属性一个数组），不再为每行重复键名和固定样式，
+        # 页面中的脚本再展开为vis-network需要的行数据
+        nodes_json = {
+            "ids": [node['id'] for node in nodes],
+            "labels": [node['label'] for node in nodes],
+            "colors": [color_map.get(node.get('group', 'default'), "#CCCCCC") for node in nodes],
+            "sizes": [20 if node.get('type') == 'Dish' else 15 for node in nodes]
+        }
+        edges_json = {
+            "from": [edge['from'] for edge in edges],
+            "to": [edge['to'] for edge in edges],
+            "labels": [edge.get('label', '') for edge in edges]
+        }
         
-        return html.replace("{nodes_json}", str(nodes_json).replace("'", '"')) \
-                   .replace("{edges_json}", str(edges_json).replace("'", '"'))
+        return _render_vis_page(nodes_json, edges_json)
 
 
 def render_subgraph_viewer(unique_id: str = "default", retrieval_results: dict = None):
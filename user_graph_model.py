@@ -21,15 +21,44 @@
 9. similar_to（菜品相似）
 """
 
-from py2neo import Graph, Node, Relationship
-import json
+from py2neo import Node
+from graph_db import get_graph, ensure_indexes, NEO4J_BATCH_SIZE
+from user_recommendation import invalidate_user_preference
+from user_preferences import pack_preferences
+import atexit
+import threading
+import weakref
+
+
+# 进程内存活的模型实例（弱引用，不阻止回收）：退出时统一刷新各自的行为写缓冲
+_live_models = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all_models():
+    """进程退出时刷新所有实例的行为写缓冲"""
+    for model in list(_live_models):
+        model.flush()
 
 
 class UserGraphModel:
     """用户图谱模型"""
     
-    def __init__(self):
-        self.g = Graph("bolt://127.0.0.1:7687", auth=("neo4j", "kurisu810975"))
+    def __init__(self, graph=None):
+        """
+        Args:
+            graph: 复用已有的Graph连接，不传则使用进程内共享的连接
+        """
+        self.g = graph if graph is not None else get_graph()
+        ensure_indexes(self.g)
+        
+        # 用户行为写缓冲：攒满FLUSH_SIZE条或等待FLUSH_INTERVAL秒后一次写入
+        self._pending_lock = threading.Lock()
+        self._pending = self._empty_pending()
+        self._pending_count = 0
+        self._flush_timer = None
+        self._retry_delay = self.FLUSH_INTERVAL  # 写入失败后重试刷新的等待（秒），连续失败时翻倍
+        _live_models.add(self)
         
         # 标签分类
         self.tags = {
@@ -60,115 +89,290 @@ class UserGraphModel:
         user = Node("User", 
                    user_id=user_id, 
                    name=user_name,
-                   preferences=json.dumps(preferences or {}, ensure_ascii=False))
+                   **pack_preferences(preferences))
         self.g.merge(user, "User", "user_id")
         return user
     
+    # 带分类节点的批量合并语句：标签无法参数化，按固定的三种标签预先生成，
+    # 调用时只查表，不在运行时拼接查询文本（其余值一律走$参数）
+    _MERGE_CATEGORY_CYPHER = {
+        label: f"""
+        UNWIND $rows AS r
+        MERGE (n:{label} {{name: r.name}})
+        SET n.category = r.category
+        """
+        for label in ("Tag", "Flavor", "Scene")
+    }
+    
+    def _merge_category_nodes(self, label, groups):
+        """
+        批量创建（合并）带分类的节点：一次UNWIND完成，不再逐个merge
+        
+        Args:
+            label: 节点标签（Tag/Flavor/Scene）
+            groups: {分类: [名称, ...]}
+        """
+        self.g.run(self._MERGE_CATEGORY_CYPHER[label], rows=self._category_rows(groups))
+    
+    # 静态分类体系一次写入：三类节点各一个子查询，全部名称和分类作为参数传入
+    _TAXONOMY_CYPHER = """
+    CALL {
+        UNWIND $tags AS r
+        MERGE (n:Tag {name: r.name})
+        SET n.category = r.category
+        RETURN count(n) as tag_count
+    }
+    CALL {
+        UNWIND $flavors AS r
+        MERGE (n:Flavor {name: r.name})
+        SET n.category = r.category
+        RETURN count(n) as flavor_count
+    }
+    CALL {
+        UNWIND $scenes AS r
+        MERGE (n:Scene {name: r.name})
+        SET n.category = r.category
+        RETURN count(n) as scene_count
+    }
+    RETURN tag_count, flavor_count, scene_count
+    """
+    
+    @staticmethod
+    def _category_rows(groups):
+        """{分类: [名称, ...]} -> [{name, category}, ...]"""
+        return [{"name": name, "category": category}
+                for category, names in groups.items() for name in names]
+    
+    def create_taxonomy_nodes(self):
+        """一次创建全部标签、口味、场景节点（一条语句），返回各类节点数"""
+        result = self.g.run(self._TAXONOMY_CYPHER,
+                            tags=self._category_rows(self.tags),
+                            flavors=self._category_rows(self.flavors),
+                            scenes=self._category_rows(self.scenes)).data()
+        counts = result[0] if result else {}
+        print(f"创建分类节点完成: {counts}")
+        return counts
+    
     def create_tag_nodes(self):
         """创建标签节点"""
-        for category, tags in self.tags.items():
-            for tag in tags:
-                tag_node = Node("Tag", name=tag, category=category)
-                self.g.merge(tag_node, "Tag", "name")
+        self._merge_category_nodes("Tag", self.tags)
         print(f"创建标签节点完成")
     
     def create_flavor_nodes(self):
         """创建口味节点"""
-        for category, flavors in self.flavors.items():
-            for flavor in flavors:
-                flavor_node = Node("Flavor", name=flavor, category=category)
-                self.g.merge(flavor_node, "Flavor", "name")
+        self._merge_category_nodes("Flavor", self.flavors)
         print(f"创建口味节点完成")
     
     def create_scene_nodes(self):
         """创建场景节点"""
-        for category, scenes in self.scenes.items():
-            for scene in scenes:
-                scene_node = Node("Scene", name=scene, category=category)
-                self.g.merge(scene_node, "Scene", "name")
+        self._merge_category_nodes("Scene", self.scenes)
         print(f"创建场景节点完成")
     
+    def link_dishes(self, mapping):
+        """
+        批量关联菜品与标签/口味/场景（一次查询完成，只关联已存在的节点）
+        
+        Args:
+            mapping: {菜品名: {"tags": [...], "flavors": [...], "scenes": [...]}}，缺少的键视为空
+        """
+        # 属性名去重（保持顺序），同一菜品重复的名称不再重复查找节点
+        rows = [
+            {
+                "dish": dish_name,
+                "tags": list(dict.fromkeys(attrs.get("tags", []))),
+                "flavors": list(dict.fromkeys(attrs.get("flavors", []))),
+                "scenes": list(dict.fromkeys(attrs.get("scenes", []))),
+            }
+            for dish_name, attrs in mapping.items()
+        ]
+        # 每个子查询以count(*)结尾，属性列表为空时也返回一行，不会中断外层
+        cypher = """
+        UNWIND $rows AS row
+        MATCH (d:Dish {name: row.dish})
+        CALL {
+            WITH d, row
+            UNWIND row.tags AS name
+            MATCH (t:Tag {name: name})
+            MERGE (d)-[:has_tag]->(t)
+            RETURN count(*) AS tag_links
+        }
+        CALL {
+            WITH d, row
+            UNWIND row.flavors AS name
+            MATCH (f:Flavor {name: name})
+            MERGE (d)-[:has_flavor]->(f)
+            RETURN count(*) AS flavor_links
+        }
+        CALL {
+            WITH d, row
+            UNWIND row.scenes AS name
+            MATCH (s:Scene {name: name})
+            MERGE (d)-[:suitable_for]->(s)
+            RETURN count(*) AS scene_links
+        }
+        RETURN d.name AS dish
+        """
+        return [record['dish'] for record in self.g.run(cypher, rows=rows).data()]
+    
     def link_dish_tags(self, dish_name, tags):
         """关联菜品和标签"""
-        dish = self.g.nodes.match("Dish", name=dish_name).first()
-        if not dish:
-            return
-        
-        for tag in tags:
-            tag_node = self.g.nodes.match("Tag", name=tag).first()
-            if tag_node:
-                rel = Relationship(dish, "has_tag", tag_node)
-                self.g.merge(rel)
+        self.link_dishes({dish_name: {"tags": tags}})
     
     def link_dish_flavors(self, dish_name, flavors):
         """关联菜品和口味"""
-        dish = self.g.nodes.match("Dish", name=dish_name).first()
-        if not dish:
-            return
-        
-        for flavor in flavors:
-            flavor_node = self.g.nodes.match("Flavor", name=flavor).first()
-            if flavor_node:
-                rel = Relationship(dish, "has_flavor", flavor_node)
-                self.g.merge(rel)
+        self.link_dishes({dish_name: {"flavors": flavors}})
     
     def link_dish_scenes(self, dish_name, scenes):
         """关联菜品和场景"""
-        dish = self.g.nodes.match("Dish", name=dish_name).first()
-        if not dish:
-            return
+        self.link_dishes({dish_name: {"scenes": scenes}})
+    
+    # 行为写缓冲的刷新条件：缓冲条数上限、首条行为进入后的最长等待（秒）
+    FLUSH_SIZE = NEO4J_BATCH_SIZE
+    FLUSH_INTERVAL = 0.2
+    FLUSH_RETRY_MAX = 30  # 写入失败后重试间隔的上限（秒）
+    
+    # 批量写入用户行为：同一(用户, 菜品)的多次搜索已在缓冲中合并为times
+    _FLUSH_SEARCHED_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (u:User {user_id: row.user_id}), (d:Dish {name: row.dish})
+    MERGE (u)-[r:searched]->(d)
+    ON CREATE SET r.count = row.times
+    ON MATCH SET r.count = COALESCE(r.count, 0) + row.times
+    """
+    _FLUSH_COOKED_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (u:User {user_id: row.user_id}), (d:Dish {name: row.dish})
+    MERGE (u)-[r:cooked]->(d)
+    SET r.rating = row.rating
+    """
+    _FLUSH_LIKED_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (u:User {user_id: row.user_id}), (d:Dish {name: row.dish})
+    MERGE (u)-[r:liked]->(d)
+    """
+    
+    @staticmethod
+    def _empty_pending():
+        """空缓冲：searched为(用户, 菜品)->次数，cooked为(用户, 菜品)->评分（后写覆盖），liked为(用户, 菜品)集合"""
+        return {'searched': {}, 'cooked': {}, 'liked': {}}
+    
+    def _enqueue(self, kind, key, value=None):
+        """行为写入缓冲，达到条数上限时立即刷新，否则确保有定时刷新"""
+        with self._pending_lock:
+            bucket = self._pending[kind]
+            if kind == 'searched':
+                bucket[key] = bucket.get(key, 0) + 1
+            else:
+                bucket[key] = value
+            self._pending_count += 1
+            full = self._pending_count >= self.FLUSH_SIZE
+            if not full and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.FLUSH_INTERVAL, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        if full:
+            self.flush()
+    
+    def flush(self):
+        """把缓冲中的用户行为写入图谱（每类行为一条UNWIND语句）"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, self._empty_pending()
+            self._pending_count = 0
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
         
-        for scene in scenes:
-            scene_node = self.g.nodes.match("Scene", name=scene).first()
-            if scene_node:
-                rel = Relationship(dish, "suitable_for", scene_node)
-                self.g.merge(rel)
+        # 每类行为单独写入：一类失败不影响其他类，失败的行为放回缓冲等下次刷新
+        written = set()
+        for kind, cypher, rows in (
+            ('searched', self._FLUSH_SEARCHED_CYPHER,
+             [{"user_id": u, "dish": d, "times": n} for (u, d), n in pending['searched'].items()]),
+            ('cooked', self._FLUSH_COOKED_CYPHER,
+             [{"user_id": u, "dish": d, "rating": rating} for (u, d), rating in pending['cooked'].items()]),
+            ('liked', self._FLUSH_LIKED_CYPHER,
+             [{"user_id": u, "dish": d} for (u, d) in pending['liked']]),
+        ):
+            if not rows:
+                continue
+            try:
+                self.g.run(cypher, rows=rows)
+            except Exception as e:
+                print(f"⚠️  用户行为写入失败（{kind}，{len(rows)}条，已放回缓冲）: {e}")
+                self._requeue(kind, pending[kind])
+            else:
+                written.add(kind)
+        
+        if len(written) == sum(1 for bucket in pending.values() if bucket):
+            with self._pending_lock:
+                self._retry_delay = self.FLUSH_INTERVAL
+        
+        # 只有做过/喜欢的菜真正写入后，偏好缓存才需要失效
+        for kind in written & {'cooked', 'liked'}:
+            for user_id in {u for u, _ in pending[kind]}:
+                invalidate_user_preference(user_id)
     
-    def record_user_search(self, user_id, dish_name):
-        """记录用户搜索"""
-        # 使用Cypher直接操作，更可靠
-        cypher = """
-        MATCH (u:User {user_id: $user_id}), (d:Dish {name: $dish_name})
-        MERGE (u)-[r:searched]->(d)
-        ON CREATE SET r.count = 1
-        ON MATCH SET r.count = COALESCE(r.count, 0) + 1
+    def _requeue(self, kind, failed):
         """
-        self.g.run(cypher, user_id=user_id, dish_name=dish_name)
+        把写入失败的行为合并回缓冲（搜索次数累加；评分等以缓冲中更新的记录为准），
+        并安排一次重试刷新：等待时间随连续失败翻倍（上限FLUSH_RETRY_MAX），数据库恢复后无需新行为也会写入
+        """
+        with self._pending_lock:
+            bucket = self._pending[kind]
+            for key, value in failed.items():
+                if kind == 'searched':
+                    bucket[key] = bucket.get(key, 0) + value
+                else:
+                    bucket.setdefault(key, value)
+            self._pending_count += len(failed)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self._retry_delay, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+                self._retry_delay = min(self._retry_delay * 2, self.FLUSH_RETRY_MAX)
+    
+    def record_user_search(self, user_id, dish_name):
+        """记录用户搜索（写缓冲，稍后批量写入；需要立即可见时调用flush）"""
+        self._enqueue('searched', (user_id, dish_name))
     
     def record_user_cooked(self, user_id, dish_name, rating=None):
-        """记录用户做过的菜"""
-        # 使用Cypher直接操作
-        cypher = """
-        MATCH (u:User {user_id: $user_id}), (d:Dish {name: $dish_name})
-        MERGE (u)-[r:cooked]->(d)
-        SET r.rating = $rating
-        """
-        self.g.run(cypher, user_id=user_id, dish_name=dish_name, rating=rating)
+        """记录用户做过的菜（写缓冲，稍后批量写入）"""
+        self._enqueue('cooked', (user_id, dish_name), rating)
     
     def record_user_liked(self, user_id, dish_name):
-        """记录用户喜欢的菜"""
-        # 使用Cypher直接操作
-        cypher = """
-        MATCH (u:User {user_id: $user_id}), (d:Dish {name: $dish_name})
-        MERGE (u)-[r:liked]->(d)
-        """
-        self.g.run(cypher, user_id=user_id, dish_name=dish_name)
+        """记录用户喜欢的菜（写缓冲，稍后批量写入）"""
+        self._enqueue('liked', (user_id, dish_name))
     
-    def calculate_dish_similarity(self):
-        """计算菜品相似度（基于共同的食材、调料、口味）"""
-        # 这个方法会比较耗时，建议离线计算
-        cypher = """
-        MATCH (d1:Dish)-[:need_ingredient]->(i:Ingredient)<-[:need_ingredient]-(d2:Dish)
-        WHERE d1.name < d2.name
-        WITH d1, d2, COUNT(i) as common_ingredients
-        WHERE common_ingredients >= 2
-        MERGE (d1)-[r:similar_to]-(d2)
-        SET r.score = common_ingredients
-        RETURN COUNT(r) as created
+    # 以给定菜品为起点计算相似关系（共同食材数>=2）
+    # both_sides为false时只处理d1.name < d2.name的一侧，全量分批计算时每对菜只计算一次
+    _SIMILARITY_CYPHER = """
+    UNWIND $names AS name
+    MATCH (d1:Dish {name: name})-[:need_ingredient]->(i:Ingredient)<-[:need_ingredient]-(d2:Dish)
+    WHERE d1 <> d2 AND ($both_sides OR d1.name < d2.name)
+    WITH d1, d2, COUNT(i) as common_ingredients
+    WHERE common_ingredients >= 2
+    MERGE (d1)-[r:similar_to]-(d2)
+    SET r.score = common_ingredients
+    RETURN COUNT(r) as created
+    """
+    
+    def update_dish_similarity(self, dish_name):
+        """增量更新单个菜品的相似关系（菜品新增或食材变化后调用），返回关系数"""
+        result = self.g.run(self._SIMILARITY_CYPHER, names=[dish_name], both_sides=True).data()
+        return result[0]['created'] if result else 0
+    
+    def calculate_dish_similarity(self, batch_size=NEO4J_BATCH_SIZE):
         """
-        result = self.g.run(cypher).data()
-        print(f"创建相似关系: {result[0]['created']}条")
-
+        计算菜品相似度（基于共同的食材）
+        
+        按菜品名分批执行，每批一个事务，避免一次性展开全部 菜品×食材×菜品 组合占满内存
+        """
+        # 这个方法会比较耗时，建议离线计算
+        names = [row['name'] for row in self.g.run("MATCH (d:Dish) RETURN d.name as name ORDER BY name").data()]
+        created = 0
+        for start in range(0, len(names), batch_size):
+            result = self.g.run(self._SIMILARITY_CYPHER, names=names[start:start + batch_size], both_sides=False).data()
+            created += result[0]['created'] if result else 0
+        print(f"创建相似关系: {created}条")
 
 # 示例：菜品标签映射
 DISH_TAG_MAPPING = {
@@ -223,21 +427,12 @@ if __name__ == "__main__":
     print("=" * 60)
     
     # 1. 创建标签、口味、场景节点（这些是静态的，只需创建一次）
-    print("\n1. 创建标签节点...")
-    model.create_tag_nodes()
-    
-    print("\n2. 创建口味节点...")
-    model.create_flavor_nodes()
-    
-    print("\n3. 创建场景节点...")
-    model.create_scene_nodes()
+    print("\n1-3. 创建标签、口味、场景节点...")
+    model.create_taxonomy_nodes()
     
     # 2. 关联菜品和标签（这些是静态的，只需创建一次）
     print("\n4. 关联菜品标签...")
-    for dish_name, attrs in DISH_TAG_MAPPING.items():
-        model.link_dish_tags(dish_name, attrs.get("tags", []))
-        model.link_dish_flavors(dish_name, attrs.get("flavors", []))
-        model.link_dish_scenes(dish_name, attrs.get("scenes", []))
+    for dish_name in model.link_dishes(DISH_TAG_MAPPING):
         print(f"   - {dish_name}")
     
     # 3. 计算菜品相似度（这是静态的，只需计算一次）
@@ -4,16 +4,22 @@
 动态创建和管理用户节点
 """
 
-from py2neo import Graph, Node
-import json
+from graph_db import get_graph, ensure_indexes
+from user_recommendation import invalidate_user_preference
+from user_preferences import PREFERENCE_LIST_FIELDS, pack_preferences, unpack_preferences
 from datetime import datetime
 
 
 class UserManager:
     """用户管理器 - 动态管理用户节点"""
     
-    def __init__(self):
-        self.g = Graph("bolt://127.0.0.1:7687", auth=("neo4j", "kurisu810975"))
+    def __init__(self, graph=None):
+        """
+        Args:
+            graph: 复用已有的Graph连接，不传则使用进程内共享的连接
+        """
+        self.g = graph if graph is not None else get_graph()
+        ensure_indexes(self.g)
         self.current_user = None
     
     def login_or_create_user(self, user_id, user_name=None, preferences=None):
@@ -29,49 +35,49 @@ class UserManager:
         Returns:
             Dict: 用户信息
         """
-        # 检查用户是否存在
-        user = self.g.nodes.match("User", user_id=user_id).first()
+        # 一条MERGE完成查找或创建，同时返回统计信息（新建时_new标记在同一语句内移除）
+        cypher = """
+        MERGE (u:User {user_id: $user_id})
+        ON CREATE SET u += $properties, u._new = true
+        WITH u, u._new IS NOT NULL as is_new
+        REMOVE u._new
+        WITH u, is_new, [(u)-[s:searched]->() | s.count] as search_counts
+        RETURN properties(u) as user, is_new,
+            size(search_counts) as searched_count,
+            size([(u)-[:cooked]->() | 1]) as cooked_count,
+            size([(u)-[:liked]->() | 1]) as liked_count,
+            reduce(total = 0, c IN search_counts | total + COALESCE(c, 0)) as total_searches
+        """
         
-        if user:
-            # 用户已存在
-            print(f"欢迎回来，{user['name']}！")
-            self.current_user = user_id
-            
-            # 获取用户统计
-            stats = self.get_user_stats(user_id)
+        properties = pack_preferences(preferences)
+        properties.update(name=user_name or f"用户{user_id}", created_at=datetime.now().isoformat())
+        data = self.g.run(cypher, user_id=user_id, properties=properties).data()[0]
+        user = data['user']
+        self.current_user = user_id
+        
+        if data['is_new']:
+            print(f"欢迎新用户：{user['name']}！")
             
             return {
                 'user_id': user_id,
                 'name': user['name'],
-                'preferences': json.loads(user.get('preferences', '{}')),
-                'created_at': user.get('created_at'),
-                'stats': stats,
-                'is_new': False
-            }
-        else:
-            # 创建新用户
-            if not user_name:
-                user_name = f"用户{user_id}"
-            
-            user = Node("User",
-                       user_id=user_id,
-                       name=user_name,
-                       preferences=json.dumps(preferences or {}, ensure_ascii=False),
-                       created_at=datetime.now().isoformat())
-            
-            self.g.create(user)
-            self.current_user = user_id
-            
-            print(f"欢迎新用户：{user_name}！")
-            
-            return {
-                'user_id': user_id,
-                'name': user_name,
                 'preferences': preferences or {},
                 'created_at': user['created_at'],
                 'stats': {'searched': 0, 'cooked': 0, 'liked': 0},
                 'is_new': True
             }
+        
+        # 用户已存在
+        print(f"欢迎回来，{user['name']}！")
+        
+        return {
+            'user_id': user_id,
+            'name': user['name'],
+            'preferences': unpack_preferences(user),
+            'created_at': user.get('created_at'),
+            'stats': self._stats_from_row(data),
+            'is_new': False
+        }
     
     def get_user_stats(self, user_id):
         """
@@ -83,31 +89,35 @@ class UserManager:
         Returns:
             Dict: 统计信息
         """
+        # 三类关系各自计数（模式推导逐个展开），不再由连续的OPTIONAL MATCH
+        # 产生 搜索×做过×喜欢 的笛卡尔积行（搜索总次数也因此被重复累加）
         cypher = """
         MATCH (u:User {user_id: $user_id})
-        OPTIONAL MATCH (u)-[s:searched]->()
-        OPTIONAL MATCH (u)-[c:cooked]->()
-        OPTIONAL MATCH (u)-[l:liked]->()
+        WITH u, [(u)-[s:searched]->() | s.count] as search_counts
         RETURN 
-            COUNT(DISTINCT s) as searched_count,
-            COUNT(DISTINCT c) as cooked_count,
-            COUNT(DISTINCT l) as liked_count,
-            SUM(s.count) as total_searches
+            size(search_counts) as searched_count,
+            size([(u)-[:cooked]->() | 1]) as cooked_count,
+            size([(u)-[:liked]->() | 1]) as liked_count,
+            reduce(total = 0, c IN search_counts | total + COALESCE(c, 0)) as total_searches
         """
         
         result = self.g.run(cypher, user_id=user_id).data()
         
         if result:
-            data = result[0]
-            return {
-                'searched': data['searched_count'] or 0,
-                'cooked': data['cooked_count'] or 0,
-                'liked': data['liked_count'] or 0,
-                'total_searches': data['total_searches'] or 0
-            }
+            return self._stats_from_row(result[0])
         
         return {'searched': 0, 'cooked': 0, 'liked': 0, 'total_searches': 0}
     
+    @staticmethod
+    def _stats_from_row(data):
+        """统计查询结果行 -> 统计信息"""
+        return {
+            'searched': data['searched_count'] or 0,
+            'cooked': data['cooked_count'] or 0,
+            'liked': data['liked_count'] or 0,
+            'total_searches': data['total_searches'] or 0
+        }
+    
     def update_user_preferences(self, user_id, preferences):
         """
         更新用户偏好
@@ -116,14 +126,15 @@ class UserManager:
             user_id: 用户ID
             preferences: 新的偏好设置
         """
+        # 整体替换：未给出的列表字段置空（删除属性）
         cypher = """
         MATCH (u:User {user_id: $user_id})
-        SET u.preferences = $preferences
+        SET u.preferences = $preferences, u.flavors = $flavors, u.tags = $tags, u.ingredients = $ingredients
         """
         
-        self.g.run(cypher, 
-                  user_id=user_id, 
-                  preferences=json.dumps(preferences, ensure_ascii=False))
+        properties = dict.fromkeys(PREFERENCE_LIST_FIELDS)
+        properties.update(pack_preferences(preferences))
+        self.g.run(cypher, user_id=user_id, **properties)
         
         print(f"用户 {user_id} 的偏好已更新")
     
@@ -145,6 +156,7 @@ class UserManager:
         SET r.rating = $rating, r.cooked_at = datetime()
         """
         self.g.run(cypher, user_id=user_id, dish_name=dish_name, rating=rating)
+        invalidate_user_preference(user_id)
         print(f"已记录：你做过【{dish_name}】")
     
     def record_liked(self, user_id, dish_name):
@@ -155,6 +167,7 @@ class UserManager:
         SET r.liked_at = datetime()
         """
         self.g.run(cypher, user_id=user_id, dish_name=dish_name)
+        invalidate_user_preference(user_id)
         print(f"已记录：你喜欢【{dish_name}】")
     
     def get_user_history(self, user_id, limit=10):
@@ -168,38 +181,43 @@ class UserManager:
         Returns:
             Dict: 用户历史
         """
-        # 搜索历史
-        search_cypher = """
-        MATCH (u:User {user_id: $user_id})-[r:searched]->(d:Dish)
-        RETURN d.name as dish, r.count as count, r.last_time as last_time
-        ORDER BY r.count DESC, r.last_time DESC
-        LIMIT $limit
-        """
-        
-        # 做过的菜
-        cooked_cypher = """
-        MATCH (u:User {user_id: $user_id})-[r:cooked]->(d:Dish)
-        RETURN d.name as dish, r.rating as rating, r.cooked_at as cooked_at
-        ORDER BY r.cooked_at DESC
-        LIMIT $limit
-        """
-        
-        # 喜欢的菜
-        liked_cypher = """
-        MATCH (u:User {user_id: $user_id})-[r:liked]->(d:Dish)
-        RETURN d.name as dish, r.liked_at as liked_at
-        ORDER BY r.liked_at DESC
-        LIMIT $limit
+        # 搜索、做过、喜欢三类历史在一次查询中取回，每类在子查询中各自排序截取
+        cypher = """
+        MATCH (u:User {user_id: $user_id})
+        CALL {
+            WITH u
+            MATCH (u)-[r:searched]->(d:Dish)
+            WITH d, r
+            ORDER BY r.count DESC, r.last_time DESC
+            LIMIT $limit
+            RETURN COLLECT({dish: d.name, count: r.count, last_time: r.last_time}) as searched
+        }
+        CALL {
+            WITH u
+            MATCH (u)-[r:cooked]->(d:Dish)
+            WITH d, r
+            ORDER BY r.cooked_at DESC
+            LIMIT $limit
+            RETURN COLLECT({dish: d.name, rating: r.rating, cooked_at: r.cooked_at}) as cooked
+        }
+        CALL {
+            WITH u
+            MATCH (u)-[r:liked]->(d:Dish)
+            WITH d, r
+            ORDER BY r.liked_at DESC
+            LIMIT $limit
+            RETURN COLLECT({dish: d.name, liked_at: r.liked_at}) as liked
+        }
+        RETURN searched, cooked, liked
         """
         
-        searched = self.g.run(search_cypher, user_id=user_id, limit=limit).data()
-        cooked = self.g.run(cooked_cypher, user_id=user_id, limit=limit).data()
-        liked = self.g.run(liked_cypher, user_id=user_id, limit=limit).data()
+        result = self.g.run(cypher, user_id=user_id, limit=limit).data()
+        history = result[0] if result else {}
         
         return {
-            'searched': searched,
-            'cooked': cooked,
-            'liked': liked
+            'searched': history.get('searched', []),
+            'cooked': history.get('cooked', []),
+            'liked': history.get('liked', [])
         }
     
     def delete_user(self, user_id):
@@ -217,18 +235,26 @@ class UserManager:
         self.g.run(cypher, user_id=user_id)
         print(f"用户 {user_id} 已删除")
     
-    def list_all_users(self):
-        """列出所有用户"""
+    def list_all_users(self, skip=0, limit=50):
+        """
+        按活跃度分页列出用户
+        
+        Args:
+            skip: 跳过的用户数
+            limit: 本页最多返回的用户数
+        """
+        # 活跃度按节点的出边数计（模式推导计数可直接读取节点度数，不逐条展开关系）
         cypher = """
         MATCH (u:User)
-        OPTIONAL MATCH (u)-[r]->()
-        WITH u, COUNT(r) as activity_count
+        WITH u, size([(u)-->() | 1]) as activity_count
+        ORDER BY activity_count DESC
+        SKIP $skip
+        LIMIT $limit
         RETURN u.user_id as user_id, u.name as name, 
                u.created_at as created_at, activity_count
-        ORDER BY activity_count DESC
         """
         
-        users = self.g.run(cypher).data()
+        users = self.g.run(cypher, skip=skip, limit=limit).data()
         return users
     
     def auto_update_preferences(self, user_id, extracted_prefs):
@@ -245,69 +271,55 @@ class UserManager:
                 'ingredients': []
             }
         """
-        # 1. 记录做过的菜
-        for dish in extracted_prefs.get('dishes_cooked', []):
-            self.record_cooked(user_id, dish)
-            print(f"  ✅ 自动记录: {user_id} 做过 {dish}")
+        cooked = list(extracted_prefs.get('dishes_cooked', []))
+        liked = list(extracted_prefs.get('dishes_liked', []))
+        lists = {key: list(extracted_prefs.get(key) or []) for key in PREFERENCE_LIST_FIELDS}
+        if not (cooked or liked or any(lists.values())):
+            return
         
-        # 2. 记录喜欢的菜
-        for dish in extracted_prefs.get('dishes_liked', []):
-            self.record_liked(user_id, dish)
-            print(f"  ✅ 自动记录: {user_id} 喜欢 {dish}")
+        # 做过/喜欢的菜与偏好合并在同一条语句（同一事务）中完成；偏好列表为User节点的原生属性，
+        # 在服务端追加去重（保持原有顺序），不再读出JSON在Python中合并后写回
+        cypher = """
+        MATCH (u:User {user_id: $user_id})
+        CALL {
+            WITH u
+            UNWIND $cooked AS name
+            MATCH (d:Dish {name: name})
+            MERGE (u)-[r:cooked]->(d)
+            SET r.rating = null, r.cooked_at = datetime()
+            RETURN COUNT(d) as cooked_count
+        }
+        CALL {
+            WITH u
+            UNWIND $liked AS name
+            MATCH (d:Dish {name: name})
+            MERGE (u)-[r:liked]->(d)
+            SET r.liked_at = datetime()
+            RETURN COUNT(d) as liked_count
+        }
+        SET u.flavors = CASE WHEN size($flavors) = 0 THEN u.flavors ELSE
+                reduce(acc = COALESCE(u.flavors, []), x IN $flavors | CASE WHEN x IN acc THEN acc ELSE acc + x END) END,
+            u.tags = CASE WHEN size($tags) = 0 THEN u.tags ELSE
+                reduce(acc = COALESCE(u.tags, []), x IN $tags | CASE WHEN x IN acc THEN acc ELSE acc + x END) END,
+            u.ingredients = CASE WHEN size($ingredients) = 0 THEN u.ingredients ELSE
+                reduce(acc = COALESCE(u.ingredients, []), x IN $ingredients | CASE WHEN x IN acc THEN acc ELSE acc + x END) END
+        RETURN u.preferences as preferences, u.flavors as flavors, u.tags as tags, u.ingredients as ingredients
+        """
         
-        # 3. 更新口味偏好
-        flavors = extracted_prefs.get('flavors', [])
-        if flavors:
-            user = self.g.nodes.match("User", user_id=user_id).first()
-            if user:
-                prefs = json.loads(user.get('preferences', '{}'))
-                if 'flavors' not in prefs:
-                    prefs['flavors'] = []
-                
-                # 合并新口味（去重）
-                for flavor in flavors:
-                    if flavor not in prefs['flavors']:
-                        prefs['flavors'].append(flavor)
-                
-                user['preferences'] = json.dumps(prefs, ensure_ascii=False)
-                self.g.push(user)
-                print(f"  ✅ 自动更新: {user_id} 的口味偏好 → {prefs['flavors']}")
+        result = self.g.run(cypher, user_id=user_id, cooked=cooked, liked=liked, **lists).data()
+        if cooked or liked:
+            invalidate_user_preference(user_id)
         
-        # 4. 更新生活习惯标签
-        tags = extracted_prefs.get('tags', [])
-        if tags:
-            user = self.g.nodes.match("User", user_id=user_id).first()
-            if user:
-                prefs = json.loads(user.get('preferences', '{}'))
-                if 'tags' not in prefs:
-                    prefs['tags'] = []
-                
-                # 合并新标签（去重）
-                for tag in tags:
-                    if tag not in prefs['tags']:
-                        prefs['tags'].append(tag)
-                
-                user['preferences'] = json.dumps(prefs, ensure_ascii=False)
-                self.g.push(user)
-                print(f"  ✅ 自动更新: {user_id} 的生活习惯标签 → {prefs['tags']}")
+        for dish in cooked:
+            print(f"  ✅ 自动记录: {user_id} 做过 {dish}")
+        for dish in liked:
+            print(f"  ✅ 自动记录: {user_id} 喜欢 {dish}")
         
-        # 5. 更新食材偏好
-        ingredients = extracted_prefs.get('ingredients', [])
-        if ingredients:
-            user = self.g.nodes.match("User", user_id=user_id).first()
-            if user:
-                prefs = json.loads(user.get('preferences', '{}'))
-                if 'ingredients' not in prefs:
-                    prefs['ingredients'] = []
-                
-                # 合并新食材（去重）
-                for ing in ingredients:
-                    if ing not in prefs['ingredients']:
-                        prefs['ingredients'].append(ing)
-                
-                user['preferences'] = json.dumps(prefs, ensure_ascii=False)
-                self.g.push(user)
-                print(f"  ✅ 自动更新: {user_id} 的食材偏好 → {prefs['ingredients']}")
+        if result:
+            prefs = unpack_preferences(result[0])
+            for key, label in (('flavors', '口味偏好'), ('tags', '生活习惯标签'), ('ingredients', '食材偏好')):
+                if lists[key]:
+                    print(f"  ✅ 自动更新: {user_id} 的{label} → {prefs[key]}")
 
 
 if __name__ == "__main__":
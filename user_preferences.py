@@ -0,0 +1,36 @@
+# coding = utf-8
+"""
+用户偏好存储格式模块
+User节点偏好属性与偏好dict之间的转换，不依赖数据库连接，供检索、用户管理等模块共用
+"""
+
+import json
+
+
+# 用户偏好中以原生列表属性存储在User节点上的字段（可在Cypher中直接读取、合并），
+# 其余字段（dietary、skill等）仍序列化为JSON存于u.preferences
+PREFERENCE_LIST_FIELDS = ('flavors', 'tags', 'ingredients')
+
+
+def pack_preferences(preferences):
+    """偏好dict -> User节点属性：列表字段为原生属性，其余字段为preferences JSON"""
+    preferences = preferences or {}
+    properties = {key: list(preferences[key]) for key in PREFERENCE_LIST_FIELDS if key in preferences}
+    rest = {key: value for key, value in preferences.items() if key not in PREFERENCE_LIST_FIELDS}
+    properties['preferences'] = json.dumps(rest, ensure_ascii=False)
+    return properties
+
+
+def unpack_preferences(properties):
+    """
+    User节点属性（或同名列的查询结果）-> 偏好dict
+    
+    旧节点的列表字段存在preferences JSON中，与原生属性合并（去重，JSON中的在前）
+    """
+    raw = properties.get('preferences')
+    preferences = json.loads(raw) if raw else {}
+    for key in PREFERENCE_LIST_FIELDS:
+        values = properties.get(key)
+        if values is not None:
+            preferences[key] = list(dict.fromkeys(list(preferences.get(key, [])) + list(values)))
+    return preferences
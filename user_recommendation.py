@@ -3,16 +3,95 @@
 用户个性化推荐引擎
 """
 
-from py2neo import Graph
+from graph_db import get_graph
 import json
-from collections import defaultdict
+import time
+import itertools
+import threading
+from collections import defaultdict, OrderedDict
+
+
+# 用户偏好分析结果缓存（进程内共享，LRU）：user_id -> (过期时刻, 结果)
+# 偏好只随做过/喜欢记录变化，写入时由invalidate_user_preference失效，TTL兜底其他途径的修改
+PREFERENCE_CACHE_TTL = 60
+PREFERENCE_CACHE_SIZE = 1024
+_preference_cache = OrderedDict()
+_preference_cache_lock = threading.Lock()
+
+
+def invalidate_user_preference(user_id):
+    """使用户的偏好分析缓存失效（记录做过/喜欢的菜之后调用）"""
+    with _preference_cache_lock:
+        _preference_cache.pop(user_id, None)
+
+
+# 综合推荐的条件：(参数名, 从菜品出发的匹配模式)
+_CRITERIA = (
+    ("scene", "(d:Dish)-[:suitable_for]->(:Scene {name: $scene})"),
+    ("flavor", "(d:Dish)-[:has_flavor]->(:Flavor {name: $flavor})"),
+    ("tag", "(d:Dish)-[:has_tag]->(:Tag {name: $tag})"),
+)
+
+
+def _multi_criteria_cypher(key):
+    """生成给定条件组合的综合推荐查询（条件为MATCH，由Scene/Flavor/Tag的名称索引出发）"""
+    matches = [pattern for (name, pattern), used in zip(_CRITERIA, key) if used]
+    match_clause = "MATCH " + ", ".join(matches or ["(d:Dish)"])
+    return f"""
+        MATCH (u:User {{user_id: $user_id}})
+        {match_clause}
+        WHERE NOT (u)-[:cooked]->(d)
+        WITH DISTINCT d
+        LIMIT $limit
+        RETURN d.name as dish, d.difficulty as difficulty,
+               [(d)-[:has_tag]->(tag:Tag) | tag.name] as tags,
+               [(d)-[:has_flavor]->(flv:Flavor) | flv.name] as flavors
+        """
 
 
 class UserRecommendation:
     """用户推荐系统"""
     
-    def __init__(self):
-        self.g = Graph("bolt://127.0.0.1:7687", auth=("neo4j", "kurisu810975"))
+    # 每个进程只预热一次
+    _warmup_started = False
+    _warmup_lock = threading.Lock()
+    
+    def __init__(self, graph=None):
+        """
+        Args:
+            graph: 复用已有的Graph连接，不传则使用进程内共享的连接
+        """
+        self.g = graph if graph is not None else get_graph()
+        
+        # 首次创建时在后台预热推荐查询用到的关系，不阻塞初始化
+        with UserRecommendation._warmup_lock:
+            start_warmup = not UserRecommendation._warmup_started
+            UserRecommendation._warmup_started = True
+        if start_warmup:
+            threading.Thread(target=self.warmup, args=(self.g,), daemon=True).start()
+    
+    @classmethod
+    def warmup(cls, graph=None):
+        """
+        预热Neo4j页缓存：遍历一遍推荐查询用到的菜品-标签/口味/场景/相似关系（一条UNION ALL查询），
+        首个推荐请求不再从磁盘读取这些关系
+        
+        Returns:
+            Dict[str, int]: 关系类型 -> 关系数，失败时返回空字典
+        """
+        g = graph if graph is not None else get_graph()
+        # 计数目标节点的name属性，迫使实际遍历关系并读取属性页（单纯count(r)可能直接取计数存储）
+        cypher = " UNION ALL ".join(
+            f"MATCH (:Dish)-[:{rel_type}]->(n) RETURN '{rel_type}' AS rel_type, count(n.name) AS count"
+            for rel_type in ('has_tag', 'has_flavor', 'suitable_for', 'similar_to')
+        )
+        try:
+            counts = {row['rel_type']: row['count'] for row in g.run(cypher).data()}
+        except Exception as e:
+            print(f"⚠️  推荐关系预热失败: {e}")
+            return {}
+        print(f"推荐关系预热完成: {counts}")
+        return counts
     
     def get_user_history(self, user_id):
         """获取用户历史记录"""
@@ -47,10 +126,9 @@ class UserRecommendation:
         """
         cypher = """
         MATCH (s:Scene {name: $scene})<-[:suitable_for]-(d:Dish)
-        OPTIONAL MATCH (d)-[:has_tag]->(t:Tag)
-        WITH d, COLLECT(DISTINCT t.name) as tags
-        RETURN d.name as dish, d.difficulty as difficulty, tags
+        WITH DISTINCT d
         LIMIT $limit
+        RETURN d.name as dish, d.difficulty as difficulty, [(d)-[:has_tag]->(t:Tag) | t.name] as tags
         """
         result = self.g.run(cypher, scene=scene_name, limit=limit).data()
         return result
@@ -62,10 +140,9 @@ class UserRecommendation:
         """
         cypher = """
         MATCH (f:Flavor {name: $flavor})<-[:has_flavor]-(d:Dish)
-        OPTIONAL MATCH (d)-[:has_tag]->(t:Tag)
-        WITH d, COLLECT(DISTINCT t.name) as tags
-        RETURN d.name as dish, d.difficulty as difficulty, tags
+        WITH DISTINCT d
         LIMIT $limit
+        RETURN d.name as dish, d.difficulty as difficulty, [(d)-[:has_tag]->(t:Tag) | t.name] as tags
         """
         result = self.g.run(cypher, flavor=flavor_preference, limit=limit).data()
         return result
@@ -77,118 +154,145 @@ class UserRecommendation:
         """
         cypher = """
         MATCH (t:Tag {name: $tag})<-[:has_tag]-(d:Dish)
-        OPTIONAL MATCH (d)-[:has_flavor]->(f:Flavor)
-        WITH d, COLLECT(DISTINCT f.name) as flavors
-        RETURN d.name as dish, d.difficulty as difficulty, flavors
+        WITH DISTINCT d
         LIMIT $limit
+        RETURN d.name as dish, d.difficulty as difficulty, [(d)-[:has_flavor]->(f:Flavor) | f.name] as flavors
         """
         result = self.g.run(cypher, tag=tag_name, limit=limit).data()
         return result
     
-    def recommend_similar_dishes(self, user_id, limit=5):
+    def recommend_similar_with_reasons(self, user_id, limit=5):
         """
-        基于相似度推荐
-        找出用户喜欢的菜品的相似菜品
+        基于相似度推荐，并给出推荐原因（一次遍历同时得到排序结果和原因）
+        
+        Returns:
+            List[Dict]: 按相似来源数降序，每项包含 dish, difficulty, flavors, similar_count,
+                        reasons（[{source_dish, action, common_flavors, common_ingredients}, ...]）
         """
+        # 先按推荐菜品聚合来源并截取前limit个，再只为这些(来源, 推荐)对展开共同口味和食材
         cypher = """
-        MATCH (u:User {user_id: $user_id})-[:liked|cooked]->(d1:Dish)-[:similar_to]-(d2:Dish)
+        MATCH (u:User {user_id: $user_id})-[r:liked|cooked]->(d1:Dish)-[:similar_to]-(d2:Dish)
         WHERE NOT (u)-[:cooked]->(d2)
-        WITH d2, d1, COUNT(DISTINCT d1) as similar_count
-        OPTIONAL MATCH (d2)-[:has_flavor]->(f:Flavor)
-        WITH d2, similar_count, COLLECT(DISTINCT f.name) as flavors
+        WITH d2, COUNT(DISTINCT d1) as similar_count, COLLECT(DISTINCT [d1, type(r)]) as sources
         ORDER BY similar_count DESC
         LIMIT $limit
-        RETURN d2.name as dish, d2.difficulty as difficulty, flavors, similar_count
+        UNWIND sources AS source
+        WITH d2, similar_count, source[0] as d1, source[1] as action
+        RETURN d2.name as dish, d2.difficulty as difficulty, similar_count,
+               [(d2)-[:has_flavor]->(f:Flavor) | f.name] as flavors,
+               d1.name as source_dish, action,
+               [(d1)-[:has_flavor]->(f:Flavor)<-[:has_flavor]-(d2) | f.name] as common_flavors,
+               [(d1)-[:need_ingredient]->(i:Ingredient)<-[:need_ingredient]-(d2) | i.name] as common_ingredients
         """
-        result = self.g.run(cypher, user_id=user_id, limit=limit).data()
-        return result
+        rows = self.g.run(cypher, user_id=user_id, limit=limit).data()
+        
+        grouped = {}
+        for row in rows:
+            item = grouped.get(row['dish'])
+            if item is None:
+                item = grouped[row['dish']] = {
+                    'dish': row['dish'],
+                    'difficulty': row['difficulty'],
+                    'flavors': row['flavors'],
+                    'similar_count': row['similar_count'],
+                    'reasons': []
+                }
+            item['reasons'].append({
+                'source_dish': row['source_dish'],
+                'action': row['action'],
+                'common_flavors': row['common_flavors'],
+                'common_ingredients': row['common_ingredients']
+            })
+        return sorted(grouped.values(), key=lambda item: item['similar_count'], reverse=True)
     
-    def get_similar_dishes_with_reason(self, user_id, limit=5):
+    def recommend_similar_dishes(self, user_id, limit=5):
         """
-        获取相似菜品并返回原因
+        基于相似度推荐
+        找出用户喜欢的菜品的相似菜品
         """
-        cypher = """
-        MATCH (u:User {user_id: $user_id})-[r:liked|cooked]->(d1:Dish)-[:similar_to]-(d2:Dish)
-        WHERE NOT (u)-[:cooked]->(d2)
-        WITH d1, d2, type(r) as action
-        OPTIONAL MATCH (d1)-[:has_flavor]->(f:Flavor)<-[:has_flavor]-(d2)
-        WITH d1, d2, action, COLLECT(DISTINCT f.name) as common_flavors
-        OPTIONAL MATCH (d1)-[:need_ingredient]->(i:Ingredient)<-[:need_ingredient]-(d2)
-        WITH d1, d2, action, common_flavors, COLLECT(DISTINCT i.name) as common_ingredients
-        RETURN d1.name as source_dish, d2.name as recommended_dish, 
-               action, common_flavors, common_ingredients
-        LIMIT $limit
+        return [
+            {key: item[key] for key in ('dish', 'difficulty', 'flavors', 'similar_count')}
+            for item in self.recommend_similar_with_reasons(user_id, limit)
+        ]
+    
+    def get_similar_dishes_with_reason(self, user_id, limit=5):
         """
-        result = self.g.run(cypher, user_id=user_id, limit=limit).data()
-        return result
+        获取相似菜品并返回原因（每个(来源菜品, 推荐菜品)一项）
+        """
+        result = [
+            dict(reason, recommended_dish=item['dish'])
+            for item in self.recommend_similar_with_reasons(user_id, limit)
+            for reason in item['reasons']
+        ]
+        return result[:limit]
     
     def analyze_user_preference(self, user_id):
         """
         分析用户偏好
-        返回用户最喜欢的口味、标签、场景
-        """
-        # 分析口味偏好
-        flavor_cypher = """
-        MATCH (u:User {user_id: $user_id})-[:liked|cooked]->(d:Dish)-[:has_flavor]->(f:Flavor)
-        WITH f.name as flavor, COUNT(*) as count
-        ORDER BY count DESC
-        LIMIT 3
-        RETURN COLLECT(flavor) as top_flavors
+        返回用户最喜欢的口味、标签、场景（结果缓存PREFERENCE_CACHE_TTL秒，记录新行为时失效）
         """
+        with _preference_cache_lock:
+            cached = _preference_cache.get(user_id)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    _preference_cache.move_to_end(user_id)
+                    return {key: list(values) for key, values in cached[1].items()}
+                del _preference_cache[user_id]  # 过期条目即时清除
         
-        # 分析标签偏好
-        tag_cypher = """
-        MATCH (u:User {user_id: $user_id})-[:liked|cooked]->(d:Dish)-[:has_tag]->(t:Tag)
-        WITH t.name as tag, COUNT(*) as count
-        ORDER BY count DESC
-        LIMIT 3
-        RETURN COLLECT(tag) as top_tags
+        # 口味和标签偏好在一次查询中分析，各自在子查询中取前3
+        cypher = """
+        MATCH (u:User {user_id: $user_id})
+        CALL {
+            WITH u
+            MATCH (u)-[:liked|cooked]->(d:Dish)-[:has_flavor]->(f:Flavor)
+            WITH f.name as flavor, COUNT(*) as count
+            ORDER BY count DESC
+            LIMIT 3
+            RETURN COLLECT(flavor) as top_flavors
+        }
+        CALL {
+            WITH u
+            MATCH (u)-[:liked|cooked]->(d:Dish)-[:has_tag]->(t:Tag)
+            WITH t.name as tag, COUNT(*) as count
+            ORDER BY count DESC
+            LIMIT 3
+            RETURN COLLECT(tag) as top_tags
+        }
+        RETURN top_flavors, top_tags
         """
         
-        flavors = self.g.run(flavor_cypher, user_id=user_id).data()
-        tags = self.g.run(tag_cypher, user_id=user_id).data()
+        rows = self.g.run(cypher, user_id=user_id).data()
         
-        return {
-            "flavors": flavors[0]["top_flavors"] if flavors else [],
-            "tags": tags[0]["top_tags"] if tags else []
+        result = {
+            "flavors": rows[0]["top_flavors"] if rows else [],
+            "tags": rows[0]["top_tags"] if rows else []
         }
+        with _preference_cache_lock:
+            _preference_cache[user_id] = (time.monotonic() + PREFERENCE_CACHE_TTL, result)
+            _preference_cache.move_to_end(user_id)
+            while len(_preference_cache) > PREFERENCE_CACHE_SIZE:
+                _preference_cache.popitem(last=False)
+        # 返回副本：调用方修改结果不影响缓存
+        return {key: list(values) for key, values in result.items()}
+    
+    # 按(有无场景, 有无口味, 有无标签)预先生成全部8种查询文本：调用时只查表，
+    # 同一形状文本不变，Neo4j可复用已编译的执行计划
+    _MULTI_CYPHER = {
+        key: _multi_criteria_cypher(key)
+        for key in itertools.product((False, True), repeat=len(_CRITERIA))
+    }
     
     def recommend_by_multiple_criteria(self, user_id, scene=None, flavor=None, tag=None, limit=10):
         """
         综合推荐：结合场景、口味、标签
         """
-        conditions = []
-        params = {"user_id": user_id, "limit": limit}
-        
-        if scene:
-            conditions.append("(d)-[:suitable_for]->(s:Scene {name: $scene})")
-            params["scene"] = scene
-        
-        if flavor:
-            conditions.append("(d)-[:has_flavor]->(f:Flavor {name: $flavor})")
-            params["flavor"] = flavor
-        
-        if tag:
-            conditions.append("(d)-[:has_tag]->(t:Tag {name: $tag})")
-            params["tag"] = tag
-        
-        where_clause = " AND ".join(conditions) if conditions else "1=1"
-        
-        cypher = f"""
-        MATCH (u:User {{user_id: $user_id}})
-        MATCH (d:Dish)
-        WHERE NOT (u)-[:cooked]->(d) AND {where_clause}
-        OPTIONAL MATCH (d)-[:has_tag]->(tag:Tag)
-        OPTIONAL MATCH (d)-[:has_flavor]->(flv:Flavor)
-        WITH d, COLLECT(DISTINCT tag.name) as tags, COLLECT(DISTINCT flv.name) as flavors
-        RETURN d.name as dish, d.difficulty as difficulty, tags, flavors
-        LIMIT $limit
-        """
+        values = {"scene": scene, "flavor": flavor, "tag": tag}
+        key = tuple(bool(values[name]) for name, _ in _CRITERIA)
+        params = {name: value for name, value in values.items() if value}
         
-        result = self.g.run(cypher, **params).data()
+        result = self.g.run(self._MULTI_CYPHER[key], user_id=user_id, limit=limit, **params).data()
         return result
 
-
 if __name__ == "__main__":
     rec = UserRecommendation()
     
@@ -222,20 +326,20 @@ if __name__ == "__main__":
     for r in flavor_recs:
         print(f"   - {r['dish']} (标签: {', '.join(r['tags'])})")
     
-    # 5. 基于相似度推荐
+    # 5. 基于相似度推荐（排序结果和推荐原因来自同一次查询）
     print(f"\n5. 基于相似度推荐：")
-    similar_recs = rec.recommend_similar_dishes(user_id)
+    similar_recs = rec.recommend_similar_with_reasons(user_id)
     for r in similar_recs:
         print(f"   - {r['dish']} (口味: {', '.join(r['flavors'])})")
     
-    # 6. 获取推荐原因
+    # 6. 推荐原因
     print(f"\n6. 相似菜品推荐（带原因）：")
-    reasons = rec.get_similar_dishes_with_reason(user_id)
-    for r in reasons:
-        print(f"   - 因为你{r['action']}过 {r['source_dish']}")
-        print(f"     推荐: {r['recommended_dish']}")
-        print(f"     共同口味: {', '.join(r['common_flavors'])}")
-        print(f"     共同食材: {', '.join(r['common_ingredients'][:3])}")
+    for r in similar_recs:
+        for reason in r['reasons']:
+            print(f"   - 因为你{reason['action']}过 {reason['source_dish']}")
+            print(f"     推荐: {r['dish']}")
+            print(f"     共同口味: {', '.join(reason['common_flavors'])}")
+            print(f"     共同食材: {', '.join(reason['common_ingredients'][:3])}")
     
     # 7. 分析用户偏好
     print(f"\n7. 用户偏好分析：")
@@ -4,10 +4,22 @@
 使用sentence-transformers进行语义检索
 """
 
+import hashlib
 import json
+import os
 import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
 from pathlib import Path
 from typing import List, Tuple, Dict
+
+# 编码线程数（默认取物理核数，约为逻辑核数的一半）：须在导入torch/MKL之前写入环境变量才对OpenMP生效
+ENCODE_THREADS = int(os.environ.get('BGE_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+os.environ.setdefault('OMP_NUM_THREADS', str(ENCODE_THREADS))
+os.environ.setdefault('MKL_NUM_THREADS', str(ENCODE_THREADS))
+
 import numpy as np
 
 try:
@@ -18,183 +30,479 @@ except ImportError:
     print("警告：sentence-transformers未安装，向量检索功能将不可用")
     print("安装命令：pip install sentence-transformers")
 
+try:
+    import torch
+    TORCH_AVAILABLE = True
+    torch.set_num_threads(ENCODE_THREADS)
+    try:
+        # 算子间并行只会与算子内线程争抢核心；已有并行任务启动后不可再设置
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+except ImportError:
+    TORCH_AVAILABLE = False
+
+try:
+    import onnxruntime  # noqa: F401  sentence-transformers的ONNX后端依赖
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+try:
+    import simsimd
+    SIMSIMD_AVAILABLE = True
+except ImportError:
+    SIMSIMD_AVAILABLE = False
+
+# 向量索引目录（旧版为同名的.pkl文件）
+INDEX_DIR = "data/vector_index"
+
+# 索引目录中的矩阵文件：(文件名, 属性名, 元素类型)，行顺序与names一致
+# 浮点矩阵以float16落盘（文件和页缓存减半），fp32检索首次使用时再展开为float32
+INDEX_MATRIX_FILES = (
+    ('name.f16', 'name_matrix', np.float16),
+    ('desc.f16', 'desc_matrix', np.float16),
+    ('name.i8', 'name_matrix_i8', np.int8),
+    ('desc.i8', 'desc_matrix_i8', np.int8),
+)
+
+# 文本嵌入持久化缓存（SQLite）：键为(模型名, 文本)的哈希，重建索引时只编码新增或改动的文本
+EMBED_CACHE_PATH = "data/embed_cache.db"
+EMBED_CACHE_QUERY_CHUNK = 500  # 每条IN查询的键数（低于SQLite参数个数上限）
+
+# 建索引时的编码批大小，以及GPU编码时后台分词的进程数
+ENCODE_BATCH_SIZE = 128
+TOKENIZE_WORKERS = 4
+
+# 查询向量LRU缓存容量（重复查询跳过模型前向计算）
+QUERY_CACHE_SIZE = 4096
+
+# fp32检索的FAISS索引：菜品数达到该值时改用HNSW近似检索，否则精确内积（IndexFlatIP）
+HNSW_MIN_ROWS = 100000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# int8内积回退实现时每次升为int32计算的行数（限制临时内存）
+INT8_CHUNK_ROWS = 4096
+
+
+def index_exists(path=INDEX_DIR):
+    """向量索引是否已构建（新版目录或旧版pickle）"""
+    return (Path(path) / 'index.json').exists() or Path(path).with_suffix('.pkl').exists()
+
+
+def _quantize(vectors, axis=None):
+    """
+    对称int8标量量化：返回(int8数组, scale)，原值 ≈ int8值 / scale
+
+    axis=None时整个数组共用一个scale；axis=1时每行一个scale（批量查询各自量化）
+    """
+    peak = np.max(np.abs(vectors), axis=axis, keepdims=axis is not None) if vectors.size else 0.0
+    scale = 127.0 / np.where(peak > 0, peak, 127.0)
+    quantized = np.ascontiguousarray(np.rint(vectors * scale).astype(np.int8))
+    return quantized, (scale if axis is not None else float(scale))
+
+
+def _int8_dot(matrix_i8, queries_i8):
+    """int8查询矩阵(Q, D)与int8向量矩阵(N, D)的两两内积（int32累加），返回(Q, N)"""
+    if SIMSIMD_AVAILABLE:
+        return np.asarray(simsimd.cdist(queries_i8, matrix_i8, metric='dot'), dtype=np.float32)
+    queries_i32 = queries_i8.astype(np.int32).T
+    scores = np.empty((len(queries_i8), len(matrix_i8)), dtype=np.float32)
+    for start in range(0, len(matrix_i8), INT8_CHUNK_ROWS):
+        chunk = matrix_i8[start:start + INT8_CHUNK_ROWS]
+        scores[:, start:start + len(chunk)] = (chunk.astype(np.int32) @ queries_i32).T
+    return scores
+
+
+# 菜谱分类的中文名（语义化）
+CATEGORY_NAMES = {
+    'dessert': '甜品',
+    'main_dish': '主菜',
+    'soup': '汤',
+    'condiment': '调味料',
+    'drink': '饮品',
+    'staple': '主食',
+    'appetizer': '凉菜',
+    'side_dish': '配菜'
+}
+
+# 难度等级的文字描述（语义化，用于匹配"新手"、"简单"等）
+DIFFICULTY_NAMES = {
+    1: "非常简单（新手友好）",
+    2: "简单（适合新手）",
+    3: "中等难度",
+    4: "较难",
+    5: "高难度"
+}
+
+
+def _write_replace(path, mode, write):
+    """写入同目录下的临时文件后用os.replace原子替换目标文件（write接收打开的文件对象）"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _join_names(limit):
+    """格式化函数：取列表前limit项的名称用顿号连接（兼容新格式[{"name": "xxx", "amount": "xxx"}, ...]）"""
+    def fmt(items):
+        items = items[:limit]
+        if isinstance(items[0], dict):
+            items = [item.get('name', '') for item in items]
+        return '、'.join(items)
+    return fmt
+
+
+# 菜品描述的字段：(字段名, 前缀, 格式化函数)，按顺序拼接，字段值为空时跳过
+RECIPE_FIELD_SPECS = (
+    ('category', '分类：', lambda v: CATEGORY_NAMES.get(v, v)),
+    ('tags', '标签：', '、'.join),  # 重要！用于匹配"快手菜"、"烘焙"等
+    ('flavors', '口味：', '、'.join),  # 重要！用于匹配"辣"、"甜"等
+    ('difficulty', '难度：', lambda v: DIFFICULTY_NAMES.get(v, f"难度{v}")),
+    ('desc', '简介：', str),  # 重要！包含菜品特点
+    ('ingredients', '食材：', _join_names(10)),
+    ('condiments', '调料：', _join_names(8)),
+    ('method', '做法：', str),
+)
+
+
+def _describe_recipe(recipe):
+    """菜品描述文本（名称加RECIPE_FIELD_SPECS中的各字段）"""
+    get = recipe.get
+    desc_parts = [get('name', '')]
+    for key, prefix, fmt in RECIPE_FIELD_SPECS:
+        value = get(key)
+        if value:
+            desc_parts.append(prefix + fmt(value))
+    return '。'.join(desc_parts)
+
+
+def _unit_rows(matrix):
+    """
+    保证矩阵每行为单位向量（零向量除外）：检索只做内积，内积等于余弦相似度的前提是库向量已归一化
+
+    已归一化时原样返回（不复制），否则返回逐行归一化后的新矩阵
+    """
+    if not matrix.size:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    if np.allclose(norms[norms > 0], 1.0, atol=1e-3):
+        return matrix
+    print("警告：向量未归一化，已按行归一化")
+    return np.ascontiguousarray(matrix / np.where(norms > 0, norms, 1.0), dtype=np.float32)
+
+
+def _top_k_indices(scores, top_k):
+    """分数最高的top_k个下标（按分数降序）：argpartition选出后只对这k个排序"""
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+    # 直接对scores做划分取最后k个，不为取负另分配长度为N的数组
+    split = len(scores) - top_k
+    candidates = np.argpartition(scores, split)[split:] if split > 0 else np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
 
 class VectorRetriever:
     """向量检索器"""
     
-    def __init__(self, model_name="BAAI/bge-m3"):
+    def __init__(self, model_name="BAAI/bge-m3", precision=None, backend='onnx', device=None):
         """
         初始化向量检索器
         
         Args:
             model_name: sentence-transformers模型名称
+            precision: 默认检索精度，'int8'（量化矩阵，内存和带宽为1/4）或'fp32'；
+                默认仅在安装了simsimd时用'int8'（numpy回退的整数矩阵乘法比float32 BLAS慢）
+            backend: 编码后端，'onnx'（ONNX Runtime，CPU上更快）或'torch'
+            device: 相似度计算设备，'cuda'时向量矩阵常驻显存、在GPU上做矩阵乘法和Top-K；默认有GPU时用'cuda'
         """
         if not SENTENCE_TRANSFORMERS_AVAILABLE:
             raise ImportError("请先安装sentence-transformers: pip install sentence-transformers")
         # BAAI/bge-m3  paraphrase-multilingual-MiniLM-L12-v2
-        self.model = SentenceTransformer(model_name, cache_folder=f'/data/yangguang/Model/bge-m3', local_files_only=True)
-        self.dish_vectors = {}  # 菜品名称向量
-        self.dish_desc_vectors = {}  # 菜品描述向量
+        self.model_name = model_name
+        self.model = self._load_model(model_name, backend)
+        # 查询文本 -> 归一化后的float32向量（只读），随实例（即模型）存在
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        # fp32检索用的FAISS索引：use_description -> (对应的向量矩阵, 索引)，矩阵替换后重建
+        self._faiss_indexes = {}
+        # GPU检索：use_description -> (对应的向量矩阵, 显存中的float32张量)，矩阵替换后重新上传
+        cuda_available = TORCH_AVAILABLE and torch.cuda.is_available()
+        self.device = device or ('cuda' if cuda_available else 'cpu')
+        if self.device != 'cpu' and not cuda_available:
+            print(f"警告：torch或CUDA不可用，无法在{self.device}上检索，改用CPU")
+            self.device = 'cpu'
+        self._gpu_matrices = {}
+        # 向量按行存为连续的float32矩阵（第i行对应names[i]，从索引目录加载时为float16），检索时一次矩阵乘法算出全部相似度
+        self.names = []  # 菜品名称
+        self.name_matrix = np.empty((0, 0), dtype=np.float32)  # 菜品名称向量 (N, D)
+        self.desc_matrix = np.empty((0, 0), dtype=np.float32)  # 菜品描述向量 (N, D)
         self.dish_data = {}  # 菜品完整数据
+        # int8量化副本（由float32矩阵派生，与之一起写入索引目录）
+        self.precision = precision or ('int8' if SIMSIMD_AVAILABLE else 'fp32')
+        self._quantize_matrices()
+        
+    @staticmethod
+    def _load_model(model_name, backend):
+        """加载编码模型：优先ONNX Runtime后端（算子融合、图优化），不可用时回退PyTorch（GPU上使用FP16）"""
+        kwargs = {'cache_folder': '/data/yangguang/Model/bge-m3', 'local_files_only': True}
+        if backend == 'onnx' and ONNXRUNTIME_AVAILABLE:
+            try:
+                return SentenceTransformer(model_name, backend='onnx', **kwargs)
+            except Exception as e:
+                print(f"警告：ONNX Runtime后端加载失败，改用PyTorch：{e}")
+        model = SentenceTransformer(model_name, **kwargs)
+        if model.device.type == 'cuda':
+            # GPU上以FP16推理：权重显存和带宽减半，归一化后的向量与FP32差异可忽略（输出统一转为float32）
+            model.half()
+        return model
+    
+    def _encode_queries(self, queries):
+        """编码查询（命中LRU缓存的直接复用，未命中的去重后一次编码），返回(Q, D)的float32矩阵"""
+        vectors = {}
+        with self._query_cache_lock:
+            for query in queries:
+                vector = self._query_cache.get(query)
+                if vector is not None:
+                    self._query_cache.move_to_end(query)
+                    vectors[query] = vector
         
-    def build_index(self, recipes_json_path):
+        missing = [query for query in dict.fromkeys(queries) if query not in vectors]
+        if missing:
+            encoded = self.model.encode(missing, batch_size=64, normalize_embeddings=True,
+                                        convert_to_numpy=True).astype(np.float32)
+            encoded.setflags(write=False)
+            with self._query_cache_lock:
+                for query, vector in zip(missing, encoded):
+                    vectors[query] = self._query_cache[query] = vector
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+        
+        return np.stack([vectors[query] for query in queries])
+    
+    def _encode_texts(self, texts):
+        """
+        编码建索引用的文本，返回归一化后的(N, D)矩阵
+
+        PyTorch模型在GPU上时，由DataLoader的后台进程分词并放入锁页内存，与GPU前向计算重叠；
+        其余情况（CPU、ONNX后端）直接交给model.encode
+        """
+        if not (TORCH_AVAILABLE and getattr(self.model, 'backend', 'torch') == 'torch'
+                and self.model.device.type == 'cuda' and texts):
+            return self.model.encode(texts, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=True,
+                                     normalize_embeddings=True, convert_to_numpy=True)
+        
+        from torch.utils.data import DataLoader
+        
+        # 与model.encode一样按长度降序分批，同一批的padding最少
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        loader = DataLoader([texts[i] for i in order], batch_size=ENCODE_BATCH_SIZE,
+                            num_workers=TOKENIZE_WORKERS, collate_fn=self.model.tokenize, pin_memory=True)
+        batches = []
+        with torch.inference_mode():
+            for features in loader:
+                features = {key: value.to(self.model.device, non_blocking=True) for key, value in features.items()}
+                embeddings = self.model(features)['sentence_embedding']
+                batches.append(torch.nn.functional.normalize(embeddings.float(), dim=1).cpu().numpy())
+        
+        vectors = np.empty((len(texts), batches[0].shape[1]), dtype=np.float32)
+        vectors[order] = np.concatenate(batches)
+        return vectors
+    
+    def _encode_cached(self, texts, cache_path):
+        """编码文本：先查持久化缓存，只把未命中的文本（去重后）交给模型，新向量写回缓存"""
+        keys = [
+            hashlib.blake2b(f"{self.model_name}\0{text}".encode('utf-8'), digest_size=16).digest()
+            for text in texts
+        ]
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(cache_path)) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+            cached = {}
+            unique_keys = list(dict.fromkeys(keys))
+            for start in range(0, len(unique_keys), EMBED_CACHE_QUERY_CHUNK):
+                chunk = unique_keys[start:start + EMBED_CACHE_QUERY_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                cached.update(conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk))
+            
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in cached:
+                    missing.setdefault(key, text)
+            print(f"嵌入缓存命中 {len(unique_keys) - len(missing)}/{len(unique_keys)}，需编码 {len(missing)} 条文本")
+            
+            if missing:
+                vectors = self._encode_texts(list(missing.values()))
+                rows = [(key, vector.astype(np.float32).tobytes()) for key, vector in zip(missing, vectors)]
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                cached.update(rows)
+        
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([np.frombuffer(cached[key], dtype=np.float32) for key in keys])
+    
+    def _normalize_matrices(self):
+        """构建或从旧版pickle加载后校验一次库向量为单位向量（目录索引由save_index写出，已校验过）"""
+        self.name_matrix = _unit_rows(self.name_matrix)
+        self.desc_matrix = _unit_rows(self.desc_matrix)
+    
+    def _quantize_matrices(self):
+        """由float32矩阵生成int8量化副本"""
+        self.name_matrix_i8, self.name_scale = _quantize(self.name_matrix)
+        self.desc_matrix_i8, self.desc_scale = _quantize(self.desc_matrix)
+        
+    def build_index(self, recipes_json_path, cache_path=EMBED_CACHE_PATH):
         """
         构建向量索引
         
         Args:
             recipes_json_path: recipes.json文件路径
+            cache_path: 文本嵌入缓存文件路径，None表示不使用缓存
         """
         print("正在加载菜谱数据...")
         recipes = []
-        with open(recipes_json_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    try:
-                        recipe = json.loads(line)
-                        recipes.append(recipe)
-                    except json.JSONDecodeError as e:
-                        print(f"警告：跳过无效行：{e}")
-                        continue
+        # 整个文件一次读入后按行切分，orjson直接解析字节（orjson.JSONDecodeError是json.JSONDecodeError的子类）
+        with open(recipes_json_path, 'rb') as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            line = line.strip()
+            if line:
+                try:
+                    recipe = _json_loads(line)
+                    recipes.append(recipe)
+                except json.JSONDecodeError as e:
+                    print(f"警告：跳过无效行：{e}")
+                    continue
         
         print(f"加载了 {len(recipes)} 道菜谱")
         print("正在构建向量索引...")
         
-        # 准备文本
-        dish_names = []
-        dish_descriptions = []
+        # 准备文本：菜品名 -> 描述（同名菜品以最后一条为准，位置按首次出现），重复的菜品不重复编码
+        dish_descriptions = {}
         
         for recipe in recipes:
             name = recipe.get('name', '')
             if not name:
                 continue
             
-            # 菜品名称
-            dish_names.append(name)
-            
-            # 菜品描述（综合多个字段）
-            desc_parts = [name]
-            
-            # 添加分类（语义化）
-            category = recipe.get('category', '')
-            if category:
-                category_map = {
-                    'dessert': '甜品',
-                    'main_dish': '主菜',
-                    'soup': '汤',
-                    'condiment': '调味料',
-                    'drink': '饮品',
-                    'staple': '主食',
-                    'appetizer': '凉菜',
-                    'side_dish': '配菜'
-                }
-                category_cn = category_map.get(category, category)
-                desc_parts.append(f"分类：{category_cn}")
-            
-            # 添加标签（重要！用于匹配"快手菜"、"烘焙"等）
-            tags = recipe.get('tags', [])
-            if tags:
-                tags_text = '、'.join(tags)
-                desc_parts.append(f"标签：{tags_text}")
-            
-            # 添加口味（重要！用于匹配"辣"、"甜"等）
-            flavors = recipe.get('flavors', [])
-            if flavors:
-                flavors_text = '、'.join(flavors)
-                desc_parts.append(f"口味：{flavors_text}")
-            
-            # 添加难度（语义化，用于匹配"新手"、"简单"等）
-            difficulty = recipe.get('difficulty')
-            if difficulty:
-                difficulty_map = {
-                    1: "非常简单（新手友好）",
-                    2: "简单（适合新手）",
-                    3: "中等难度",
-                    4: "较难",
-                    5: "高难度"
-                }
-                difficulty_text = difficulty_map.get(difficulty, f"难度{difficulty}")
-                desc_parts.append(f"难度：{difficulty_text}")
-            
-            # 添加菜品描述（重要！包含菜品特点）
-            desc = recipe.get('desc', '')
-            if desc:
-                desc_parts.append(f"简介：{desc}")
-            
-            # 添加食材
-            ingredients = recipe.get('ingredients', [])
-            if ingredients:
-                # 处理新格式：[{"name": "xxx", "amount": "xxx", "is_main": true}, ...]
-                if isinstance(ingredients[0], dict):
-                    ing_names = [ing.get('name', '') for ing in ingredients[:10]]
-                else:
-                    ing_names = ingredients[:10]
-                ing_text = '、'.join(ing_names)
-                desc_parts.append(f"食材：{ing_text}")
-            
-            # 添加调料
-            condiments = recipe.get('condiments', [])
-            if condiments:
-                # 处理新格式：[{"name": "xxx", "amount": "xxx"}, ...]
-                if isinstance(condiments[0], dict):
-                    cond_names = [cond.get('name', '') for cond in condiments[:8]]
-                else:
-                    cond_names = condiments[:8]
-                cond_text = '、'.join(cond_names)
-                desc_parts.append(f"调料：{cond_text}")
-            
-            # 添加烹饪方法
-            method = recipe.get('method', '')
-            if method:
-                desc_parts.append(f"做法：{method}")
-            
-            description = '。'.join(desc_parts)
-            dish_descriptions.append(description)
+            dish_descriptions[name] = _describe_recipe(recipe)
             
             # 保存完整数据
             self.dish_data[name] = recipe
         
-        # 编码向量
-        print("正在编码菜品名称...")
-        name_vectors = self.model.encode(dish_names, show_progress_bar=True, normalize_embeddings=True)
-        
-        print("正在编码菜品描述...")
-        desc_vectors = self.model.encode(dish_descriptions, show_progress_bar=True, normalize_embeddings=True)
+        # 编码向量：名称和描述合并为一次encode（模型内部按长度排序分批，padding最少），再按位置拆分
+        print("正在编码菜品名称和描述...")
+        self.names = list(dish_descriptions)
+        texts = self.names + list(dish_descriptions.values())
+        if cache_path:
+            vectors = self._encode_cached(texts, cache_path)
+        else:
+            vectors = self._encode_texts(texts)
         
-        # 保存向量
-        for name, name_vec, desc_vec in zip(dish_names, name_vectors, desc_vectors):
-            self.dish_vectors[name] = name_vec
-            self.dish_desc_vectors[name] = desc_vec
+        # encode返回的(2N, D)矩阵按行切成两半直接作为向量矩阵（连续切片，不复制）
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.name_matrix = vectors[:len(self.names)]
+        self.desc_matrix = vectors[len(self.names):]
+        self._normalize_matrices()
+        self._quantize_matrices()
         
-        print(f"向量索引构建完成！共 {len(self.dish_vectors)} 道菜品")
+        print(f"向量索引构建完成！共 {len(self.names)} 道菜品")
     
-    def save_index(self, save_path="data/vector_index.pkl"):
-        """保存向量索引"""
-        Path(save_path).parent.mkdir(parents=True, exist_ok=True)
+    def save_index(self, save_path=INDEX_DIR):
+        """
+        保存向量索引（目录）：矩阵按行写成裸二进制（浮点矩阵为float16）供load_index直接mmap，
+        菜品名和量化参数写入index.json，完整菜谱按行写入recipes.jsonl
+        """
+        index_dir = Path(save_path)
+        index_dir.mkdir(parents=True, exist_ok=True)
         
-        data = {
-            'dish_vectors': self.dish_vectors,
-            'dish_desc_vectors': self.dish_desc_vectors,
-            'dish_data': self.dish_data
+        # 先删除index.json：写入过程中断时目录不会被当作完整索引
+        (index_dir / 'index.json').unlink(missing_ok=True)
+        # 每个文件先写临时文件再os.replace：矩阵可能正是从这些文件mmap的（load后再save到同一目录），
+        # 直接覆盖会截断正在读取的文件；替换后旧的映射仍指向原文件内容
+        for file_name, attr, dtype in INDEX_MATRIX_FILES:
+            matrix = np.ascontiguousarray(getattr(self, attr), dtype=dtype)
+            _write_replace(index_dir / file_name, 'wb', matrix.tofile)
+        _write_replace(index_dir / 'recipes.jsonl', 'w', lambda f: f.writelines(
+            json.dumps(self.dish_data.get(name, {}), ensure_ascii=False) + '\n' for name in self.names))
+        # index.json最后写入，存在即表示索引完整
+        meta = {
+            'dim': int(self.desc_matrix.shape[1]) if self.names else 0,
+            'name_scale': self.name_scale,
+            'desc_scale': self.desc_scale,
+            'names': self.names,
         }
+        _write_replace(index_dir / 'index.json', 'w', lambda f: json.dump(meta, f, ensure_ascii=False))
+        
+        print(f"向量索引已保存到：{index_dir}")
+    
+    def load_index(self, load_path=INDEX_DIR):
+        """加载向量索引：矩阵以只读mmap映射（不反序列化、多进程共享页缓存），兼容旧版pickle索引"""
+        index_dir = Path(load_path)
+        if not (index_dir / 'index.json').exists():
+            self._load_pickle(index_dir if index_dir.suffix == '.pkl' else index_dir.with_suffix('.pkl'))
+            return
         
-        with open(save_path, 'wb') as f:
-            pickle.dump(data, f)
+        with open(index_dir / 'index.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.names = meta['names']
+        self.name_scale = meta['name_scale']
+        self.desc_scale = meta['desc_scale']
+        shape = (len(self.names), meta['dim'])
+        for file_name, attr, dtype in INDEX_MATRIX_FILES:
+            path = index_dir / file_name
+            if dtype == np.float16 and not path.exists():
+                path, dtype = path.with_suffix('.f32'), np.float32  # 早期的目录索引以float32存储
+            if shape[0]:
+                matrix = np.asarray(np.memmap(path, dtype=dtype, mode='r', shape=shape))
+            else:
+                matrix = np.empty((0, 0), dtype=dtype)
+            setattr(self, attr, matrix)
+        with open(index_dir / 'recipes.jsonl', 'r', encoding='utf-8') as f:
+            self.dish_data = {name: json.loads(line) for name, line in zip(self.names, f)}
         
-        print(f"向量索引已保存到：{save_path}")
+        print(f"向量索引已加载：{len(self.names)} 道菜品")
     
-    def load_index(self, load_path="data/vector_index.pkl"):
-        """加载向量索引"""
+    def _load_pickle(self, load_path):
+        """加载旧版pickle索引"""
         with open(load_path, 'rb') as f:
             data = pickle.load(f)
         
-        self.dish_vectors = data['dish_vectors']
-        self.dish_desc_vectors = data['dish_desc_vectors']
+        if 'names' in data:
+            self.names = data['names']
+            self.name_matrix = np.ascontiguousarray(data['name_matrix'], dtype=np.float32)
+            self.desc_matrix = np.ascontiguousarray(data['desc_matrix'], dtype=np.float32)
+        else:
+            # 旧格式：{菜品名: 向量}字典
+            self.names = list(data['dish_vectors'])
+            self.name_matrix = np.ascontiguousarray(
+                np.stack([data['dish_vectors'][name] for name in self.names]), dtype=np.float32)
+            self.desc_matrix = np.ascontiguousarray(
+                np.stack([data['dish_desc_vectors'][name] for name in self.names]), dtype=np.float32)
         self.dish_data = data['dish_data']
+        self._normalize_matrices()
+        self._quantize_matrices()
         
-        print(f"向量索引已加载：{len(self.dish_vectors)} 道菜品")
+        print(f"向量索引已加载：{len(self.names)} 道菜品")
     
-    def search(self, query, top_k=10, use_description=True):
+    def search(self, query, top_k=10, use_description=True, precision=None):
         """
         向量检索
         
@@ -202,25 +510,101 @@ class VectorRetriever:
             query: 查询文本
             top_k: 返回Top-K结果
             use_description: 是否使用描述向量（更准确但慢）
+            precision: 'int8'或'fp32'，默认使用初始化时的设置（需要精确分数重排时用'fp32'）
         
         Returns:
-            List[Tuple[str, float]]: [(菜品名, 相似度分数), ...]
+            List[Tuple[str, float]]: [(菜品名, 余弦相似度), ...]
         """
-        # 编码查询
-        query_vector = self.model.encode([query], normalize_embeddings=True)[0]
+        return self.search_batch([query], top_k, use_description, precision)[0]
+    
+    def search_batch(self, queries, top_k=10, use_description=True, precision=None):
+        """
+        批量向量检索：所有查询一次编码（模型内部按长度分批，减少padding；重复查询命中缓存），一次矩阵乘法算出全部相似度
+        
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回Top-K结果
+            use_description: 是否使用描述向量
+            precision: 'int8'或'fp32'，默认使用初始化时的设置（device为'cuda'时始终以float32在GPU上计算）
+        
+        Returns:
+            List[List[Tuple[str, float]]]: 与queries一一对应的检索结果（分数为余弦相似度）
+        """
+        if not queries or not self.names or top_k <= 0:
+            return [[] for _ in queries]
         
-        # 选择向量库
-        vectors_dict = self.dish_desc_vectors if use_description else self.dish_vectors
+        # 编码查询
+        query_vectors = self._encode_queries(list(queries))
         
-        # 计算相似度
-        similarities = []
-        for dish_name, dish_vector in vectors_dict.items():
-            similarity = float(np.dot(query_vector, dish_vector))
-            similarities.append((dish_name, similarity))
+        # 计算相似度（向量已归一化，内积即余弦相似度），每个查询只对Top-K排序
+        if self.device != 'cpu':
+            # GPU：一次矩阵乘法加torch.topk，只把Top-K结果拷回内存
+            queries = torch.from_numpy(query_vectors).to(self.device)
+            scores, rows = torch.topk(queries @ self._gpu_matrix(use_description).T,
+                                      min(top_k, len(self.names)), dim=1)
+            return self._hits(rows.cpu().numpy(), scores.cpu().numpy())
+        elif (precision or self.precision) == 'int8':
+            matrix_i8, scale = ((self.desc_matrix_i8, self.desc_scale) if use_description
+                                else (self.name_matrix_i8, self.name_scale))
+            queries_i8, query_scales = _quantize(query_vectors, axis=1)
+            scores = _int8_dot(matrix_i8, queries_i8) / (scale * query_scales)
+        elif FAISS_AVAILABLE:
+            # FAISS的SIMD内积核在扫描中直接完成Top-K选择（-1表示结果不足）
+            scores, rows = self._faiss_index(use_description).search(query_vectors, min(top_k, len(self.names)))
+            return self._hits(rows, scores)
+        else:
+            scores = query_vectors @ self._fp32_matrix(use_description).T
+        rows = np.stack([_top_k_indices(row, top_k) for row in scores])
+        return self._hits(rows, np.take_along_axis(scores, rows, axis=1))
+    
+    def _hits(self, rows, scores):
+        """
+        把(Q, K)的行号和分数矩阵转成[(菜品名, 分数), ...]列表（行号-1表示结果不足，跳过）
+
+        只为Top-K结果构造元组；tolist()一次转成Python数值，不逐个装箱numpy标量
+        """
+        names = self.names
+        return [
+            [(names[i], score) for i, score in zip(row_ids, row_scores) if i >= 0]
+            for row_ids, row_scores in zip(rows.tolist(), scores.tolist())
+        ]
+    
+    def _fp32_matrix(self, use_description):
+        """fp32检索用的向量矩阵：从索引目录加载的float16矩阵在首次使用时展开为float32并替换"""
+        attr = 'desc_matrix' if use_description else 'name_matrix'
+        matrix = getattr(self, attr)
+        if matrix.dtype != np.float32:
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            setattr(self, attr, matrix)
+        return matrix
+    
+    def _gpu_matrix(self, use_description):
+        """取（必要时上传）向量矩阵在GPU上的float32张量"""
+        matrix = self._fp32_matrix(use_description)
+        cached = self._gpu_matrices.get(use_description)
+        if cached is not None and cached[0] is matrix:
+            return cached[1]
+        tensor = torch.tensor(matrix, dtype=torch.float32, device=self.device)
+        self._gpu_matrices[use_description] = (matrix, tensor)
+        return tensor
+    
+    def _faiss_index(self, use_description):
+        """取（必要时构建）向量矩阵对应的FAISS内积索引"""
+        matrix = self._fp32_matrix(use_description)
+        cached = self._faiss_indexes.get(use_description)
+        if cached is not None and cached[0] is matrix:
+            return cached[1]
         
-        # 排序并返回Top-K
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        return similarities[:top_k]
+        dim = matrix.shape[1]
+        if len(matrix) >= HNSW_MIN_ROWS:
+            index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        else:
+            index = faiss.IndexFlatIP(dim)
+        index.add(np.ascontiguousarray(matrix, dtype=np.float32))
+        self._faiss_indexes[use_description] = (matrix, index)
+        return index
     
     def get_dish_data(self, dish_name):
         """获取菜品完整数据"""
@@ -242,6 +626,13 @@ if __name__ == "__main__":
     # 保存索引
     retriever.save_index()
     
+    # 加载→保存→加载往返校验（矩阵从同一目录mmap时再保存不能破坏索引）
+    names = list(retriever.names)
+    retriever.load_index()
+    retriever.save_index()
+    retriever.load_index()
+    assert retriever.names == names, "向量索引往返保存后菜品名不一致"
+    
     # 测试检索
     test_queries = [
         "我想吃辣的菜",
@@ -0,0 +1,185 @@
+# coding = utf-8
+"""
+共享词表与多模式匹配模块
+偏好提取（preference_extractor）和查询优化（query_optimizer）共用同一份口味/标签/场景词表，
+查询只需一次Aho-Corasick扫描
+"""
+
+import mmap
+import unicodedata
+
+try:
+    from cyac import AC
+    CYAC_AVAILABLE = True
+except ImportError:
+    CYAC_AVAILABLE = False
+
+
+# 偏好提取：口味关键词（规范口味 -> 同义词）
+FLAVOR_KEYWORDS = {
+    '酸': ['酸', '酸味', '酸的', '酸爽', '酸辣'],
+    '甜': ['甜', '甜味', '甜的', '甜品', '甜食'],
+    '苦': ['苦', '苦味', '苦的'],
+    '辣': ['辣', '辣味', '辣的', '麻辣', '香辣', '酸辣', '微辣', '中辣', '特辣', '辛辣'],
+    '咸': ['咸', '咸味', '咸的', '重口味'],
+    '鲜': ['鲜', '鲜味', '鲜美', '鲜香'],
+    '麻': ['麻', '麻味', '麻辣', '花椒'],
+    '香': ['香', '香味', '香的'],
+    '清淡': ['清淡', '淡', '少油', '少盐'],
+}
+
+# 偏好提取：生活习惯/场景标签（规范标签 -> 同义词）
+TAG_KEYWORDS = {
+    '熬夜': ['熬夜', '晚睡', '夜宵', '宵夜'],
+    '加班': ['加班', '工作忙', '没时间'],
+    '健身': ['健身', '锻炼', '运动', '增肌'],
+    '减脂': ['减脂', '减肥', '瘦身', '控制体重', '低卡'],
+    '养生': ['养生', '保健', '滋补', '调理'],
+    '快手': ['快手', '快速', '简单', '方便', '省时', '10分钟', '5分钟'],
+    '宴客': ['宴客', '请客', '聚餐', '招待', '待客'],
+    '便当': ['便当', '带饭', '午餐盒'],
+    '下酒': ['下酒', '喝酒', '配酒'],
+    '早餐': ['早餐', '早饭', '早上吃'],
+    '午餐': ['午餐', '午饭', '中午吃'],
+    '晚餐': ['晚餐', '晚饭', '晚上吃'],
+}
+
+# 偏好提取：常见食材（作为备用，优先使用知识图谱中的）
+INGREDIENT_KEYWORDS = [
+    '鸡肉', '猪肉', '牛肉', '羊肉', '鱼', '虾', '蟹', '鸡蛋', '豆腐',
+    '土豆', '番茄', '黄瓜', '茄子', '青椒', '洋葱', '蒜', '姜',
+    '米饭', '面条', '面粉', '豆芽', '白菜', '菠菜', '芹菜'
+]
+
+# 查询优化（LLM失败时的规则兜底）：场景、口味、标签
+QUERY_SCENES = ["加班", "熬夜", "减肥", "健身", "聚会", "周末", "夜宵"]
+QUERY_FLAVORS = ["辣", "麻辣", "清淡", "酸", "甜", "酸甜", "咸", "鲜"]
+QUERY_TAGS = ["简单", "快手", "下饭", "新手", "家常"]
+
+
+def normalize(text):
+    """
+    文本规范化：全角转半角等兼容字符统一（NFKC）、大小写折叠、去首尾空白
+
+    查询在入口处规范化一次，之后所有扫描都使用规范化后的文本；模式串登记时做同样的规范化
+    """
+    return unicodedata.normalize('NFKC', text).casefold().strip()
+
+
+class KeywordMatcher:
+    """
+    多类别关键词匹配器（cyac双数组trie实现的Aho-Corasick自动机）
+
+    每个模式串对应若干(类别, 规范名, 名次)：名次是该词在原词表中的位置，
+    命中结果按名次排序，与逐个词表遍历时的输出顺序一致
+    """
+
+    def __init__(self, patterns=None, meta=None):
+        self.patterns = patterns if patterns is not None else []  # 模式串，下标即模式id
+        self.meta = meta if meta is not None else []              # 与patterns对应的[(类别, 规范名, 名次)]
+        self._ids = {word: pid for pid, word in enumerate(self.patterns)}
+        self.start_chars = {word[0] for word in self.patterns}  # 所有模式串的首字符
+        self.automaton = None
+        self._buffer = None  # mmap加载时自动机引用的映射，需与匹配器同生命周期
+
+    def add(self, word, category, canonical, rank):
+        """登记一个模式串（同一个词可属于多个类别，规范名保持原样）"""
+        word = normalize(word)
+        if not word:
+            return
+        pid = self._ids.get(word)
+        if pid is None:
+            pid = self._ids[word] = len(self.patterns)
+            self.patterns.append(word)
+            self.meta.append([])
+            self.start_chars.add(word[0])
+        self.meta[pid].append((category, canonical, rank))
+
+    def add_list(self, words, category):
+        """登记一个词表，规范名即词本身"""
+        for rank, word in enumerate(words):
+            self.add(word, category, word, rank)
+
+    def add_synonyms(self, synonyms, category):
+        """登记{规范名: [同义词...]}，名次为(规范名位置, 同义词位置)"""
+        for rank, (canonical, words) in enumerate(synonyms.items()):
+            for word_rank, word in enumerate(words):
+                self.add(word, category, canonical, (rank, word_rank))
+
+    def build(self):
+        """构建自动机（cyac返回的id即模式串在列表中的下标）"""
+        self.automaton = AC.build(self.patterns) if CYAC_AVAILABLE and self.patterns else None
+        return self
+
+    def save_automaton(self, path):
+        """保存自动机二进制（可被load_automaton直接mmap）"""
+        if self.automaton is not None:
+            self.automaton.save(path)
+
+    def load_automaton(self, path):
+        """以只读mmap加载自动机，多个进程共享同一份物理内存页"""
+        if not (CYAC_AVAILABLE and self.patterns):
+            return
+        with open(path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.automaton = AC.from_buff(self._buffer, copy=False)
+
+    def match(self, text):
+        """
+        扫描文本（应已经过normalize），按类别汇总命中的词
+
+        Returns:
+            Dict[str, Dict[str, list]]: 类别 -> {规范名: [最小名次, 命中词1, 命中词2, ...]}
+        """
+        # 查询中没有任何模式串的首字符时不可能命中（如"怎么做"），O(|text|)跳过扫描
+        if self.start_chars.isdisjoint(text):
+            return {}
+        if self.automaton is not None:
+            pids = {pid for pid, _, _ in self.automaton.match(text)}
+        else:
+            pids = [pid for pid, word in enumerate(self.patterns) if word in text]
+
+        hits = {}
+        for pid in pids:
+            word = self.patterns[pid]
+            for category, canonical, rank in self.meta[pid]:
+                bucket = hits.setdefault(category, {})
+                entry = bucket.get(canonical)
+                if entry is None:
+                    bucket[canonical] = [rank, word]
+                else:
+                    entry[0] = min(entry[0], rank)
+                    entry.append(word)
+        return hits
+
+    def scan(self, text):
+        """
+        扫描文本（应已经过normalize）
+
+        Returns:
+            Dict[str, List[str]]: 类别 -> 命中的规范名（按原词表顺序）
+        """
+        return {
+            category: sorted(bucket, key=lambda name: bucket[name][0])
+            for category, bucket in self.match(text).items()
+        }
+
+
+def _build_static_matcher():
+    matcher = KeywordMatcher()
+    matcher.add_synonyms(FLAVOR_KEYWORDS, 'flavor_kw')
+    matcher.add_synonyms(TAG_KEYWORDS, 'tag_kw')
+    matcher.add_list(INGREDIENT_KEYWORDS, 'ingredient_kw')
+    matcher.add_list(QUERY_SCENES, 'scene')
+    matcher.add_list(QUERY_FLAVORS, 'query_flavor')
+    matcher.add_list(QUERY_TAGS, 'query_tag')
+    return matcher.build()
+
+
+# 静态词表的共享匹配器（导入时构建一次）
+STATIC_MATCHER = _build_static_matcher()
+
+
+def scan(query):
+    """用静态词表扫描查询（应已经过normalize），返回{类别: [规范名...]}"""
+    return STATIC_MATCHER.scan(query)